@@ -1,39 +1,128 @@
 # Import packages
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+import importlib
 import os
 
-IMG_DIR = "images" 
-os.makedirs(IMG_DIR, exist_ok=True)
+from cache import cached_frame, sources_name
+from compact import compact_frame, join_themes, plain_merge
+from cube import as_cube, build_cube
+from density import size_distribution
+from leaderboard import Leaderboard, top_series
+from search import NameIndex, cached_index
+from sketch import SizeSketches
+from yearindex import YearIndex
 
 
+class _LazyModule:
+    """Stand-in for a module that is imported the first time one of its attributes is used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# The plotting stack is only needed by the plot_* functions; importing it lazily
+# keeps numbers-only runs from paying for matplotlib and seaborn
+plt = _LazyModule('matplotlib.pyplot')
+sns = _LazyModule('seaborn')
+
+IMG_DIR = "images" # Created by the plot_* functions when they first save into it
+
+# Set by render.render_chart() to keep charts in memory: called with the
+# finished figure and its file name instead of writing the PNG into IMG_DIR
+figure_sink = None
+
+# Input locations, overridable through the environment
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('LEGO_DATA_DIR', BASE_DIR)
+SETS_CSV = os.environ.get('LEGO_SETS_CSV', os.path.join(DATA_DIR, 'lego_sets.csv'))
+THEMES_CSV = os.environ.get('LEGO_THEMES_CSV', os.path.join(DATA_DIR, 'parent_themes.csv'))
+CACHE_DIR = os.environ.get('LEGO_CACHE_DIR', os.path.join(BASE_DIR, '.lego_cache'))
+
+
+def save_plot(filename):
+    """Save the current figure as filename in IMG_DIR (or hand it to figure_sink) and close it."""
+    plt.tight_layout()
+    if figure_sink is not None:
+        figure_sink(plt.gcf(), filename)
+    else:
+        os.makedirs(IMG_DIR, exist_ok=True)
+        plt.savefig(os.path.join(IMG_DIR, filename), bbox_inches='tight')
+    plt.close()
+
+
+def merge_data(lego_sets, parent_themes):
+    """Merge the LEGO sets data with the parent themes data based on the 'parent_theme' column
+
+    The result is in the compact representation of compact.py: theme columns
+    are categoricals and the theme attributes are looked up by code."""
+    if parent_themes['name'].is_unique:
+        return join_themes(lego_sets, parent_themes)
+    return compact_frame(plain_merge(lego_sets, parent_themes))
+
 # Read data from CSV files into pandas DataFrames
-def load_data():
-    """Load and merge LEGO set data with parent theme data. Returns the merged DataFrame."""
-    lego_sets = pd.read_csv('/Users/viragnemeth/Projects/Python/LEGO_analysis/lego_sets.csv')
-    parent_themes = pd.read_csv('/Users/viragnemeth/Projects/Python/LEGO_analysis/parent_themes.csv')
+def load_data(sets_path=None, themes_path=None, use_cache=True, cache_dir=None):
+    """Load and merge LEGO set data with parent theme data. Returns the merged DataFrame.
+
+    The merged frame is kept in a columnar cache under cache_dir (CACHE_DIR by
+    default), one per pair of input files, and rebuilt automatically when
+    either CSV changes.
+    """
+    sets_path = sets_path or SETS_CSV
+    themes_path = themes_path or THEMES_CSV
+
+    def build():
+        return merge_data(pd.read_csv(sets_path), pd.read_csv(themes_path))
+
+    if not use_cache:
+        return build()
+    return cached_frame(sources_name('merged', [sets_path, themes_path]), [sets_path, themes_path], build,
+                        cache_dir or CACHE_DIR)
+
+def load_name_index(sets_path=None, themes_path=None, use_cache=True, cache_dir=None):
+    """The n-gram name index (search.NameIndex) over the merged catalog, for fuzzy set name search.
+
+    Cached next to the merged frame and rebuilt when either CSV changes."""
+    sets_path = sets_path or SETS_CSV
+    themes_path = themes_path or THEMES_CSV
+
+    def build():
+        return NameIndex.build(load_data(sets_path, themes_path, use_cache, cache_dir))
 
-    # Merge the LEGO sets data with the parent themes data based on the 'parent_theme' column
-    merged = lego_sets.merge(parent_themes, how= 'inner', left_on = 'parent_theme', right_on='name', suffixes=('_ls', '_pt'))
-    return merged
+    if not use_cache:
+        return build()
+    return cached_index(sources_name('names', [sets_path, themes_path]), [sets_path, themes_path], build,
+                        cache_dir or CACHE_DIR)
+
+def build_year_index(merged):
+    """Year x parent theme prefix sums (yearindex.YearIndex) for year-range, rolling and growth queries"""
+    return YearIndex.from_cube(as_cube(merged))
+
+def build_leaderboard(merged, level='parent_theme'):
+    """Per-year and cumulative ranking of parent themes or sub-themes (level 'theme_name'), see leaderboard.Leaderboard"""
+    return Leaderboard.from_cube(as_cube(merged), level)
 
 def calc_star_wars_percentage(merged):
     """What percentage of all licensed sets ever released were Star Wars themed?"""
-    licensed = merged[merged['is_licensed'] == True] # Filter out only licensed sets
-    star_wars = licensed[licensed['parent_theme'] == 'Star Wars'] # Filter Star Wars licensed sets
-    the_force = round((len(star_wars) / len(licensed)) * 100, 2)  # Calculate the percentage of Star Wars themed sets
+    cube = as_cube(merged)
+    licensed = cube.where(is_licensed=True) # Filter out only licensed sets
+    star_wars = licensed.where(parent_theme='Star Wars') # Filter Star Wars licensed sets
+    the_force = round((star_wars.total() / licensed.total()) * 100, 2)  # Calculate the percentage of Star Wars themed sets
     return the_force, star_wars
 
 def calc_peak_star_wars_year(star_wars):
     """In which year was the highest number of Star Wars sets released?"""
-    new_era = int(star_wars.groupby('year').size().sort_values(ascending=False).index[0])
+    new_era = int(as_cube(star_wars).top('year', 'rows', 1).index[0])
     return new_era
 
 def plot_sets_over_time(merged):
     """How has the number of LEGO sets released changed over time?"""
-    sets_yearly = merged.groupby('year').size().reset_index(name='count')
+    sets_yearly = as_cube(merged).totals('year').reset_index(name='count')
 
     # Plot the number of LEGO sets released over time (line plot)
     sns.set_style("whitegrid")
@@ -47,16 +136,11 @@ def plot_sets_over_time(merged):
     plt.grid(True, linestyle="--", alpha=0.5)
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "sets_over_time.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("sets_over_time.png")
 
-def calc_top_themes_by_set_count(merged):
-    """What are the top 5 most common parent themes in terms of the number of sets released?"""
-    themes_by_set = merged.groupby('parent_theme')['set_num'].count().sort_values(ascending=False).reset_index().head(5)
+def calc_top_themes_by_set_count(merged, top=5):
+    """What are the top 5 (or top) most common parent themes in terms of the number of sets released?"""
+    themes_by_set = as_cube(merged).top('parent_theme', 'sets', top).rename('set_num').reset_index()
     return themes_by_set
 
 def plot_top_themes(themes_by_set):
@@ -72,18 +156,14 @@ def plot_top_themes(themes_by_set):
     plt.grid(True, linestyle="--", alpha=0.5)
 
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "top_themes.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("top_themes.png")
 
 def calc_licensed_percentage(merged):
     """What percentage of all LEGO sets are from licensed themes?"""
-    prop_licensed = int((merged[merged['is_licensed'] == True].shape[0] / merged.shape[0]) * 100)
+    cube = as_cube(merged)
+    prop_licensed = int((cube.where(is_licensed=True).total() / cube.total()) * 100)
     #print(f"{prop_licensed}% of the LEGO sets are licensed.")
-    licensed_counts = merged['is_licensed'].value_counts().to_list()
+    licensed_counts = cube.totals('is_licensed').sort_values(ascending=False).to_list()
     return licensed_counts, prop_licensed
 
 def plot_licenses_percentage(licensed_counts):
@@ -93,17 +173,12 @@ def plot_licenses_percentage(licensed_counts):
     plt.title('Percentage of Licensed vs. Non-Licensed LEGO Sets', fontsize=14, fontweight='bold', pad=15)
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "licensed_percentage.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("licensed_percentage.png")
 
-def calc_licensed_highest_sets(merged):
+def calc_licensed_highest_sets(merged, top=10):
     """Which licensed themes have the highest number of sets?"""
-    licensed = merged[merged['is_licensed'] == True]
-    licensed_themes = licensed.groupby('parent_theme')['set_num'].count().sort_values(ascending=False).reset_index().head(10)
+    licensed = as_cube(merged).where(is_licensed=True)
+    licensed_themes = licensed.top('parent_theme', 'sets', top).rename('set_num').reset_index()
     return licensed_themes
 
 def plot_licensed_highest_sets(licensed_themes):
@@ -120,26 +195,19 @@ def plot_licensed_highest_sets(licensed_themes):
     plt.grid(True, linestyle="--", alpha=0.5)
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "licensed_highest.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("licensed_highest.png")
 
-def calc_set_count_for_top_themes(merged):
-    """How has the number of sets of the top 5 parent themes changed over time?"""
-    themes_by_set_year = merged.groupby(['parent_theme', 'year'])['set_num'].count().reset_index().sort_values(by=['year', 'set_num'], ascending=[True, False])
+def calc_set_count_for_top_themes(merged, top=5):
+    """How has the number of sets of the top 5 (or top) parent themes changed over time?"""
+    cube = as_cube(merged)
 
-    # Add a new column to hold the total number of sets for each parent theme
-    themes_by_set_year['theme_count'] = themes_by_set_year.groupby('parent_theme')['set_num'].transform('sum')
+    # Extract the top 5 themes by their total number of sets
+    theme_count = cube.top('parent_theme', 'sets', top)
+    top_5_themes_data = (cube.where(parent_theme=theme_count.index).totals(['parent_theme', 'year'], 'sets')
+                         .rename('set_num').reset_index().sort_values(by=['year', 'set_num'], ascending=[True, False]))
 
-    # Sort data by theme count and year
-    sorted_df = themes_by_set_year.sort_values(by=['theme_count', 'year'], ascending=[False, True])
-
-    # Extract the top 5 themes
-    top_5_themes = themes_by_set_year['parent_theme'].unique()[:5]
-    top_5_themes_data = themes_by_set_year[themes_by_set_year['parent_theme'].isin(top_5_themes)]
+    # Add a column holding the total number of sets of each parent theme
+    top_5_themes_data['theme_count'] = top_5_themes_data['parent_theme'].map(theme_count)
     return top_5_themes_data
 
 def plot_set_count_for_top_themes(top_5_themes_data):
@@ -159,19 +227,15 @@ def plot_set_count_for_top_themes(top_5_themes_data):
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "top5_trends.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("top5_trends.png")
 
 def calc_licensed_non_licensed_sets(merged):
     """What are the trends in licensed vs. non-licensed LEGO sets over the years? (Stacked Bar Chart or Line Chart)"""
-    licensed_trends = merged.groupby(['year', 'is_licensed'])['set_num'].count().reset_index()
+    licensed_trends = as_cube(merged).totals(['year', 'is_licensed'], 'sets').rename('set_num').reset_index()
 
     # Pivot the data to create a stacked bar chart
     licensed_trends_pivot = licensed_trends.pivot(index='year', columns='is_licensed', values='set_num')
+    licensed_trends_pivot = licensed_trends_pivot.reindex(columns=[False, True], fill_value=0) # Both, even if a filter left one out
     licensed_trends_pivot.columns = ['Non-Licensed', 'Licensed']
     return licensed_trends_pivot
 
@@ -189,39 +253,68 @@ def plot_licensed_non_licensed_sets(licensed_trends_pivot):
     plt.grid(True, linestyle="--", alpha=0.5)
     plt.tight_layout()
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "licensed_trend.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
-
-def box_plot_set_comparison_licensed_non_licensed(merged):
-    """Do licensed LEGO sets tend to have more parts compared to non-licensed ones?"""
+    save_plot("licensed_trend.png")
+
+def weighted_quantile(values, weights, q):
+    """Quantile of values repeated weights times, with the same linear interpolation as Series.quantile"""
+    order = np.argsort(values, kind='stable')
+    values = np.asarray(values, dtype=float)[order]
+    cum = np.cumsum(np.asarray(weights)[order])
+    pos = q * (cum[-1] - 1)
+    lo = values[np.searchsorted(cum, np.floor(pos), side='right')]
+    hi = values[np.searchsorted(cum, np.ceil(pos), side='right')]
+    return lo + (hi - lo) * (pos - np.floor(pos))
+
+def calc_size_sketches(merged):
+    """Quantile sketches of num_parts overall and per licensed flag, parent theme and year (sketch.SizeSketches)
+
+    Also accepts the weighted part counts from streaming.stream_aggregates(),
+    which only have the licensed flag to group by."""
+    return SizeSketches().add(merged)
+
+def calc_set_size_comparison(sketches):
+    """Do licensed LEGO sets tend to have more parts compared to non-licensed ones?
+
+    Returns the box plot statistics of both groups and the 95th percentile of
+    all set sizes, taken from the quantile sketches."""
+    stats = [sketch.box_stats(str(flag)) for flag, sketch in sorted(sketches.groups['is_licensed'].items())]
+    return stats, sketches.overall.quantile(0.95)
+
+def box_plot_set_comparison_licensed_non_licensed(comparison):
+    """Plot the set sizes of licensed and non-licensed sets (box plot) from calc_set_size_comparison()"""
+    stats, top = comparison
     plt.figure(figsize=(8, 6))
-    sns.boxplot(data=merged, x='is_licensed', y='num_parts', palette='pastel')
+    line = {'color': '0.42'}
+    boxes = plt.gca().bxp(stats, positions=range(len(stats)), patch_artist=True, widths=0.8,
+                          boxprops={'edgecolor': '0.42'}, whiskerprops=line, capprops=line, medianprops=line,
+                          flierprops={'markeredgecolor': '0.42'})
+    for patch, colour in zip(boxes['boxes'], sns.color_palette('pastel', desat=0.75)):
+        patch.set_facecolor(colour)
     plt.title('Licensed vs. Non-Licensed Set Sizes')
     plt.xlabel('Is Licensed')
     plt.ylabel('Number of Parts')
-    plt.ylim(0, merged['num_parts'].quantile(0.95))
+    plt.ylim(0, top)
     plt.grid(True, linestyle='--', alpha=0.5)
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "boxplot_comparison.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("boxplot_comparison.png")
+
+def rank_parent_themes(merged, top=None):
+    """Number of sets per parent theme, most common first (value_counts order); only the top ones if top is given"""
+    return as_cube(merged).top('parent_theme', 'rows', top)
+
+def calc_subthemes_top_3_parent_themes(merged, ranking=None, top=3):
+    """What are the most common sub-themes within the top 3 (or top) parent themes?
 
-def calc_subthemes_top_3_parent_themes(merged):
-    """What are the most common sub-themes within the top 3 parent themes?"""
-    top3_themes = merged['parent_theme'].value_counts().head(3).index.tolist()
-    top3_data = merged[merged['parent_theme'].isin(top3_themes)]
+    ranking (from rank_parent_themes) can be passed in when it is already computed."""
+    cube = as_cube(merged)
+    ranking = rank_parent_themes(cube, top) if ranking is None else ranking
+    top3_themes = top_series(ranking, top).index.tolist()
+    top3_data = cube.where(parent_theme=top3_themes)
 
     # Calculate the count of sets for each sub-theme within the top 3 themes
-    subtheme_counts = (top3_data.groupby(['parent_theme', 'theme_name'])['set_num'].count().reset_index(name='set_count'))
+    subtheme_counts = (top3_data.totals(['parent_theme', 'theme_name'], 'sets').reset_index(name='set_count'))
     return subtheme_counts
 
 def plot_subthemes_top_3_parent_themes(subtheme_counts):
@@ -238,25 +331,39 @@ def plot_subthemes_top_3_parent_themes(subtheme_counts):
     plt.legend(title='Parent Theme')
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "subthemes_top3.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("subthemes_top3.png")
 
-def calc_distribution_set_sizes(merged):
-    """What is the distribution of set sizes (number of parts) across all sets?"""
+def calc_distribution_set_sizes(merged, sketches=None):
+    """What is the distribution of set sizes (number of parts) across all sets?
+
+    Returns the histogram and binned density curve as a density.SizeDistribution,
+    cut at the 95th percentile from sketches (calc_size_sketches) when given.
+    Also accepts weighted part counts (streaming.stream_aggregates(),
+    store.SqlCube.part_counts()); both are reduced to the number of sets per
+    part count first, so either input gives the same result."""
     if 'num_parts' in merged.columns:
         merged_df = merged.dropna(subset=['num_parts']) # Drop rows with missing 'num_parts' values
     else:
         raise ValueError("'num_parts' column not found in the merged dataset.")
-    return merged_df
+    weights = merged_df['weight'] if 'weight' in merged_df.columns else None
+    if sketches is not None:
+        xmax = sketches.overall.quantile(0.95)
+    elif weights is not None:
+        xmax = weighted_quantile(merged_df['num_parts'], weights, 0.95)
+    else:
+        xmax = merged_df['num_parts'].quantile(0.95)
+    sizes = merged_df.groupby('num_parts')['weight'].sum() if weights is not None else merged_df.groupby('num_parts').size()
+    return size_distribution(sizes.index.to_numpy(dtype=float), sizes.to_numpy(dtype=float), xmax)
 
-def plot_distribution_set_sizes(merged_df):
-    """Plot the distribution of set sizes (histogram with KDE)"""
+def plot_distribution_set_sizes(distribution):
+    """Plot the distribution of set sizes (histogram with KDE) from calc_distribution_set_sizes()"""
     plt.figure(figsize=(12, 6))
-    sns.histplot(data=merged_df, x='num_parts', bins=50, kde=True, color='#0f392b')
+    edges = distribution.edges
+    bars = pd.DataFrame({'num_parts': (edges[:-1] + edges[1:]) / 2, 'sets': distribution.counts})
+    sns.histplot(data=bars, x='num_parts', weights='sets', bins=len(bars), binrange=(edges[0], edges[-1]),
+                 color='#0f392b', alpha=0.5) # histplot's lighter bars when it draws a KDE
+    if distribution.curve is not None:
+        plt.plot(distribution.grid, distribution.curve, color='#0f392b')
 
     plt.title('Distribution of LEGO Set Sizes (Number of Parts)', fontsize=14, fontweight='bold', pad=15)
     plt.xlabel('Number of Parts', fontweight='bold')
@@ -264,21 +371,15 @@ def plot_distribution_set_sizes(merged_df):
     plt.yticks(range(0,5500,500))
     plt.xticks(range(0,700,50))
     plt.grid(True, linestyle='--', alpha=0.5)
-    plt.xlim(0, merged_df['num_parts'].quantile(0.95))
+    plt.xlim(0, distribution.xmax)
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "distribution_set_sizes.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("distribution_set_sizes.png")
 
 def calc_top_new_theme_year(merged):
     """Which year had the highest number of new themes introduced?"""
-    new_themes = merged.drop_duplicates(subset=['parent_theme', 'year'])  # Remove duplicates by year and theme
-    themes_per_year = new_themes.groupby('year')['parent_theme'].nunique().reset_index(name='new_themes')
+    themes_per_year = as_cube(merged).distinct('year', 'parent_theme').reset_index(name='new_themes')
     highest_num_themes = themes_per_year.sort_values(by='new_themes', ascending=False).head(1)
     #print(highest_num_themes)
     return highest_num_themes, themes_per_year
@@ -296,18 +397,17 @@ def plot_top_new_theme_year(themes_per_year):
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "top_new_themes_year.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("top_new_themes_year.png")
+
+def calc_set_compexity_top_themes(merged, ranking=None, top=5):
+    """What are the trends in LEGO set complexity (average number of parts) for the top 5 (or top) themes over time?
 
-def calc_set_compexity_top_themes(merged):
-    """What are the trends in LEGO set complexity (average number of parts) for the top 5 themes over time?"""
-    top5_themes = merged['parent_theme'].value_counts().head(5).index
-    top5_data = merged[merged['parent_theme'].isin(top5_themes)]
-    avg_parts_trend = top5_data.groupby(['year', 'parent_theme'])['num_parts'].mean().reset_index()
+    ranking (from rank_parent_themes) can be passed in when it is already computed."""
+    cube = as_cube(merged)
+    ranking = rank_parent_themes(cube, top) if ranking is None else ranking
+    top5_themes = top_series(ranking, top).index
+    top5_data = cube.where(parent_theme=top5_themes).totals(['year', 'parent_theme'], ['parts_sum', 'parts_count'])
+    avg_parts_trend = (top5_data['parts_sum'] / top5_data['parts_count']).rename('num_parts').reset_index()
     return avg_parts_trend
 
 def plot_set_complexity_top_themes(avg_parts_trend):
@@ -324,16 +424,12 @@ def plot_set_complexity_top_themes(avg_parts_trend):
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "set_complexity_top_themes.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("set_complexity_top_themes.png")
 
 def calc_theme_set_complexity_corr(merged):
     """How does the number of sets per theme correlate with the number of parts per set?"""
-    theme_stats = merged.groupby('parent_theme').agg(total_sets=('set_num', 'count'),avg_parts=('num_parts', 'mean')).reset_index()
+    totals = as_cube(merged).totals('parent_theme', ['sets', 'parts_sum', 'parts_count'])
+    theme_stats = pd.DataFrame({'total_sets': totals['sets'], 'avg_parts': totals['parts_sum'] / totals['parts_count']}).reset_index()
     return theme_stats
 
 def plot_theme_set_complexity_corr(theme_stats):
@@ -351,10 +447,5 @@ def plot_theme_set_complexity_corr(theme_stats):
     plt.tight_layout()
     
     # Save plot 
-    if not os.path.exists(IMG_DIR):
-        os.makedirs(IMG_DIR)
-    path = os.path.join(IMG_DIR, "theme_set_complexity_corr.png")
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+    save_plot("theme_set_complexity_corr.png")
 
@@ -0,0 +1,154 @@
+# Build the report for many catalog snapshots over a shared pool of worker processes
+#
+# A manifest is a JSON list of jobs, one per snapshot:
+#   [{"name": "de-2024-05", "sets": "exports/de/lego_sets.csv",
+#     "themes": "exports/de/parent_themes.csv", "output": "reports/de-2024-05.pdf"}, ...]
+# Relative paths are relative to the manifest. "themes" defaults to the
+# configured THEMES_CSV; "sections" and "chunksize" are passed on to report.main().
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from profiling import peak_rss
+
+# One report to build
+Job = namedtuple('Job', ['name', 'sets', 'themes', 'output', 'sections', 'chunksize'])
+
+# What became of a job: ok is False when it failed, with the exception in
+# error. peak_rss_bytes is the peak of the worker process that ran it so far.
+JobResult = namedtuple('JobResult', ['name', 'output', 'ok', 'seconds', 'cpu_seconds', 'peak_rss_bytes', 'error'])
+
+# Jobs a worker process builds before it is replaced by a fresh one
+DEFAULT_TASKS_PER_WORKER = 20
+
+
+def read_manifest(path):
+    """The jobs of a manifest file; raises ValueError for malformed entries."""
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: the manifest must be a JSON list of jobs")
+
+    base = os.path.dirname(os.path.abspath(path))
+    resolve = lambda p: p if p is None else os.path.join(base, p)
+    jobs = []
+    for i, entry in enumerate(entries):
+        missing = {'sets', 'output'} - set(entry)
+        if missing:
+            raise ValueError(f"{path}: job {i} lacks {', '.join(sorted(missing))}")
+        jobs.append(Job(entry.get('name') or os.path.splitext(os.path.basename(entry['output']))[0],
+                        resolve(entry['sets']), resolve(entry.get('themes')), resolve(entry['output']),
+                        entry.get('sections'), entry.get('chunksize')))
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"{path}: duplicate job names: {', '.join(duplicates)}")
+    return jobs
+
+
+def _init_worker(max_memory):
+    """Import and set up everything a report needs once per worker, then cap its address space."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    import report  # noqa: F401 (imported for its imports: pandas, fpdf, analysis, ...)
+    from render import CHART_STYLE
+
+    # Load the font list and draw one throwaway figure so the first job does not pay for it
+    sns.set_style(CHART_STYLE)
+    plt.figure()
+    plt.close()
+
+    if max_memory and resource is not None:
+        # Allocations beyond the cap raise MemoryError in the job instead of
+        # the kernel killing the worker (and the pool with it)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def run_job(job, profile, use_cache):
+    """Build one report in this process; never raises, failures come back as a JobResult."""
+    import report
+    from profiling import Tracer
+
+    start, cpu = time.perf_counter(), time.process_time()
+    error = None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report.main(workers=1, output_pdf=job.output, use_cache=use_cache, chunksize=job.chunksize,
+                        tracer=Tracer(enabled=False), only=job.sections, profile=profile,
+                        sets_path=job.sets, themes_path=job.themes)
+    except Exception:
+        error = traceback.format_exc(limit=-3).strip()
+    return JobResult(job.name, job.output, error is None, time.perf_counter() - start,
+                     time.process_time() - cpu, peak_rss(), error)
+
+
+def run_batch(jobs, workers=None, profile=None, use_cache=True, max_memory=None,
+              tasks_per_worker=DEFAULT_TASKS_PER_WORKER, on_result=None):
+    """Build the reports of jobs over a pool of worker processes; returns a JobResult per job, in order.
+
+    Workers keep their imports, fonts and plotting setup across jobs and are
+    replaced after tasks_per_worker jobs so memory held on to by one job does
+    not pile up. max_memory (bytes) caps the address space of each worker.
+    A failing job is reported and the rest of the batch carries on. A worker
+    dying outright (e.g. killed for memory) breaks the pool: the jobs that
+    had not finished are run once more on a fresh pool, and reported as
+    failed if that breaks too. on_result, if given, is called with each
+    JobResult as it completes.
+    """
+    from render import DEFAULT_PROFILE, default_workers
+
+    workers = default_workers() if workers is None else (workers or os.cpu_count() or 1)
+    profile = profile or DEFAULT_PROFILE
+    # Worker recycling needs processes that are not forked
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+    results = {}
+    pending = list(jobs)
+    for attempt in range(2):
+        broken = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)) or 1, mp_context=context,
+                                 initializer=_init_worker, initargs=(max_memory,),
+                                 max_tasks_per_child=tasks_per_worker) as pool:
+            futures = {pool.submit(run_job, job, profile, use_cache): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    if attempt == 0:
+                        broken.append(job)
+                        continue
+                    result = JobResult(job.name, job.output, False, None, None, None, f"worker process died: {e}")
+                results[job.name] = result
+                if on_result:
+                    on_result(result)
+        pending = broken
+        if not pending:
+            break
+    return [results[job.name] for job in jobs]
+
+
+def format_result(result):
+    """One line of the batch summary."""
+    seconds = f"{result.seconds:8.2f} s" if result.seconds is not None else f"{'-':>10}"
+    rss = f"{result.peak_rss_bytes / 2**20:8.1f} MiB" if result.peak_rss_bytes else f"{'-':>12}"
+    status = 'ok' if result.ok else 'FAILED'
+    detail = result.output if result.ok else result.error.splitlines()[-1]
+    return f"{result.name[:32]:<32} {status:<7} {seconds} {rss}  {detail}"
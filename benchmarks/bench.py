@@ -0,0 +1,204 @@
+# Benchmark harness: times and memory-profiles each stage of the pipeline on synthetic catalogs
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import matplotlib  # noqa: E402
+matplotlib.use('Agg')
+warnings.filterwarnings('ignore', category=FutureWarning)  # seaborn palette deprecations, once per plot
+
+import pandas as pd  # noqa: E402
+
+import analysis  # noqa: E402
+from analysis import THEMES_CSV, build_cube, load_data  # noqa: E402
+from render import render_chart  # noqa: E402
+from search import NameIndex  # noqa: E402
+from store import ingest, open_store  # noqa: E402
+from streaming import stream_aggregates  # noqa: E402
+from synth import parse_rows, write_catalog  # noqa: E402
+
+CALCS = ['calc_star_wars_percentage', 'calc_top_themes_by_set_count', 'calc_licensed_percentage',
+         'calc_licensed_highest_sets', 'calc_set_count_for_top_themes', 'calc_licensed_non_licensed_sets',
+         'calc_subthemes_top_3_parent_themes', 'calc_top_new_theme_year', 'calc_set_compexity_top_themes',
+         'calc_theme_set_complexity_corr']
+
+# A stage only counts as regressed when it is both this much slower
+# (relative) and at least MIN_DELTA seconds slower than the baseline
+DEFAULT_THRESHOLD = 0.25
+MIN_DELTA = 0.005
+
+
+def measure(fn, repeat):
+    """Best wall time over `repeat` runs, then the tracemalloc peak of one extra run."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}, result
+
+
+def sqlite_stages(sets_path, cache_dir):
+    """The calc stages again on the SQLite backend, after ingesting the catalog."""
+    state = {}
+
+    def ingest_db():
+        path = os.path.join(cache_dir, 'bench.sqlite')
+        if os.path.exists(path):
+            os.remove(path)
+        return ingest(path, sets_path, THEMES_CSV)
+    yield 'sqlite.ingest', ingest_db
+
+    open_store(sets_path, THEMES_CSV, cache_dir).close()  # Ingest into the cache outside the timings
+
+    def open_cube():
+        state['cube'] = open_store(sets_path, THEMES_CSV, cache_dir).cube()
+        return state['cube']
+    yield 'sqlite.open', open_cube
+
+    for name in CALCS:
+        yield f'sqlite.calc.{name}', lambda name=name: getattr(analysis, name)(state['cube'])
+    yield 'sqlite.calc.calc_peak_star_wars_year', lambda: analysis.calc_peak_star_wars_year(
+        analysis.calc_star_wars_percentage(state['cube'])[1])
+
+    def part_counts():
+        state['parts'] = state['cube'].part_counts()
+        return state['parts']
+    yield 'sqlite.part_counts', part_counts
+    yield 'sqlite.calc.calc_size_sketches', lambda: analysis.calc_size_sketches(state['parts'])
+    yield 'sqlite.calc.calc_distribution_set_sizes', lambda: analysis.calc_distribution_set_sizes(state['parts'])
+
+
+def stages(sets_path, cache_dir, plots=True, chunksize=None):
+    """Yield (stage name, callable) in pipeline order; later stages reuse earlier results."""
+    state = {}
+
+    def load_csv():
+        state['merged'] = load_data(sets_path, THEMES_CSV, use_cache=False)
+        return state['merged']
+    yield 'load_csv', load_csv
+
+    load_data(sets_path, THEMES_CSV, cache_dir=cache_dir)  # Populate the cache outside the timings
+    yield 'load_cached', lambda: load_data(sets_path, THEMES_CSV, cache_dir=cache_dir)
+
+    def cube():
+        state['cube'] = build_cube(state['merged'])
+        return state['cube']
+    yield 'build_cube', cube
+
+    if chunksize:
+        yield 'stream_aggregates', lambda: stream_aggregates(sets_path, THEMES_CSV, chunksize)
+
+    for name in CALCS:
+        yield f'calc.{name}', lambda name=name: getattr(analysis, name)(state['cube'])
+    yield 'calc.calc_peak_star_wars_year', lambda: analysis.calc_peak_star_wars_year(
+        analysis.calc_star_wars_percentage(state['cube'])[1])
+    yield 'calc.calc_size_sketches', lambda: analysis.calc_size_sketches(state['merged'])
+    yield 'calc.build_year_index', lambda: analysis.build_year_index(state['cube'])
+    yield 'calc.build_leaderboard', lambda: analysis.build_leaderboard(state['cube'], 'theme_name')
+    yield 'calc.calc_distribution_set_sizes', lambda: analysis.calc_distribution_set_sizes(state['merged'])
+
+    def name_index():
+        state['names'] = NameIndex.build(state['merged'])
+        return state['names']
+    yield 'search.build_name_index', name_index
+    yield 'search.search', lambda: state['names'].search('milenium falcon')
+    yield 'search.similar', lambda: state['names'].similar(state['names'].search('millennium falcon', 1).set_num[0])
+
+    if plots:
+        import report
+        for spec in report.chart_specs(report.build_sections(state['merged'], state['cube'])):
+            yield f'plot.{spec.plot}', lambda spec=spec: render_chart(spec)
+
+
+def run(sizes, seed=0, repeat=3, plots=True, chunksize=None, sqlite=False):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='lego-bench-')
+    img_dir = analysis.IMG_DIR
+    analysis.IMG_DIR = os.path.join(workdir, 'images')  # Keep the repository's images/ untouched
+    try:
+        for rows in sizes:
+            sets_path = write_catalog(rows, seed)
+            cache_dir = os.path.join(workdir, f'cache-{rows}')
+            results[str(rows)] = {}
+            pipeline = stages(sets_path, cache_dir, plots, chunksize)
+            if sqlite:
+                pipeline = itertools.chain(pipeline, sqlite_stages(sets_path, cache_dir))
+            for name, fn in pipeline:
+                results[str(rows)][name], _ = measure(fn, repeat)
+                print(f"{rows:>10} {name:<52} {results[str(rows)][name]['seconds'] * 1000:10.1f} ms "
+                      f"{results[str(rows)][name]['peak_bytes'] / 2**20:9.1f} MiB", flush=True)
+    finally:
+        analysis.IMG_DIR = img_dir
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'meta': {'seed': seed, 'repeat': repeat, 'python': platform.python_version(),
+                 'pandas': pd.__version__, 'machine': platform.machine(), 'time': time.time()},
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Stages that got slower than the baseline by more than threshold. Returns a list of messages."""
+    regressions = []
+    for rows, stages_ in current['results'].items():
+        for name, now in stages_.items():
+            before = baseline.get('results', {}).get(rows, {}).get(name)
+            if before is None:
+                continue
+            slower = now['seconds'] - before['seconds']
+            if now['seconds'] > before['seconds'] * (1 + threshold) and slower > MIN_DELTA:
+                regressions.append(f"{rows} rows, {name}: {before['seconds'] * 1000:.1f} ms -> "
+                                   f"{now['seconds'] * 1000:.1f} ms (+{slower / before['seconds']:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LEGO analysis pipeline on synthetic catalogs.")
+    parser.add_argument('--rows', nargs='+', default=['10k', '1M', '10M'], help="catalog sizes (default: 10k 1M 10M)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage; the best one is kept")
+    parser.add_argument('--no-plots', action='store_true', help="skip the plot_* stages")
+    parser.add_argument('--chunksize', type=int, default=None, help="also time the streaming pass with this chunk size")
+    parser.add_argument('--sqlite', action='store_true', help="also ingest into SQLite and time the calcs on that backend")
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.json'))
+    parser.add_argument('--baseline', default=None, help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown (default 0.25)")
+    args = parser.parse_args(argv)
+
+    current = run([parse_rows(r) for r in args.rows], args.seed, args.repeat, not args.no_plots, args.chunksize,
+                  args.sqlite)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions against " + args.baseline + ":")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# Seeded generator of synthetic LEGO catalogs with the schema of lego_sets.csv
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analysis import SETS_CSV  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CHUNK_ROWS = 500_000
+
+
+def parse_rows(text):
+    """'10k' -> 10000, '1M' -> 1000000, '25000' -> 25000"""
+    text = str(text).strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def synthetic_chunks(rows, seed=0, source=None, chunk_rows=CHUNK_ROWS):
+    """Yield synthetic catalog chunks totalling `rows` rows.
+
+    Rows are drawn from the real catalog with replacement, so the joint
+    distribution of year, theme_name and parent_theme (and the share of
+    licensed themes) follows lego_sets.csv. num_parts gets log-normal noise
+    with missing values kept where the source row had none, and every row
+    that had a set_num gets a unique one.
+    """
+    source = pd.read_csv(source or SETS_CSV)
+    rng = np.random.default_rng(seed)
+    done = 0
+    while done < rows:
+        n = min(chunk_rows, rows - done)
+        chunk = source.iloc[rng.integers(0, len(source), size=n)].reset_index(drop=True)
+        noise = rng.lognormal(mean=0.0, sigma=0.15, size=n)
+        chunk['num_parts'] = np.round(chunk['num_parts'] * noise)
+        set_nums = pd.Series([f'{i:08d}-{v}' for i, v in zip(range(done, done + n), rng.integers(1, 4, size=n))])
+        chunk['set_num'] = set_nums.where(chunk['set_num'].notna())
+        yield chunk
+        done += n
+
+
+def write_catalog(rows, seed=0, path=None, source=None):
+    """Write a synthetic lego_sets CSV (reused when it already exists) and return its path."""
+    path = path or os.path.join(DATA_DIR, f'lego_sets_{rows}_s{seed}.csv')
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    for i, chunk in enumerate(synthetic_chunks(rows, seed, source)):
+        chunk.to_csv(tmp, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    os.replace(tmp, path)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic lego_sets.csv.")
+    parser.add_argument('rows', type=parse_rows, help="number of rows, e.g. 10k, 1M, 10M")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    print(write_catalog(args.rows, args.seed, args.output))
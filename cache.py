@@ -0,0 +1,283 @@
+# On-disk caches used by the analysis pipeline
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 2
+
+
+def file_fingerprint(path, previous=None):
+    """Return the size, mtime and sha256 of a file.
+
+    The content hash is only recomputed when size or mtime differ from a
+    previous fingerprint of the same file, so warm runs only pay for a stat().
+    """
+    st = os.stat(path)
+    fp = {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if previous and previous.get('size') == fp['size'] and previous.get('mtime_ns') == fp['mtime_ns']:
+        fp['sha256'] = previous['sha256']
+        return fp
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    fp['sha256'] = digest.hexdigest()
+    return fp
+
+
+def _sources_match(stored, current):
+    """Compare stored and current fingerprints on their content hashes."""
+    if len(stored) != len(current):
+        return False
+    return all(s['path'] == c['path'] and s['sha256'] == c['sha256'] for s, c in zip(stored, current))
+
+
+def save_frame(df, directory, extra=None):
+    """Write a DataFrame as one .npy file per column plus a meta.json.
+
+    Numeric and boolean columns are stored as-is so they can be memory-mapped.
+    Categorical columns keep their own codes and categories; other string
+    columns are dictionary encoded the same way, with int32 codes (-1 for
+    missing) and a fixed-width unicode array of categories.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        entry = {'name': col, 'dtype': str(series.dtype)}
+        if series.dtype.kind in 'biuf':
+            np.save(os.path.join(tmp, f'{i}.npy'), series.to_numpy())
+            entry['encoding'] = 'plain'
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, f'{i}.codes.npy'), series.cat.codes.to_numpy())
+            np.save(os.path.join(tmp, f'{i}.cats.npy'), np.asarray(series.cat.categories, dtype=str))
+            entry['encoding'] = 'category'
+        else:
+            codes, cats = pd.factorize(series, use_na_sentinel=True)
+            np.save(os.path.join(tmp, f'{i}.codes.npy'), codes.astype(np.int32))
+            np.save(os.path.join(tmp, f'{i}.cats.npy'), np.asarray(cats, dtype=str))
+            entry['encoding'] = 'dict'
+        columns.append(entry)
+
+    meta = {'version': CACHE_VERSION, 'rows': len(df), 'columns': columns}
+    meta.update(extra or {})
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    publish_directory(tmp, directory)
+
+
+def publish_directory(tmp, directory):
+    """Swap a finished cache entry written to tmp into place, so readers never see a partial one.
+
+    The previous entry is renamed aside first and removed afterwards. Several
+    processes (batch workers) may publish the same entry at once: when
+    another one's entry takes the place first, it is kept and tmp is dropped."""
+    old = f'{tmp}.old'
+    try:
+        os.rename(directory, old)
+    except FileNotFoundError:
+        old = None
+    try:
+        os.replace(tmp, directory)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+            raise
+        shutil.rmtree(tmp, ignore_errors=True) # Another writer won
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def read_meta(directory):
+    """Return the cache metadata, or None when the cache is missing or unreadable."""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == CACHE_VERSION else None
+
+
+def load_frame(directory, meta=None, mmap=True):
+    """Rebuild a DataFrame written by save_frame()."""
+    meta = meta or read_meta(directory)
+    mode = 'r' if mmap else None
+    data = {}
+    for i, entry in enumerate(meta['columns']):
+        if entry['encoding'] == 'plain':
+            data[entry['name']] = np.load(os.path.join(directory, f'{i}.npy'), mmap_mode=mode)
+        elif entry['encoding'] == 'category':
+            codes = np.load(os.path.join(directory, f'{i}.codes.npy'), mmap_mode=mode)
+            cats = np.load(os.path.join(directory, f'{i}.cats.npy')).astype(object)
+            data[entry['name']] = pd.Categorical.from_codes(codes, categories=cats)
+        else:
+            codes = np.load(os.path.join(directory, f'{i}.codes.npy'), mmap_mode=mode)
+            cats = np.load(os.path.join(directory, f'{i}.cats.npy')).astype(object)
+            values = np.take(cats, codes) if len(cats) else np.empty(len(codes), dtype=object)
+            values[codes == -1] = np.nan
+            data[entry['name']] = pd.Series(values, dtype=entry['dtype'])
+    return pd.DataFrame(data, columns=[c['name'] for c in meta['columns']])
+
+
+def sources_name(prefix, sources):
+    """Cache entry name for a set of source files, so each set of inputs gets its own entry."""
+    digest = hashlib.sha256('\0'.join(os.path.abspath(p) for p in sources).encode()).hexdigest()
+    return f'{prefix}-{digest[:16]}'
+
+
+def check_sources(directory, meta, sources):
+    """Current fingerprints of sources, and whether they match those in the cache entry's meta.
+
+    Touched but unchanged files get their stored mtimes refreshed to keep the fast path."""
+    stored = meta['sources'] if meta else []
+    previous = {s['path']: s for s in stored}
+    current = [file_fingerprint(p, previous.get(os.path.abspath(p))) for p in sources]
+    if not (meta and _sources_match(stored, current)):
+        return current, False
+    if stored != current:
+        meta['sources'] = current
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    return current, True
+
+
+def cached_frame(name, sources, build, cache_dir):
+    """Return build() from the columnar cache, rebuilding it when any source file changed."""
+    directory = os.path.join(cache_dir, name)
+    meta = read_meta(directory)
+    current, fresh = check_sources(directory, meta, sources)
+    if fresh:
+        return load_frame(directory, meta)
+
+    df = build()
+    save_frame(df, directory, extra={'sources': current})
+    return df
+
+
+# --- Rendered chart cache ---
+
+def data_fingerprint(obj, digest=None):
+    """Feed a stable description of obj (frames, series, cubes, containers, scalars) into a sha256."""
+    digest = digest or hashlib.sha256()
+    if isinstance(obj, pd.DataFrame):
+        digest.update(repr((list(obj.columns), [str(t) for t in obj.dtypes], obj.shape)).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        digest.update(repr((obj.name, str(obj.dtype), len(obj))).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(repr((str(obj.dtype), obj.shape)).encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f'{type(obj).__name__}:{len(obj)}'.encode())
+        for item in obj:
+            data_fingerprint(item, digest)
+    elif isinstance(obj, dict):
+        # Sorted by key so insertion order does not matter; values hashed in full, not through repr()
+        digest.update(f'dict:{len(obj)}'.encode())
+        for key, value in sorted(obj.items(), key=lambda item: repr(item[0])):
+            data_fingerprint(key, digest)
+            data_fingerprint(value, digest)
+    elif hasattr(obj, 'frame'):
+        # Cube and other wrappers around a single frame
+        digest.update(type(obj).__name__.encode())
+        data_fingerprint(obj.frame, digest)
+    else:
+        digest.update(repr(obj).encode())
+    return digest
+
+
+def image_cache_path(cache_dir, key):
+    """Location of the cached PNG for a chart key."""
+    return os.path.join(cache_dir, 'images', key + '.png')
+
+
+def fetch_image(cache_dir, key, target):
+    """Copy a cached chart to target. Returns False on a cache miss."""
+    path = image_cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    shutil.copyfile(path, target)
+    os.utime(path)  # Mark as recently used for age/size eviction
+    return True
+
+
+def store_image(cache_dir, key, source):
+    """Add a freshly rendered chart to the cache."""
+    path = image_cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, path)
+
+
+def read_image(cache_dir, key):
+    """Bytes of a cached chart, or None on a cache miss."""
+    path = image_cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.utime(path)
+    return data
+
+
+def write_image(cache_dir, key, data):
+    """Add a chart rendered in memory to the cache."""
+    path = image_cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# Defaults for evict_images(): keep at most 200 MB, drop entries unused for 30 days
+IMAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+IMAGE_CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+def evict_images(cache_dir, max_bytes=IMAGE_CACHE_MAX_BYTES, max_age=IMAGE_CACHE_MAX_AGE, now=None):
+    """Remove cached charts older than max_age seconds, then least recently used ones until under max_bytes.
+
+    Returns the number of files removed.
+    """
+    directory = os.path.join(cache_dir, 'images')
+    if not os.path.isdir(directory):
+        return 0
+    now = now if now is not None else time.time()
+
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.png'):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue # Evicted by another process at the same time
+        removed += 1
+    return removed
@@ -0,0 +1,279 @@
+# Command-line entry point: python cli.py {stats,charts,pdf,update,batch,memory,search,serve,sections} ...
+#
+# Only the standard library is imported up front. Each subcommand imports
+# what it needs when it runs, so `stats` never loads matplotlib, seaborn or fpdf.
+import argparse
+import json
+import sys
+
+
+def _load(args):
+    """Merged rows (or weighted part counts when streaming or on SQLite), the aggregate
+    cube and, when streaming, the set-size sketches."""
+    if getattr(args, 'backend', 'pandas') == 'sqlite':
+        cube = _open_store(args).cube()
+        return cube.part_counts(), cube, None
+
+    if getattr(args, 'chunksize', None):
+        from streaming import stream_aggregates
+        cube, merged, sketches = stream_aggregates(chunksize=args.chunksize)
+        return merged, cube, sketches
+
+    from analysis import build_cube, load_data
+    merged = load_data(use_cache=not args.no_data_cache)
+    return merged, build_cube(merged), None
+
+
+def _open_store(args):
+    """The SQLite store of --backend sqlite; --no-data-cache re-ingests it and --chunksize sets the ingest chunks."""
+    from store import INGEST_CHUNK_ROWS, open_store
+    return open_store(rebuild=getattr(args, 'no_data_cache', False), chunksize=args.chunksize or INGEST_CHUNK_ROWS)
+
+
+def compute_stats(cube):
+    """The report's headline numbers as a JSON-serialisable dict."""
+    import analysis
+
+    sw_percentage, star_wars = analysis.calc_star_wars_percentage(cube)
+    _, licensed_percentage = analysis.calc_licensed_percentage(cube)
+    highest_num_themes, _ = analysis.calc_top_new_theme_year(cube)
+    top_themes = analysis.calc_top_themes_by_set_count(cube)
+    licensed_themes = analysis.calc_licensed_highest_sets(cube)
+    return {
+        'star_wars_percentage_of_licensed': float(sw_percentage),
+        'star_wars_peak_year': analysis.calc_peak_star_wars_year(star_wars),
+        'licensed_percentage': int(licensed_percentage),
+        'top_new_theme_year': int(highest_num_themes.iloc[0, 0]),
+        'top_themes': [{'parent_theme': t, 'sets': int(n)} for t, n in top_themes.values.tolist()],
+        'licensed_top_themes': [{'parent_theme': t, 'sets': int(n)} for t, n in licensed_themes.values.tolist()],
+    }
+
+
+def cmd_stats(args):
+    _, cube, _ = _load(args)
+    stats = compute_stats(cube)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+
+    print(f"Percentage of licensed sets that are Star Wars: {stats['star_wars_percentage_of_licensed']}%")
+    print(f"Year with the most Star Wars sets released: {stats['star_wars_peak_year']}")
+    print(f"Licensed sets account for {stats['licensed_percentage']}% of all LEGO sets")
+    print(f"The highest number of new themes was introduced in: {stats['top_new_theme_year']}")
+    print("Top parent themes by number of sets:")
+    for row in stats['top_themes']:
+        print(f"  {row['parent_theme']:<30} {row['sets']:>6}")
+    print("Licensed themes with the most sets:")
+    for row in stats['licensed_top_themes']:
+        print(f"  {row['parent_theme']:<30} {row['sets']:>6}")
+    return 0
+
+
+def cmd_charts(args):
+    import report
+    from render import render_charts
+
+    merged, cube, sketches = _load(args)
+    specs = report.chart_specs(report.build_sections(merged, cube, only=args.sections, sketches=sketches))
+    paths, summary = render_charts(specs, workers=args.workers, use_cache=not args.no_cache)
+    print(f"Charts: {len(summary['hits'])} reused from cache, {len(summary['misses'])} rendered")
+    for path in paths:
+        print("  " + path)
+    return 0
+
+
+def cmd_pdf(args):
+    import report
+    from profiling import Tracer, default_tracer
+
+    tracer = default_tracer()
+    if args.no_trace:
+        tracer = Tracer(enabled=False)
+    elif args.trace_memory:
+        tracer = Tracer(memory=True)
+    cube = parts = None
+    if args.backend == 'sqlite':
+        cube = _open_store(args).cube()
+        parts = cube.part_counts()
+    report.main(workers=args.workers, output_pdf=args.output, use_cache=not args.no_cache,
+                chunksize=args.chunksize, tracer=tracer, only=args.sections, profile=args.profile,
+                cube=cube, parts=parts)
+    return 0
+
+
+def cmd_batch(args):
+    from batch import format_result, read_manifest, run_batch
+
+    jobs = read_manifest(args.manifest)
+    print(f"Building {len(jobs)} report(s)")
+    max_memory = args.max_memory * 2**20 if args.max_memory else None
+    results = run_batch(jobs, workers=args.workers, profile=args.profile, use_cache=not args.no_cache,
+                        max_memory=max_memory, tasks_per_worker=args.tasks_per_worker,
+                        on_result=lambda result: print(format_result(result), flush=True))
+    failed = [r for r in results if not r.ok]
+    print(f"{len(results) - len(failed)} built, {len(failed)} failed")
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump([r._asdict() for r in results], f, indent=2)
+    return 1 if failed else 0
+
+
+def cmd_memory(args):
+    import pandas as pd
+    from analysis import SETS_CSV, THEMES_CSV, merge_data
+    from compact import memory_footprint, plain_merge
+
+    lego_sets, parent_themes = pd.read_csv(SETS_CSV), pd.read_csv(THEMES_CSV)
+    report = memory_footprint(plain_merge(lego_sets, parent_themes), merge_data(lego_sets, parent_themes))
+    if args.json:
+        print(report.to_json(orient='index', indent=2))
+    else:
+        print("Bytes per column of the merged catalog, plain merge (before) vs compact representation (after):")
+        print(report.to_string())
+    return 0
+
+
+def cmd_search(args):
+    import pandas as pd
+    from analysis import load_name_index
+
+    index = load_name_index(use_cache=not args.no_data_cache)
+    if args.similar:
+        try:
+            result = index.similar(args.query, limit=args.limit)
+        except KeyError:
+            print(f"No set {args.query!r} in the catalog.", file=sys.stderr)
+            return 1
+    else:
+        result = index.search(args.query, limit=args.limit)
+    if args.json:
+        print(result.to_json(orient='records', indent=2))
+    else:
+        with pd.option_context('display.width', 200, 'display.max_colwidth', 40):
+            print(result.to_string(index=False) if len(result) else "No matching sets.")
+    return 0
+
+
+def cmd_serve(args):
+    import server
+
+    server.serve(args.host, args.port, args.cache_size)
+    return 0
+
+
+def cmd_sections(args):
+    from sections import SECTIONS
+
+    for section in SECTIONS:
+        print(f"{section.key:<24} {', '.join(section.tags):<26} {section.title}")
+    return 0
+
+
+def cmd_update(args):
+    import pandas as pd
+    from incremental import CatalogState
+
+    state = CatalogState.load(args.state)
+    stale = state.apply(pd.read_csv(args.batch))
+    print(f"Applied {args.batch}; stale sections: {', '.join(sorted(stale)) or 'none'}")
+    if args.pdf and state.stale:
+        import report
+
+        report.main(workers=args.workers, output_pdf=args.pdf, use_cache=not args.no_cache, only=sorted(state.stale),
+                    cube=state.cube(), parts=state.parts())
+        state.mark_fresh()
+    state.save(args.state)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="LEGO sets analysis.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_backend_option(p):
+        p.add_argument('--backend', choices=['pandas', 'sqlite'], default='pandas',
+                       help="answer the calculations in pandas (default) or with SQL over an indexed SQLite copy "
+                            "(see store.py); with sqlite, --chunksize sets the rows ingested at a time")
+
+    def add_data_options(p):
+        p.add_argument('--chunksize', type=int, default=None, help="stream lego_sets.csv in chunks of this many rows")
+        p.add_argument('--no-data-cache', action='store_true',
+                       help="re-parse the CSV files instead of using the columnar cache (or re-ingest the SQLite store)")
+        add_backend_option(p)
+
+    def add_render_options(p):
+        p.add_argument('--workers', type=int, default=None, help="chart rendering processes (0 = one per CPU, default: LEGO_RENDER_WORKERS or 1)")
+        p.add_argument('--no-cache', action='store_true', help="redraw every chart instead of reusing cached images")
+        p.add_argument('--sections', nargs='+', default=None, metavar='NAME',
+                       help="only these section keys or tags, e.g. 'licensed' (see: cli.py sections)")
+
+    stats = commands.add_parser('stats', help="print the headline numbers (no plotting libraries are loaded)")
+    add_data_options(stats)
+    stats.add_argument('--json', action='store_true', help="print JSON instead of text")
+    stats.set_defaults(func=cmd_stats)
+
+    charts = commands.add_parser('charts', help="render the report charts into images/")
+    add_data_options(charts)
+    add_render_options(charts)
+    charts.set_defaults(func=cmd_charts)
+
+    pdf = commands.add_parser('pdf', help="build the full PDF report")
+    pdf.add_argument('--chunksize', type=int, default=None, help="stream lego_sets.csv in chunks of this many rows")
+    add_backend_option(pdf)
+    add_render_options(pdf)
+    pdf.add_argument('--output', default="lego_analysis_report.pdf", help="path of the PDF to write")
+    pdf.add_argument('--profile', choices=['email', 'screen', 'print'], default='screen',
+                     help="chart resolution and compression: email (smallest), screen (default) or print (300 dpi)")
+    pdf.add_argument('--no-trace', action='store_true', help="disable timing instrumentation (same as LEGO_TRACE=0)")
+    pdf.add_argument('--trace-memory', action='store_true', help="also trace Python allocations with tracemalloc (slower)")
+    pdf.set_defaults(func=cmd_pdf)
+
+    update = commands.add_parser('update', help="apply a batch of new or corrected sets to the stored aggregate state")
+    update.add_argument('batch', help="CSV of lego_sets.csv rows; a known set_num replaces that set's row")
+    update.add_argument('--state', default=None, help="state directory (default: one under CACHE_DIR per pair of source CSVs)")
+    update.add_argument('--pdf', default=None, metavar='OUTPUT', help="also rebuild the sections made stale into this PDF")
+    update.add_argument('--workers', type=int, default=None, help="chart rendering processes (see pdf --workers)")
+    update.add_argument('--no-cache', action='store_true', help="redraw every chart instead of reusing cached images")
+    update.set_defaults(func=cmd_update)
+
+    batch = commands.add_parser('batch', help="build the PDF report for every snapshot in a manifest")
+    batch.add_argument('manifest', help="JSON list of jobs with sets, themes and output paths (see batch.py)")
+    batch.add_argument('--workers', type=int, default=None, help="reports built at once (0 = one per CPU, default: LEGO_RENDER_WORKERS or 1)")
+    batch.add_argument('--max-memory', type=int, default=None, metavar='MB', help="address space cap of each worker process")
+    batch.add_argument('--tasks-per-worker', type=int, default=20, help="reports a worker builds before it is replaced")
+    batch.add_argument('--no-cache', action='store_true', help="redraw every chart instead of reusing cached images")
+    batch.add_argument('--profile', choices=['email', 'screen', 'print'], default='screen',
+                       help="chart resolution and compression (see pdf --profile)")
+    batch.add_argument('--summary', default=None, help="also write the per-job results as JSON to this path")
+    batch.set_defaults(func=cmd_batch)
+
+    memory = commands.add_parser('memory', help="compare the memory footprint of the plain and compact merged catalog")
+    memory.add_argument('--json', action='store_true', help="print JSON instead of text")
+    memory.set_defaults(func=cmd_memory)
+
+    search = commands.add_parser('search', help="fuzzy search of set names and numbers, or sets similar to one")
+    search.add_argument('query', help="part of a set name (typos allowed) or the start of a set number")
+    search.add_argument('--similar', action='store_true', help="treat query as a set number and list the most similar sets")
+    search.add_argument('--limit', type=int, default=20, help="number of sets to list (default: 20)")
+    search.add_argument('--no-data-cache', action='store_true', help="rebuild the merged catalog and index instead of using the cache")
+    search.add_argument('--json', action='store_true', help="print JSON instead of text")
+    search.set_defaults(func=cmd_search)
+
+    serve = commands.add_parser('serve', help="answer calc_* queries over HTTP/JSON with the catalog kept in memory")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8765, help="port to listen on (default: 8765)")
+    serve.add_argument('--cache-size', type=int, default=256, help="answers kept in the LRU result cache")
+    serve.set_defaults(func=cmd_serve)
+
+    sections = commands.add_parser('sections', help="list the report sections and their tags")
+    sections.set_defaults(func=cmd_sections)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
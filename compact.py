@@ -0,0 +1,82 @@
+# Compact in-memory representation of the merged catalog
+import numpy as np
+import pandas as pd
+
+# Low-cardinality string columns of the merged frame, kept as categoricals
+# (small integer codes plus one copy of every distinct value)
+CATEGORICAL_COLUMNS = ['theme_name', 'parent_theme', 'name_pt']
+
+# float32 holds every integer up to this value exactly
+FLOAT32_EXACT = 2 ** 24
+
+
+def narrow(series):
+    """series in the smallest dtype that holds its values exactly.
+
+    Integers are downcast to the narrowest integer type; floats whose values
+    are all whole numbers below FLOAT32_EXACT (part counts, with NaN for
+    missing) become float32. Anything else is returned unchanged.
+    """
+    if series.dtype.kind in 'iu':
+        return pd.to_numeric(series, downcast='integer')
+    if series.dtype.kind == 'f' and series.dtype.itemsize > 4:
+        values = series.to_numpy()
+        finite = values[~np.isnan(values)]
+        if (finite == np.round(finite)).all() and (np.abs(finite) < FLOAT32_EXACT).all():
+            return series.astype('float32')
+    return series
+
+
+def join_themes(lego_sets, parent_themes):
+    """lego_sets with the attributes of their parent theme, in the compact representation.
+
+    The same rows, in the same order, as an inner merge on parent_theme =
+    name, with the merge's column names (name_ls, id, name_pt, is_licensed).
+    Instead of merging, parent_theme is encoded as codes into the sorted theme
+    names, and every theme attribute is read from a lookup array indexed by
+    those codes. parent_themes must have unique names.
+    """
+    themes = parent_themes.sort_values('name', ignore_index=True)
+    codes = pd.Index(themes['name']).get_indexer(lego_sets['parent_theme'])
+    found = codes >= 0
+    codes = codes[found]
+    parent = pd.Categorical.from_codes(codes, categories=themes['name'])
+
+    merged = lego_sets[found].rename(columns={'name': 'name_ls'}).reset_index(drop=True)
+    merged['parent_theme'] = parent
+    for column in themes.columns:
+        if column == 'name':
+            merged['name_pt'] = parent
+        else:
+            merged[column] = themes[column].to_numpy()[codes]
+    return compact_frame(merged)
+
+
+def compact_frame(merged):
+    """Copy of merged with CATEGORICAL_COLUMNS as sorted categoricals and numeric columns narrowed."""
+    columns = {}
+    for column in merged.columns:
+        series = merged[column]
+        if column in CATEGORICAL_COLUMNS:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype('category')
+            columns[column] = series.cat.reorder_categories(sorted(series.cat.categories))
+        else:
+            columns[column] = narrow(series)
+    return pd.DataFrame(columns)
+
+
+def plain_merge(lego_sets, parent_themes):
+    """The merged frame as a plain pandas merge builds it, object strings and 64-bit numbers."""
+    return lego_sets.merge(parent_themes, how='inner', left_on='parent_theme', right_on='name', suffixes=('_ls', '_pt'))
+
+
+def memory_footprint(before, after):
+    """Bytes per column of two versions of a frame (deep, counting the strings), with a total row."""
+    report = pd.DataFrame({'before': before.memory_usage(deep=True, index=False),
+                           'after': after.memory_usage(deep=True, index=False)})
+    report.loc['total'] = report.sum()
+    report['ratio'] = (report['after'] / report['before']).round(3)
+    report.insert(0, 'dtype_before', before.dtypes.astype(str))
+    report.insert(1, 'dtype_after', after.dtypes.astype(str))
+    return report.fillna({'dtype_before': '', 'dtype_after': ''})
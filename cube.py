@@ -0,0 +1,91 @@
+# Aggregate cube over the merged LEGO catalog
+import pandas as pd
+
+# Dimensions of the cube, one row per distinct combination present in the data
+CUBE_KEYS = ['year', 'parent_theme', 'theme_name', 'is_licensed']
+
+# Additive measures kept for every cell:
+#   rows        - number of rows (what .size() / len() / value_counts() count)
+#   sets        - non-null set_num values (what ['set_num'].count() counts)
+#   parts_sum   - sum of num_parts, ignoring missing values
+#   parts_count - non-null num_parts values, so means are parts_sum / parts_count
+CUBE_MEASURES = ['rows', 'sets', 'parts_sum', 'parts_count']
+
+
+class Cube:
+    """Year x parent_theme x theme_name x is_licensed aggregate of the merged catalog.
+
+    Every measure is additive, so any roll-up over the dimensions can be answered
+    from the cube alone and its cost grows with the number of cells, not rows.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.frame)
+
+    def where(self, **filters):
+        """Return the sub-cube matching every filter (a scalar value or a list of values)."""
+        mask = pd.Series(True, index=self.frame.index)
+        for column, value in filters.items():
+            if isinstance(value, (list, tuple, set, pd.Index)):
+                mask &= self.frame[column].isin(list(value))
+            else:
+                mask &= self.frame[column] == value
+        return Cube(self.frame[mask])
+
+    def total(self, measure='rows'):
+        """Grand total of one measure."""
+        return int(self.frame[measure].sum())
+
+    def totals(self, by, measures='rows'):
+        """Roll the cube up to the given dimension(s), summing the measure(s)."""
+        return self.frame.groupby(by)[measures].sum()
+
+    def top(self, by, measure='rows', k=None):
+        """The k largest totals of measure by by, largest first, ties in key order (k=None: all of them)."""
+        from leaderboard import top_series  # leaderboard imports this module
+        return top_series(self.totals(by, measure), k)
+
+    def distinct(self, by, column):
+        """Number of distinct values of column per group of by."""
+        present = self.frame[self.frame['rows'] > 0]
+        return present.groupby(by)[column].nunique()
+
+
+def _aggregate(frame):
+    """Group rows or partial cells by CUBE_KEYS; missing keys form their own cells."""
+    return frame.groupby(CUBE_KEYS, dropna=False, sort=True, observed=True)
+
+
+def build_cube(merged):
+    """Build the cube from the merged DataFrame in a single grouping pass.
+
+    Categorical keys of the compact representation become plain columns of
+    their values, and part counts are summed in float64 whatever their dtype."""
+    merged = merged.assign(num_parts=merged['num_parts'].astype('float64'))
+    frame = _aggregate(merged).agg(
+        rows=('year', 'size'),
+        sets=('set_num', 'count'),
+        parts_sum=('num_parts', 'sum'),
+        parts_count=('num_parts', 'count'),
+    ).reset_index()
+    for column in CUBE_KEYS:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(frame[column].cat.categories.dtype)
+    return Cube(frame)
+
+
+def merge_cubes(cubes):
+    """Combine cubes built over disjoint parts of the catalog into one."""
+    frames = [c.frame for c in cubes]
+    frame = _aggregate(pd.concat(frames, ignore_index=True))[CUBE_MEASURES].sum().reset_index()
+    return Cube(frame)
+
+
+def as_cube(data):
+    """Accept either a Cube or a merged DataFrame and return a Cube."""
+    if isinstance(data, Cube):
+        return data
+    return build_cube(data)
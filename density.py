@@ -0,0 +1,72 @@
+# Histogram and binned kernel density estimate of the set sizes
+from collections import namedtuple
+
+import numpy as np
+
+# Everything plot_distribution_set_sizes() draws: the histogram (bin edges and
+# the number of sets per bin), the density curve on grid scaled to the same
+# units as the bars, and the 95th percentile the x axis is cut at
+SizeDistribution = namedtuple('SizeDistribution', ['edges', 'counts', 'grid', 'curve', 'xmax'])
+
+# Defaults of sns.histplot(bins=50, kde=True), whose chart this reproduces
+HIST_BINS = 50
+KDE_GRIDSIZE = 200
+
+# Points of the regular grid the data is binned onto before the convolution
+KDE_BINS = 2 ** 12
+
+# The Gaussian kernel is cut off this many bandwidths from its centre
+KERNEL_CUTOFF = 4
+
+
+def scott_bandwidth(values, weights):
+    """Scott's rule bandwidth for values repeated weights times (as scipy's gaussian_kde picks it)."""
+    n = weights.sum()
+    mean = np.average(values, weights=weights)
+    variance = (weights * (values - mean) ** 2).sum() / (n - 1)
+    return np.sqrt(variance) * n ** -0.2
+
+
+def binned_kde(values, weights, grid, bandwidth):
+    """Gaussian kernel density of the weighted values, evaluated on grid.
+
+    The values are linearly binned onto KDE_BINS regular points and convolved
+    with the kernel by FFT, so the cost depends on the number of values only
+    through the binning pass instead of growing as values x grid points.
+    """
+    lo = values.min() - KERNEL_CUTOFF * bandwidth
+    hi = values.max() + KERNEL_CUTOFF * bandwidth
+    delta = (hi - lo) / (KDE_BINS - 1)
+
+    # Split each value's weight between the two grid points around it
+    pos = (values - lo) / delta
+    left = np.minimum(pos.astype(np.int64), KDE_BINS - 2)
+    frac = pos - left
+    binned = (np.bincount(left, weights * (1 - frac), minlength=KDE_BINS)
+              + np.bincount(left + 1, weights * frac, minlength=KDE_BINS))
+
+    # Zero-padded to twice the length so the circular convolution does not wrap
+    offsets = np.arange(KDE_BINS) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    kernel = np.concatenate([kernel, [0.0], kernel[:0:-1]])
+    density = np.fft.irfft(np.fft.rfft(binned, 2 * KDE_BINS) * np.fft.rfft(kernel), 2 * KDE_BINS)[:KDE_BINS]
+    density = np.maximum(density, 0) / weights.sum()
+    return np.interp(grid, lo + np.arange(KDE_BINS) * delta, density)
+
+
+def size_distribution(values, weights=None, xmax=None, bins=HIST_BINS, gridsize=KDE_GRIDSIZE):
+    """Histogram and density curve of the part counts values (each repeated weights times).
+
+    The curve covers the range of the data, like sns.histplot's KDE, and is
+    scaled so its area matches the bars. It is None when the values do not
+    spread (fewer than two sets or a single distinct size). xmax is stored
+    as given, for the plot to cut the x axis at.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+    counts, edges = np.histogram(values, bins=bins, weights=weights)
+    grid, curve = np.linspace(values.min(), values.max(), gridsize), None
+    if weights.sum() > 1 and values.min() < values.max():
+        bandwidth = scott_bandwidth(values, weights)
+        curve = binned_kde(values, weights, grid, bandwidth) * weights.sum() * (edges[1] - edges[0])
+    return SizeDistribution(edges, counts, grid, curve, xmax)
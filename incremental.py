@@ -0,0 +1,309 @@
+# Incremental updates of the aggregate state for small batches of new or corrected sets
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis import CACHE_DIR, SETS_CSV, THEMES_CSV, build_cube, load_data
+from cache import CACHE_VERSION, check_sources, load_frame, read_meta, save_frame, sources_name
+from cube import CUBE_KEYS, CUBE_MEASURES, Cube, merge_cubes
+
+# Columns of lego_sets.csv kept for the current row of every set
+SET_COLUMNS = ['set_num', 'year', 'num_parts', 'theme_name', 'parent_theme']
+
+# Layout of a saved state; states written with another one are rebuilt
+STATE_FORMAT = 2
+
+# Which aggregates each report section (by sections.SECTIONS key) reads. A batch marks a section stale
+# when it changes any of them:
+#   rows / sets      - row or set_num counts of any cell
+#   parts            - num_parts sums or counts, or the set-size distribution
+#   licensed_rows    - row counts of licensed cells
+#   licensed_sets    - set_num counts of licensed cells
+#   theme_years      - which parent themes appear in which years
+SECTION_INPUTS = {
+    'star_wars': {'licensed_rows'},
+    'sets_over_time': {'rows'},
+    'top_themes': {'sets'},
+    'licensed_percentage': {'rows'},
+    'licensed_themes': {'licensed_sets'},
+    'top5_trends': {'sets'},
+    'licensed_trend': {'sets'},
+    'size_boxplot': {'parts'},
+    'subthemes': {'rows', 'sets'},
+    'size_distribution': {'parts'},
+    'new_themes': {'theme_years'},
+    'complexity': {'rows', 'parts'},
+    'popularity_complexity': {'sets', 'parts'},
+}
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _key(value):
+    """Dictionary-safe version of a value: every kind of missing value becomes None."""
+    return None if _missing(value) else value
+
+
+def _scalar(value):
+    """A numpy scalar as the Python value a batch row would hold."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _records(frame, columns):
+    """Rows of frame as tuples of Python values, missing values as None."""
+    return [tuple(_key(_scalar(v)) for v in row) for row in frame[columns].astype(object).itertuples(index=False)]
+
+
+class CatalogState:
+    """Aggregate state of the catalog that batches of lego_sets.csv rows are applied to.
+
+    Holds the cube cells, the per-(is_licensed, num_parts) set counts and the
+    years each parent theme appears in, all in dictionaries, so apply() costs
+    time proportional to the batch. The current row of every set_num is
+    looked up in the catalog as built unless a batch has replaced it since:
+    the rows are kept sorted by set_num and found by binary search, so
+    loading them costs no pass over the catalog. cube() and parts() turn
+    the state back into the structures the calc_* and plot_* functions take.
+    """
+
+    def __init__(self, parent_themes, base_keys=None, base=None):
+        self.licensed = dict(zip(parent_themes['name'], parent_themes['is_licensed'].astype(bool)))
+        self.cells = {}        # CUBE_KEYS tuple -> [rows, sets, parts_sum, parts_count]
+        self.part_counts = {}  # (is_licensed, num_parts) -> number of sets
+        self.theme_years = {}  # (year, parent_theme) -> number of rows
+        # Rows of the catalog as built: their sorted set_nums, and the other SET_COLUMNS in the same order
+        self.base_keys = base_keys if base_keys is not None else np.array([], dtype=str)
+        self.base = base if base is not None else pd.DataFrame(columns=SET_COLUMNS[1:])
+        # Rows added or replaced by batches since
+        self.sets = {}         # set_num -> current row as a dict of lego_sets.csv columns
+        self.stale = set()
+        self.base_saved = False
+        self.sources = None    # fingerprints of the source CSVs the state was built from, once loaded
+
+    @classmethod
+    def from_merged(cls, merged, parent_themes=None):
+        """Build the state from a merged catalog (as returned by load_data())."""
+        if parent_themes is None:
+            parent_themes = pd.read_csv(THEMES_CSV)
+        merged = merged.assign(num_parts=merged['num_parts'].astype('float64'))
+        # The last row of a repeated set_num is its current one, as if the rows were applied in order
+        base = merged.dropna(subset=['set_num']).drop_duplicates('set_num', keep='last').sort_values('set_num')
+        keys = np.asarray(base['set_num'].to_numpy(), dtype=str)
+        state = cls(parent_themes, keys, base[SET_COLUMNS[1:]].reset_index(drop=True))
+
+        cube = build_cube(merged).frame
+        for *key, rows, sets, parts_sum, parts_count in _records(cube, CUBE_KEYS + CUBE_MEASURES):
+            key[3] = bool(key[3])
+            state.cells[tuple(key)] = [rows, sets, parts_sum, parts_count]
+        parts = merged.dropna(subset=['num_parts']).groupby(['is_licensed', 'num_parts']).size().reset_index()
+        state.part_counts = {(bool(licensed), parts_): n for licensed, parts_, n in _records(parts, list(parts.columns))}
+        years = merged.groupby(['year', 'parent_theme'], observed=True).size().reset_index()
+        state.theme_years = {(year, parent): n for year, parent, n in _records(years, list(years.columns))}
+        return state
+
+    # --- persistence ---
+
+    @staticmethod
+    def _directory(path, sets_path, themes_path):
+        return path or os.path.join(CACHE_DIR, sources_name('state', [sets_path, themes_path]))
+
+    def save(self, path=None, sets_path=None, themes_path=None):
+        """Store the state for the next batch, under CACHE_DIR by default (one per pair of source CSVs).
+
+        Only the aggregates and the rows batches added or replaced are
+        written; the catalog rows as built are written once, by the first
+        save. The fingerprints of the source CSVs are stored with the state."""
+        sets_path, themes_path = sets_path or SETS_CSV, themes_path or THEMES_CSV
+        directory = self._directory(path, sets_path, themes_path)
+        os.makedirs(directory, exist_ok=True)
+        meta = read_meta(directory)
+        if not (self.base_saved and meta):
+            save_frame(self.base, os.path.join(directory, 'base'))
+            tmp = os.path.join(directory, 'base_keys.tmp.npy')
+            np.save(tmp, self.base_keys)
+            os.replace(tmp, os.path.join(directory, 'base_keys.npy'))
+            self.base_saved = True
+
+        frames = {
+            'cells': pd.DataFrame([key + tuple(m) for key, m in self.cells.items()], columns=CUBE_KEYS + CUBE_MEASURES),
+            'part_counts': pd.DataFrame([key + (n,) for key, n in self.part_counts.items()],
+                                        columns=['is_licensed', 'num_parts', 'weight']),
+            'theme_years': pd.DataFrame([key + (n,) for key, n in self.theme_years.items()],
+                                        columns=['year', 'parent_theme', 'rows']),
+            'sets': pd.DataFrame(list(self.sets.values()), columns=SET_COLUMNS),
+        }
+        for name, frame in frames.items():
+            save_frame(frame, os.path.join(directory, name))
+
+        # Fingerprints taken before the CSVs were read, when the state was loaded or rebuilt
+        sources = self.sources or check_sources(directory, meta, [sets_path, themes_path])[0]
+        meta = {'version': CACHE_VERSION, 'kind': 'catalog_state', 'format': STATE_FORMAT, 'sources': sources,
+                'licensed': [[name, bool(flag)] for name, flag in self.licensed.items()], 'stale': sorted(self.stale)}
+        tmp = os.path.join(directory, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+    @classmethod
+    def load(cls, path=None, sets_path=None, themes_path=None):
+        """Load the stored state, building it from load_data() the first time and whenever a source CSV changed.
+
+        Batches applied to a state are not part of the CSVs, so a state saved
+        against other versions of them is rebuilt rather than reused."""
+        sets_path, themes_path = sets_path or SETS_CSV, themes_path or THEMES_CSV
+        directory = cls._directory(path, sets_path, themes_path)
+        meta = read_meta(directory)
+        current, fresh = check_sources(directory, meta, [sets_path, themes_path])
+        if not (fresh and meta.get('kind') == 'catalog_state' and meta.get('format') == STATE_FORMAT):
+            state = cls.from_merged(load_data(sets_path, themes_path), pd.read_csv(themes_path))
+            state.sources = current
+            state.save(directory, sets_path, themes_path)
+            return state
+
+        themes = pd.DataFrame(meta['licensed'], columns=['name', 'is_licensed'])
+        state = cls(themes, np.load(os.path.join(directory, 'base_keys.npy'), mmap_mode='r'),
+                    load_frame(os.path.join(directory, 'base')))
+        state.base_saved = True
+        state.sources = current
+        state.stale = set(meta['stale'])
+        part = lambda name: load_frame(os.path.join(directory, name), mmap=False)
+        for *key, rows, sets, parts_sum, parts_count in _records(part('cells'), CUBE_KEYS + CUBE_MEASURES):
+            key[3] = bool(key[3])
+            state.cells[tuple(key)] = [rows, sets, parts_sum, parts_count]
+        state.part_counts = {(bool(licensed), parts): n for licensed, parts, n
+                             in _records(part('part_counts'), ['is_licensed', 'num_parts', 'weight'])}
+        state.theme_years = {(year, parent): n for year, parent, n
+                             in _records(part('theme_years'), ['year', 'parent_theme', 'rows'])}
+        state.sets = {row[0]: dict(zip(SET_COLUMNS, row)) for row in _records(part('sets'), SET_COLUMNS)}
+        return state
+
+    # --- deltas ---
+
+    def _contribute(self, row, sign, delta):
+        """Add (sign=1) or remove (sign=-1) one row's contribution to every aggregate.
+
+        The net change per cube cell and per part count is accumulated in delta.
+        """
+        licensed = self.licensed.get(row['parent_theme'])
+        if licensed is None:
+            return  # Inner join: sets of unknown parent themes are not part of the catalog
+        licensed = bool(licensed)
+        has_set = not _missing(row['set_num'])
+        parts = row['num_parts']
+        has_parts = not _missing(parts)
+        change = [sign, sign * has_set, sign * (parts if has_parts else 0.0), sign * has_parts]
+
+        key = (_key(row['year']), _key(row['parent_theme']), _key(row['theme_name']), licensed)
+        cell = self.cells.setdefault(key, [0, 0, 0.0, 0])
+        net = delta['cells'].setdefault(key, [0, 0, 0.0, 0])
+        for i, value in enumerate(change):
+            cell[i] += value
+            net[i] += value
+        if cell[0] == 0:
+            del self.cells[key]
+
+        if has_parts:
+            pkey = (licensed, float(parts))
+            self.part_counts[pkey] = self.part_counts.get(pkey, 0) + sign
+            delta['parts'][pkey] = delta['parts'].get(pkey, 0) + sign
+            if self.part_counts[pkey] == 0:
+                del self.part_counts[pkey]
+
+        ykey = key[:2]
+        delta['theme_years'].setdefault(ykey, ykey in self.theme_years)
+        self.theme_years[ykey] = self.theme_years.get(ykey, 0) + sign
+        if self.theme_years[ykey] == 0:
+            del self.theme_years[ykey]
+
+    def _add(self, row, delta):
+        if not _missing(row['set_num']):
+            self.sets[row['set_num']] = {column: row.get(column) for column in SET_COLUMNS}
+        self._contribute(row, 1, delta)
+
+    def _current(self, set_num):
+        """The current row of a set, or None for a set not in the catalog."""
+        if _missing(set_num):
+            return None
+        if set_num in self.sets:
+            return self.sets[set_num]
+        i = np.searchsorted(self.base_keys, str(set_num))
+        if i == len(self.base_keys) or self.base_keys[i] != str(set_num):
+            return None
+        return {'set_num': set_num, **{column: _key(_scalar(self.base[column].iat[i])) for column in SET_COLUMNS[1:]}}
+
+    @staticmethod
+    def _new_delta():
+        return {'cells': {}, 'parts': {}, 'theme_years': {}}
+
+    def _changed_inputs(self, delta):
+        """Names of the aggregates (see SECTION_INPUTS) whose net value changed."""
+        changed = set()
+        for (_, _, _, licensed), (rows, sets, parts_sum, parts_count) in delta['cells'].items():
+            if rows:
+                changed.update(['rows', 'licensed_rows'] if licensed else ['rows'])
+            if sets:
+                changed.update(['sets', 'licensed_sets'] if licensed else ['sets'])
+            if parts_sum or parts_count:
+                changed.add('parts')
+        if any(delta['parts'].values()):
+            changed.add('parts')
+        if any(was != (key in self.theme_years) for key, was in delta['theme_years'].items()):
+            changed.add('theme_years')
+        return changed
+
+    def apply(self, batch):
+        """Apply a batch of lego_sets.csv rows and return the keys of the sections it made stale.
+
+        A row whose set_num is already in the catalog replaces the stored row
+        (a correction); any other row is added. Stale sections accumulate in
+        self.stale until mark_fresh() is called. To rebuild just those, pass
+        them with the updated aggregates to report.main(only=self.stale,
+        cube=self.cube(), parts=self.parts()), as `cli.py update --pdf` does.
+        """
+        delta = self._new_delta()
+        for row in batch.to_dict('records'):
+            previous = self._current(row['set_num'])
+            if previous is not None:
+                self._contribute(previous, -1, delta)
+            self._add(row, delta)
+
+        changed = self._changed_inputs(delta)
+        stale = {key for key, inputs in SECTION_INPUTS.items() if inputs & changed}
+        self.stale |= stale
+        return stale
+
+    def mark_fresh(self, sections=None):
+        """Forget the stale flags of the given sections (all of them by default)."""
+        if sections is None:
+            self.stale.clear()
+        else:
+            self.stale -= set(sections)
+
+    # --- views ---
+
+    def cube(self):
+        """The aggregate cube of the current catalog, equal to build_cube() of the merged rows."""
+        frame = pd.DataFrame([key + tuple(measures) for key, measures in self.cells.items()],
+                             columns=CUBE_KEYS + CUBE_MEASURES)
+        frame = frame.astype({'year': 'int64', 'is_licensed': bool, 'rows': 'int64', 'sets': 'int64',
+                              'parts_sum': 'float64', 'parts_count': 'int64'})
+        return merge_cubes([Cube(frame)])
+
+    def parts(self):
+        """Weighted set-size counts (is_licensed, num_parts, weight), as streaming.stream_aggregates() returns them."""
+        frame = pd.DataFrame([key + (weight,) for key, weight in self.part_counts.items()],
+                             columns=['is_licensed', 'num_parts', 'weight'])
+        frame = frame.astype({'is_licensed': bool, 'num_parts': 'float64', 'weight': 'int64'})
+        return frame.sort_values(['is_licensed', 'num_parts'], ignore_index=True)
+
+    def first_seen_years(self):
+        """First year each parent theme appears in."""
+        years = {}
+        for year, parent in self.theme_years:
+            if parent not in years or year < years[parent]:
+                years[parent] = year
+        return pd.Series(years, name='first_year').sort_index()
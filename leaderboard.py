@@ -0,0 +1,112 @@
+# Top-k selection and per-year leaderboards of parent themes and sub-themes
+import numpy as np
+import pandas as pd
+
+from cube import as_cube
+
+# Leaderboard levels and the cube keys identifying an entry of each
+LEVELS = {
+    'parent_theme': ['parent_theme'],
+    'theme_name': ['parent_theme', 'theme_name'], # sub-theme names repeat across parent themes
+}
+
+
+def top_k(values, k):
+    """Positions of the k largest values, largest first; ties keep their order in values.
+
+    Selects with np.partition (linear time) and only sorts the k selected
+    values, instead of sorting all of them.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    k = n if k is None else max(0, min(int(k), n))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        threshold = np.partition(values, n - k)[n - k]
+        above = np.flatnonzero(values > threshold)
+        ties = np.flatnonzero(values == threshold)[:k - len(above)]
+        positions = np.concatenate([above, ties])
+    else:
+        positions = np.arange(n)
+    return positions[np.lexsort((positions, -values[positions]))]
+
+
+def top_series(series, k):
+    """The k largest entries of series, largest first (as sort_values(ascending=False).head(k)); k=None keeps all."""
+    return series.iloc[top_k(series.to_numpy(), k)]
+
+
+class Leaderboard:
+    """Ranking of the entries of one level (parent themes or sub-themes) in every year.
+
+    Holds the measure per year and entry, in that year alone and cumulated up
+    to it. Nothing is sorted up front: "top k as of year Y" selects the k
+    leaders of that year with top_k() and only sorts those, and a rank is a
+    count of the entries ahead. Ties rank in entry order. Entries without
+    any sets (yet) are unranked.
+    """
+
+    def __init__(self, level, measure, years, entries, values):
+        self.level = level
+        self.measure = measure
+        self.years = years      # consecutive years, first to last
+        self.entries = entries  # pd.Index (or MultiIndex) of the entries, sorted
+        self.values = {'year': values, 'cumulative': np.cumsum(values, axis=0)}
+
+    @classmethod
+    def from_cube(cls, data, level='parent_theme', measure='sets'):
+        """Build the leaderboard of a level (a key of LEVELS) from a Cube (or merged rows)."""
+        if level not in LEVELS:
+            raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+        table = as_cube(data).totals(LEVELS[level] + ['year'], measure).unstack('year', fill_value=0)
+        if table.empty:
+            raise ValueError("cannot rank an empty catalog")
+        years = np.arange(int(table.columns.min()), int(table.columns.max()) + 1)
+        table = table.reindex(columns=years, fill_value=0)
+        return cls(level, measure, years, table.index, table.to_numpy().T)
+
+    def _year_pos(self, year):
+        if year is None:
+            return len(self.years) - 1
+        if not self.years[0] <= year <= self.years[-1]:
+            raise ValueError(f"year must be between {self.years[0]} and {self.years[-1]}")
+        return int(year - self.years[0])
+
+    def _kind(self, cumulative):
+        return 'cumulative' if cumulative else 'year'
+
+    def top(self, k, year=None, cumulative=True):
+        """The k leading entries in a year (default the last), with their rank and measure.
+
+        cumulative ranks on the totals up to and including year; otherwise on
+        that year alone."""
+        row = self.values[self._kind(cumulative)][self._year_pos(year)]
+        ranked = np.flatnonzero(row > 0)
+        order = ranked[top_k(row[ranked], k)]
+        frame = self.entries[order].to_frame(index=False)
+        frame['rank'] = np.arange(1, len(order) + 1)
+        frame[self.measure] = row[order]
+        return frame
+
+    def _ranks(self, table, position):
+        """Rank of the entry at position in every row of table (entries ahead, ties in entry order); 0 when unranked."""
+        value = table[:, position, None]
+        ranks = (table > value).sum(axis=1) + (table[:, :position] == value).sum(axis=1) + 1
+        return np.where(value[:, 0] > 0, ranks, 0)
+
+    def rank(self, entry, cumulative=True):
+        """Rank of one entry (a name, or a (parent_theme, theme_name) pair) in every year; <NA> when unranked."""
+        if entry not in self.entries:
+            raise KeyError(entry)
+        ranks = self._ranks(self.values[self._kind(cumulative)], self.entries.get_loc(entry))
+        return pd.Series(ranks, index=pd.Index(self.years, name='year'), name='rank').replace(0, pd.NA).astype('Int64')
+
+    def rank_table(self, cumulative=True):
+        """Rank of every entry (columns) in every year (rows); <NA> when unranked."""
+        table = self.values[self._kind(cumulative)]
+        order = np.argsort(-table, axis=1, kind='stable')
+        ranks = np.empty(table.shape, dtype=np.int64)
+        np.put_along_axis(ranks, order, np.arange(1, table.shape[1] + 1)[None, :], axis=1)
+        frame = pd.DataFrame(np.where(table > 0, ranks, 0), index=pd.Index(self.years, name='year'), columns=self.entries)
+        return frame.replace(0, pd.NA).astype('Int64')
@@ -0,0 +1,127 @@
+# Lightweight timing and memory instrumentation for report generation
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it is not available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+
+class Tracer:
+    """Records wall time, CPU time and memory for named spans of work.
+
+    Every span costs a few clock and getrusage() calls, cheap enough to leave
+    on. memory=True additionally traces Python allocations with tracemalloc
+    (noticeably slower) and records each span's allocation peak. The
+    tracemalloc peak is process-wide, so a span that overlaps one in another
+    thread (e.g. calcs run by sections.compute with workers > 1) records no
+    allocation peak. A disabled tracer records nothing and its spans are no-ops.
+    """
+
+    def __init__(self, enabled=True, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.events = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.open = []  # [thread id, overlapped] of the memory-traced spans running now
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def span(self, name, category='report', **args):
+        """Context manager timing the enclosed block."""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name, category, args):
+        if self.memory:
+            mine = [threading.get_ident(), False]
+            with self.lock:
+                for other in self.open:
+                    if other[0] != mine[0]:
+                        other[1] = mine[1] = True
+                self.open.append(mine)
+                if not mine[1]:
+                    tracemalloc.reset_peak()
+                mem_before = tracemalloc.get_traced_memory()[0]
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+            if self.memory:
+                with self.lock:
+                    self.open.remove(mine)
+                    if not mine[1]:
+                        args['alloc_peak_bytes'] = tracemalloc.get_traced_memory()[1] - mem_before
+            self.add(name, start, wall, cpu, category, **args)
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn inside a span named after it and return its result."""
+        with self.span(fn.__name__, 'calc' if fn.__name__.startswith('calc_') else 'report'):
+            return fn(*args, **kwargs)
+
+    def add(self, name, start, wall, cpu, category='report', pid=None, **args):
+        """Record a span measured elsewhere, e.g. in a worker process (start is a perf_counter value)."""
+        if not self.enabled:
+            return
+        args.setdefault('peak_rss_bytes', peak_rss() if pid is None else None)
+        event = {'name': name, 'cat': category, 'start': start, 'wall': wall, 'cpu': cpu,
+                 'pid': pid or os.getpid(), 'tid': threading.get_ident() if pid is None else pid, 'args': args}
+        with self.lock:
+            self.events.append(event)
+
+    def chrome_trace(self):
+        """The events in Chrome trace format (load in chrome://tracing or Perfetto)."""
+        events = []
+        for e in self.events:
+            args = {'cpu_ms': round(e['cpu'] * 1000, 3)}
+            args.update({k: v for k, v in e['args'].items() if v is not None})
+            events.append({'name': e['name'], 'cat': e['cat'], 'ph': 'X', 'pid': e['pid'], 'tid': e['tid'],
+                           'ts': round((e['start'] - self.origin) * 1e6, 1), 'dur': round(e['wall'] * 1e6, 1),
+                           'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """Write the Chrome trace JSON to path."""
+        if not self.enabled:
+            return
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """Plain-text table of the recorded spans in the order they finished."""
+        lines = [f"{'section':<52} {'wall ms':>10} {'cpu ms':>10} {'peak RSS MiB':>13}"]
+        for e in self.events:
+            rss = e['args'].get('peak_rss_bytes')
+            rss = f"{rss / 2**20:13.1f}" if rss else f"{'-':>13}"
+            lines.append(f"{e['name'][:52]:<52} {e['wall'] * 1000:10.1f} {e['cpu'] * 1000:10.1f} {rss}")
+        return "\n".join(lines)
+
+
+def trace_path(output_pdf):
+    """The trace file written next to a PDF: report.pdf -> report.trace.json"""
+    return os.path.splitext(output_pdf)[0] + '.trace.json'
+
+
+def default_tracer():
+    """Tracer configured from LEGO_TRACE (0 disables) and LEGO_TRACE_MEMORY (1 enables tracemalloc)."""
+    enabled = os.environ.get('LEGO_TRACE', '1') != '0'
+    memory = os.environ.get('LEGO_TRACE_MEMORY', '0') == '1'
+    return Tracer(enabled, memory)
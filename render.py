@@ -0,0 +1,176 @@
+# Chart rendering for the report, serially or over a pool of worker processes
+import inspect
+import io
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from cache import data_fingerprint, evict_images, fetch_image, read_image, store_image, write_image
+from profiling import Tracer
+
+# One chart of the report: the analysis.plot_* function to call, the file it
+# writes into IMG_DIR and the positional arguments it takes
+ChartSpec = namedtuple('ChartSpec', ['plot', 'filename', 'args'])
+
+# Seaborn style every chart starts from, whichever process draws it
+CHART_STYLE = 'whitegrid'
+
+# How charts rendered in memory are encoded: resolution, palette size (None
+# keeps 24-bit colour) and zlib level of the PNG. Charts are flat colours and
+# text, so a palette loses nothing visible and cuts the size by two thirds.
+IMAGE_PROFILES = {
+    'email': {'dpi': 72, 'colors': 64, 'compress_level': 9},
+    'screen': {'dpi': 100, 'colors': 256, 'compress_level': 6},
+    'print': {'dpi': 300, 'colors': None, 'compress_level': 6},
+}
+DEFAULT_PROFILE = 'screen'
+
+
+def _init_worker():
+    """Use the headless Agg backend in worker processes."""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def encode_figure(fig, profile=DEFAULT_PROFILE):
+    """PNG bytes of a matplotlib figure, encoded as IMAGE_PROFILES[profile] says, without alpha channel."""
+    from PIL import Image
+
+    settings = IMAGE_PROFILES[profile]
+    raw = io.BytesIO()
+    fig.savefig(raw, format='png', dpi=settings['dpi'], bbox_inches='tight', pil_kwargs={'compress_level': 0})
+    image = Image.open(raw).convert('RGB')
+    if settings['colors']:
+        image = image.quantize(settings['colors'], method=Image.Quantize.FASTOCTREE)
+    out = io.BytesIO()
+    image.save(out, format='PNG', compress_level=settings['compress_level'])
+    return out.getvalue()
+
+
+def render_chart(spec, profile=None):
+    """Draw one chart and return the path of the PNG it wrote.
+
+    With a profile (a key of IMAGE_PROFILES) nothing is written to disk and
+    the encoded PNG bytes are returned instead.
+    """
+    import analysis
+    import seaborn as sns
+
+    # Reset the global style so the output does not depend on which charts
+    # this process happened to draw before
+    sns.set_style(CHART_STYLE)
+    if profile is None:
+        getattr(analysis, spec.plot)(*spec.args)
+        return os.path.join(analysis.IMG_DIR, spec.filename)
+
+    images = {}
+    analysis.figure_sink = lambda fig, filename: images.__setitem__(filename, encode_figure(fig, profile))
+    try:
+        getattr(analysis, spec.plot)(*spec.args)
+    finally:
+        analysis.figure_sink = None
+    return images[spec.filename]
+
+
+def _render_timed(spec, profile=None):
+    """render_chart() plus its timings, for spans measured in worker processes."""
+    from profiling import peak_rss
+
+    start, cpu = time.perf_counter(), time.process_time()
+    image = render_chart(spec, profile)
+    return image, start, time.perf_counter() - start, time.process_time() - cpu, os.getpid(), peak_rss()
+
+
+def default_workers():
+    """Worker count from LEGO_RENDER_WORKERS; 0 means one per CPU, unset means serial."""
+    value = os.environ.get('LEGO_RENDER_WORKERS', '1')
+    try:
+        workers = int(value)
+    except ValueError:
+        raise ValueError(f"LEGO_RENDER_WORKERS must be an integer, got {value!r}") from None
+    if workers < 0:
+        raise ValueError(f"LEGO_RENDER_WORKERS must be at least 0, got {workers}")
+    return workers or os.cpu_count() or 1
+
+
+def chart_key(spec, profile=None):
+    """Fingerprint of a chart: its input data plus everything that decides how it is drawn and encoded."""
+    import analysis
+    import matplotlib
+    import PIL
+    import seaborn as sns
+
+    plot = getattr(analysis, spec.plot)
+    digest = data_fingerprint(spec.args)
+    params = (spec.plot, spec.filename, CHART_STYLE, inspect.getsource(plot), matplotlib.__version__, sns.__version__)
+    if profile is not None:
+        params += (IMAGE_PROFILES[profile], inspect.getsource(encode_figure), PIL.__version__)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+def _draw(specs, workers, tracer, profile=None):
+    """Draw the given charts, in a process pool when workers > 1, recording one span per chart."""
+    workers = min(workers, len(specs))
+    if workers <= 1:
+        results = [_render_timed(spec, profile) for spec in specs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = list(pool.map(partial(_render_timed, profile=profile), specs))
+
+    for spec, (_, start, wall, cpu, pid, rss) in zip(specs, results):
+        tracer.add(spec.plot, start, wall, cpu, 'plot', pid=pid, peak_rss_bytes=rss)
+    return [result[0] for result in results]
+
+
+def render_charts(specs, workers=None, use_cache=True, cache_dir=None, tracer=None, profile=None):
+    """Render the charts and return their paths in the order of specs, plus a cache summary.
+
+    With a profile (a key of IMAGE_PROFILES) the charts stay in memory and
+    their PNG bytes are returned instead of paths; nothing is written to
+    IMG_DIR. Charts whose fingerprint is already in the image cache are taken
+    from it instead of being redrawn. With workers > 1 the remaining charts
+    are drawn in a process pool; the images are identical to the ones the
+    serial path produces. The summary is a dict with the 'hits' and 'misses'
+    file names. A profiling.Tracer, if given, gets one span per drawn chart.
+    """
+    import analysis
+
+    tracer = tracer or Tracer(enabled=False)
+    workers = default_workers() if workers is None else (workers or os.cpu_count() or 1)
+    cache_dir = cache_dir or analysis.CACHE_DIR
+    if profile is None:
+        results = [os.path.join(analysis.IMG_DIR, spec.filename) for spec in specs]
+    else:
+        results = [None] * len(specs)
+    summary = {'hits': [], 'misses': []}
+
+    todo = []
+    with tracer.span('chart_cache_lookup'):
+        keys = [chart_key(spec, profile) for spec in specs] if use_cache else [None] * len(specs)
+        for i, (spec, key) in enumerate(zip(specs, keys)):
+            if key and profile is not None:
+                results[i] = read_image(cache_dir, key)
+                hit = results[i] is not None
+            else:
+                hit = key is not None and fetch_image(cache_dir, key, results[i])
+            if hit:
+                summary['hits'].append(spec.filename)
+            else:
+                summary['misses'].append(spec.filename)
+                todo.append((i, spec, key))
+
+    drawn = _draw([spec for _, spec, _ in todo], workers, tracer, profile)
+    for (i, _, _), image in zip(todo, drawn):
+        results[i] = image
+    if use_cache:
+        with tracer.span('chart_cache_store'):
+            for (_, _, key), image in zip(todo, drawn):
+                if profile is None:
+                    store_image(cache_dir, key, image)
+                else:
+                    write_image(cache_dir, key, image)
+            evict_images(cache_dir)
+    return results, summary
@@ -1,19 +1,37 @@
 # report.py
 import os
+import struct
 from analysis import *
 from fpdf import FPDF
-import matplotlib.pyplot as plt
+from render import DEFAULT_PROFILE, default_workers, render_charts
+from sections import build, select_sections
+from streaming import stream_aggregates
+from profiling import Tracer, default_tracer, trace_path
 
 # Create a folder to store plot images
 #IMG_DIR = "report_images"
 #os.makedirs(IMG_DIR, exist_ok=True)
 
-# Helper function to save a plot to image
-def save_plot(filename):
-    path = os.path.join(IMG_DIR, filename)
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight')
-    plt.close()
+# Helper function to read an in-memory PNG the way fpdf reads image files
+def png_info(data):
+    """fpdf image entry for PNG bytes without alpha channel (as render.encode_figure() writes them)."""
+    width, height, bpc, color_type = struct.unpack('>IIBB', data[16:26])
+    if color_type not in (0, 2, 3) or data[28]:
+        raise ValueError("Only non-interlaced grey, RGB or palette PNGs can be embedded from memory")
+    colorspace = {0: 'DeviceGray', 2: 'DeviceRGB', 3: 'Indexed'}[color_type]
+    palette, chunks, pos = b'', [], 8
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        if kind == b'PLTE':
+            palette = data[pos + 8:pos + 8 + length]
+        elif kind == b'IDAT':
+            chunks.append(data[pos + 8:pos + 8 + length])
+        pos += length + 12 # length, type, data, CRC
+    colors = 3 if colorspace == 'DeviceRGB' else 1
+    # The IDAT stream is zlib data with PNG row filters, which PDF decodes with predictor 15
+    return {'w': width, 'h': height, 'cs': colorspace, 'bpc': bpc, 'f': 'FlateDecode',
+            'dp': f'/Predictor 15 /Colors {colors} /BitsPerComponent {bpc} /Columns {width}',
+            'pal': palette, 'trns': '', 'data': b''.join(chunks)}
 
 # Create and configure PDF
 class PDF(FPDF):
@@ -35,6 +53,15 @@ class PDF(FPDF):
     def add_image(self, image_path, width=180):
         self.image(image_path, w=width)
         self.ln(10)
+
+    def add_image_data(self, name, data, width=180):
+        # fpdf only loads images from files; registering the parsed PNG under
+        # name makes image() use it as if it had read it from disk
+        if name not in self.images:
+            info = png_info(data)
+            info['i'] = len(self.images) + 1
+            self.images[name] = info
+        self.add_image(name, width)
         
     def add_table(self, data, col_widths=None):
         self.set_font("Arial", "", 10)
@@ -48,100 +75,95 @@ class PDF(FPDF):
                 self.cell(width, line_height, str(datum), border=1)
             self.ln(line_height)
 
-def main():
-    merged = load_data()
+def build_sections(merged, cube, tracer=None, only=None, workers=1, sketches=None):
+    """Run the calculations and describe the report, section by section, in order.
+
+    merged is only used by the set-size charts; it can be the merged rows or the
+    weighted part counts of the streaming mode. Either input can be None, in
+    which case it is loaded; so can the set-size sketches, which are then
+    built from merged. only restricts the report to the given section
+    keys or tags (see sections.SECTIONS); nothing else is computed.
+
+    Every section is a (title, blocks) pair. A block is ('paragraph', text),
+    ('table', rows, col_widths) or ('chart', ChartSpec). Each calculation is
+    recorded as a span of tracer, if given.
+    """
+    known = (('merged', merged), ('cube', cube), ('size_sketches', sketches))
+    values = {name: value for name, value in known if value is not None}
+    return build(select_sections(only), values, workers, tracer)
+
+def chart_specs(sections):
+    """All charts of the report in section order."""
+    return [block[1] for _, blocks in sections for block in blocks if block[0] == 'chart']
+
+def write_pdf(sections, images, output_pdf, tracer=None):
+    """Assemble the PDF from the sections; images maps chart file names to rendered paths or PNG bytes."""
+    t = tracer or Tracer(enabled=False)
     pdf = PDF()
     pdf.add_page()
-
-    # --- Star Wars Analysis ---
-    pdf.chapter_title("Star Wars Sets")
-    sw_percentage, star_wars = calc_star_wars_percentage(merged)
-    sw_peak_year = calc_peak_star_wars_year(star_wars)
-    pdf.add_paragraph(f"Percentage of licensed sets that are Star Wars: {sw_percentage}%.")
-    pdf.add_paragraph(f"Year with the most Star Wars sets released: {sw_peak_year}.")
-
-    # --- Sets Over Time ---
-    pdf.chapter_title("Set Release Over Time")
-    plot_sets_over_time(merged)
-    pdf.add_image(os.path.join('images', "sets_over_time.png"))
-
-    # --- Top 5 Parent Themes ---
-    pdf.chapter_title("Top 5 Most Common Parent Themes")
-    top_themes = calc_top_themes_by_set_count(merged)
-    #pdf.add_paragraph(top_themes.to_string(index=False))
-    top_themes_table = [top_themes.columns.tolist()] + top_themes.values.tolist()
-    col_widths = [60, 40, 40] 
-    pdf.add_table(top_themes_table, col_widths=col_widths)
-    plot_top_themes(top_themes)
-    pdf.add_image(os.path.join('images', "top_themes.png"))
-
-    # --- Licensed Sets Percentage ---
-    pdf.chapter_title("Licensed Sets Percentage")
-    licensed_counts, licensed_percentage = calc_licensed_percentage(merged)
-    pdf.add_paragraph(f"Licensed sets account for {licensed_percentage}% of all LEGO sets.")
-    plot_licenses_percentage(licensed_counts)
-    pdf.add_image(os.path.join('images', "licensed_percentage.png"))
-
-    # --- Licensed Themes with Most Sets ---
-    pdf.chapter_title("Licensed Themes with the Most Sets")
-    licensed_themes = calc_licensed_highest_sets(merged)
-    licensed_themes_table = [licensed_themes.columns.tolist()] + licensed_themes.values.tolist()
-    col_widths = [60, 40, 40] 
-    pdf.add_table(licensed_themes_table, col_widths=col_widths)
-    plot_licensed_highest_sets(licensed_themes)
-    pdf.add_image(os.path.join('images', "licensed_highest.png"))
-
-    # --- Set Count Trends for Top 5 Themes ---
-    pdf.chapter_title("Set Count Trends for Top 5 Themes")
-    top5_themes_data = calc_set_count_for_top_themes(merged)
-    plot_set_count_for_top_themes(top5_themes_data)
-    pdf.add_image(os.path.join('images', "top5_trends.png"))
-
-    # --- Licensed vs Non-Licensed Sets Over Time ---
-    pdf.chapter_title("Licensed vs Non-Licensed Sets Over Time")
-    licensed_trends = calc_licensed_non_licensed_sets(merged)
-    plot_licensed_non_licensed_sets(licensed_trends)
-    pdf.add_image(os.path.join('images', "licensed_trend.png"))
-
-    # --- Box Plot: Set Size Comparison ---
-    pdf.chapter_title("Set Size Comparison (Boxplot)")
-    box_plot_set_comparison_licensed_non_licensed(merged)
-    pdf.add_image(os.path.join('images', "boxplot_comparison.png"))
-
-    # --- Sub-themes in Top 3 Parent Themes ---
-    pdf.chapter_title("Sub-themes in Top 3 Parent Themes")
-    subtheme_counts = calc_subthemes_top_3_parent_themes(merged)
-    plot_subthemes_top_3_parent_themes(subtheme_counts)
-    pdf.add_image(os.path.join('images', "subthemes_top3.png"))
-    
-    # --- Set Size Distribution Across Sets ---
-    pdf.chapter_title("Set Size Distribution Across Sets")
-    merged_df = calc_distribution_set_sizes(merged)
-    plot_distribution_set_sizes(merged_df)
-    pdf.add_image(os.path.join('images', "distribution_set_sizes.png"))
-    
-    # --- Highest Number of Themes Introduced ---
-    pdf.chapter_title("Highest Number of Themes Introduced")
-    highest_num_themes, themes_per_year = calc_top_new_theme_year(merged)
-    pdf.add_paragraph(f"The highest number of new themes was introduced in: {highest_num_themes.iloc[0,0]}.\n" )
-    plot_top_new_theme_year(themes_per_year)
-    pdf.add_image(os.path.join('images', "top_new_themes_year.png"))
-    
-    # --- Average Number of Parts for the Top 5 Themes Over Time ---
-    pdf.chapter_title("Average Number of Parts for the Top 5 Themes Over Time")
-    avg_part_trend = calc_set_compexity_top_themes(merged)
-    plot_set_complexity_top_themes(avg_part_trend)
-    pdf.add_image(os.path.join('images', "set_complexity_top_themes.png"))
-    
-    #--- Theme Popularity vs. Set Complexity ---
-    pdf.chapter_title("Theme Popularity vs. Set Complexity")
-    theme_stats = calc_theme_set_complexity_corr(merged)
-    plot_theme_set_complexity_corr(theme_stats)
-    pdf.add_image(os.path.join('images', "theme_set_complexity_corr.png"))
+    for title, blocks in sections:
+        pdf.chapter_title(title)
+        for block in blocks:
+            if block[0] == 'paragraph':
+                pdf.add_paragraph(block[1])
+            elif block[0] == 'table':
+                pdf.add_table(block[1], col_widths=block[2])
+            else:
+                filename = block[1].filename
+                with t.span("embed " + filename, 'pdf'):
+                    if isinstance(images[filename], bytes):
+                        pdf.add_image_data(filename, images[filename])
+                    else:
+                        pdf.add_image(images[filename])
+    with t.span("pdf.output", 'pdf'):
+        pdf.output(output_pdf)
+
+def main(workers=None, output_pdf="lego_analysis_report.pdf", use_cache=True, chunksize=None, tracer=None, only=None,
+         profile=DEFAULT_PROFILE, sets_path=None, themes_path=None, cube=None, parts=None):
+    """Build the report. workers > 1 renders the charts in a process pool and
+    runs independent calculations in threads; use_cache=False redraws every
+    chart instead of reusing unchanged ones; chunksize reads the catalog in
+    chunks instead of loading it whole; only limits the report to the given
+    section keys or tags. The charts are rendered in memory and embedded
+    with the image profile given (see render.IMAGE_PROFILES). sets_path and
+    themes_path replace the configured input CSVs (SETS_CSV, THEMES_CSV).
+    cube and parts, an aggregate cube and the weighted part counts (e.g.
+    incremental.CatalogState.cube() and parts()), replace the catalog as
+    the streaming mode's aggregates do; nothing is then read from the CSVs.
+
+    Timings are recorded by tracer (profiling.default_tracer() unless given),
+    written as a Chrome trace next to the PDF and summarised at the end."""
+    t = tracer or default_tracer()
+    merged = sketches = None # Loaded by the section graph, and only if a requested section needs them
+    if cube is not None:
+        merged = parts
+    elif chunksize:
+        # Out-of-core: aggregate chunk by chunk, set sizes come as weighted counts and sketches
+        cube, merged, sketches = t.call(stream_aggregates, sets_path, themes_path, chunksize=chunksize)
+    elif sets_path or themes_path:
+        merged = t.call(load_data, sets_path, themes_path)
+    calc_workers = default_workers() if workers is None else (workers or os.cpu_count() or 1)
+    sections = build_sections(merged, cube, t, only=only, workers=calc_workers, sketches=sketches)
+
+    # Render every chart first, then lay the PDF out in the original order
+    specs = chart_specs(sections)
+    rendered, summary = render_charts(specs, workers=workers, use_cache=use_cache, tracer=t, profile=profile)
+    images = {spec.filename: image for spec, image in zip(specs, rendered)}
+    print(f"Charts: {len(summary['hits'])} reused from cache, {len(summary['misses'])} rendered")
+    if summary['misses'] and summary['hits']:
+        print("  rendered: " + ", ".join(summary['misses']))
 
     # Save PDF
-    output_pdf = "lego_analysis_report.pdf"
-    pdf.output(output_pdf)
+    write_pdf(sections, images, output_pdf, t)
     print(f"\n Report saved as: {output_pdf}")
 
-main()
+    if t.enabled:
+        t.write(trace_path(output_pdf))
+        print(f"\n{t.summary()}\n Trace saved as: {trace_path(output_pdf)}")
+
+if __name__ == "__main__":
+    # The command-line options live in cli.py; `python report.py ...` is `python cli.py pdf ...`
+    import sys
+    import cli
+
+    sys.exit(cli.main(['pdf'] + sys.argv[1:]))
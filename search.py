@@ -0,0 +1,419 @@
+# Character n-gram index over set names: ranked fuzzy search and similar-set lookup
+#
+# Names are lowercased, with punctuation turned into spaces, and every distinct
+# name is split into overlapping NGRAM-character grams ("falcon" -> " fa",
+# "fal", "alc", ...). The index maps each gram to the distinct names holding
+# it and each name to its rows, so a query only looks at the names sharing a
+# gram with it, however many rows the catalog has.
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cache import CACHE_VERSION, check_sources, load_frame, publish_directory, read_meta, save_frame
+from leaderboard import top_k
+
+NGRAM = 3
+
+# Catalog columns kept in the index and returned by its queries
+INDEX_COLUMNS = ['set_num', 'name', 'year', 'theme_name', 'parent_theme', 'num_parts']
+
+DEFAULT_LIMIT = 20
+
+# Names scoring below this are left out of search() results
+MIN_SCORE = 0.5
+
+# Weights of name, theme and size similarity in similar(). Its candidates are
+# the sets of the SIMILAR_NAMES most similar names and of the same theme, of
+# each at most SIMILAR_WINDOW either side of the reference part count.
+SIMILARITY_WEIGHTS = {'name': 0.5, 'theme': 0.25, 'parts': 0.25}
+SIMILAR_NAMES = 50
+SIMILAR_WINDOW = 100
+
+
+def normalize(text):
+    """Lowercase text with every run of punctuation and spaces as one space."""
+    return re.sub(r'[\W_]+', ' ', text.lower()).strip() if isinstance(text, str) else ''
+
+
+def ngrams(text, n=NGRAM):
+    """The distinct n-grams of normalize(text), padded with a space at each end."""
+    text = normalize(text)
+    if not text:
+        return set()
+    padded = f' {text} '
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def theme_key(parent_theme, theme_name):
+    """(parent_theme, theme_name) identifying a theme in the index, with '' for a missing value."""
+    return tuple(value if isinstance(value, str) else '' for value in (parent_theme, theme_name))
+
+
+def index_frame(frame):
+    """The INDEX_COLUMNS of merged rows (name_ls) or lego_sets.csv rows (name), renumbered from 0."""
+    return frame.rename(columns={'name_ls': 'name'})[INDEX_COLUMNS].reset_index(drop=True)
+
+
+class Postings:
+    """Integer values listed per integer key.
+
+    The values built in one go are kept sorted by key (and within a key by
+    order_by, if given) in one array with an offset per key (CSR). A key that
+    values are added to afterwards gets its whole list, still in order, in a
+    dictionary until compacted() folds them back in.
+    """
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+        self.extra = {}  # key -> all of its values, once values were added to it
+
+    @classmethod
+    def build(cls, keys, values, size, order_by=None):
+        keys = np.asarray(keys, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=size), out=offsets[1:])
+        order = np.argsort(keys, kind='stable') if order_by is None else np.lexsort((order_by[values], keys))
+        return cls(offsets, values[order])
+
+    def base(self, key):
+        """The values of key built in one go, in their order."""
+        return self.values[self.offsets[key]:self.offsets[key + 1]] if key < len(self.offsets) - 1 else self.values[:0]
+
+    def get(self, key):
+        """All values of key, in order."""
+        extra = self.extra.get(key)
+        return self.base(key) if extra is None else extra
+
+    def add(self, key, values, order_by=None):
+        """Add values to key, merged into its order by order_by (if given) after any equal ones."""
+        merged = np.concatenate([self.get(key), np.asarray(values, dtype=np.int64)])
+        if order_by is not None:
+            merged = merged[np.argsort(order_by[merged], kind='stable')]
+        self.extra[key] = merged
+
+    def compacted(self, size, order_by=None):
+        """The same postings as one CSR over keys 0..size-1."""
+        keys = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        keep = ~np.isin(keys, np.fromiter(self.extra, dtype=np.int64, count=len(self.extra)))
+        extra_keys = [np.full(len(values), key, dtype=np.int64) for key, values in self.extra.items()]
+        return Postings.build(np.concatenate([keys[keep]] + extra_keys),
+                              np.concatenate([self.values[keep]] + list(self.extra.values())), size, order_by)
+
+
+class NameIndex:
+    """Fuzzy search over the set names and set numbers of a catalog.
+
+    search() ranks the distinct names sharing grams with the query by the mean
+    of two scores: the share of the query's grams they hold (so longer names
+    containing the query still rank high) and the Dice coefficient of both
+    gram sets (so closer matches rank first). similar() ranks sets by name
+    similarity, theme and part count. add() indexes new or corrected rows
+    without rebuilding; save() writes everything back as one index.
+    """
+
+    def __init__(self, table, names, grams, themes, row_name, row_theme, live, set_order,
+                 name_size, gram_names, name_rows, theme_rows):
+        self.table = table            # INDEX_COLUMNS of the rows indexed when built or loaded
+        self.added = []               # frames of rows added since
+        self._added_table = None
+        self.names = names            # distinct names, by name id
+        self.grams = grams            # gram -> gram id
+        self.themes = themes          # distinct (parent_theme, theme_name), by theme id
+        self.row_name = row_name      # name id per row
+        self.row_theme = row_theme    # theme id per row
+        self.row_parts = table['num_parts'].to_numpy(dtype=float)
+        self.live = live              # False for rows replaced by a later row of the same set_num
+        self.name_size = name_size    # number of grams per name id
+        self.gram_names = gram_names  # Postings: gram id -> name ids
+        self.name_rows = name_rows    # Postings: name id -> rows, by num_parts
+        self.theme_rows = theme_rows  # Postings: theme id -> rows, by num_parts
+        self.name_ids = {name: i for i, name in enumerate(names)}
+        self.theme_ids = {theme: i for i, theme in enumerate(themes)}
+        self.theme_parent = np.array([parent for parent, _ in themes], dtype=str)
+        # Rows of the table sorted by set_num, for set number lookups; added rows by set_num
+        self.set_order = set_order
+        self.set_sorted = table['set_num'].to_numpy(dtype=object)[set_order]
+        self.added_sets = {}
+        self.sources = None           # fingerprints of the source files, when built or loaded by cached_index()
+
+    @classmethod
+    def build(cls, merged):
+        """Index merged rows (as returned by load_data())."""
+        table = index_frame(merged)
+        row_name, names = pd.factorize(table['name'].astype(object).fillna(''))
+        row_theme, themes = pd.MultiIndex.from_arrays(
+            [table[column].astype(object).fillna('') for column in ('parent_theme', 'theme_name')]).factorize()
+        names, themes = list(names), list(themes)
+
+        grams, gram_keys, gram_values, name_size = {}, [], [], np.zeros(len(names), dtype=np.int64)
+        for name_id, name in enumerate(names):
+            name_grams = ngrams(name)
+            name_size[name_id] = len(name_grams)
+            for gram in name_grams:
+                gram_keys.append(grams.setdefault(gram, len(grams)))
+                gram_values.append(name_id)
+
+        rows, parts = np.arange(len(table)), table['num_parts'].to_numpy(dtype=float)
+        return cls(table, names, grams, themes, row_name.astype(np.int64), row_theme.astype(np.int64),
+                   np.ones(len(table), dtype=bool), cls._set_order(table), name_size,
+                   Postings.build(gram_keys, gram_values, len(grams)),
+                   Postings.build(row_name, rows, len(names), parts), Postings.build(row_theme, rows, len(themes), parts))
+
+    @staticmethod
+    def _set_order(table):
+        set_nums = table['set_num']
+        present = np.flatnonzero(set_nums.notna().to_numpy())
+        return present[np.argsort(set_nums.to_numpy(dtype=object)[present].astype(str), kind='stable')]
+
+    def __len__(self):
+        return int(self.live.sum())
+
+    # --- rows ---
+
+    def _rows(self, positions):
+        """INDEX_COLUMNS of the rows at positions, in that order."""
+        positions = np.asarray(positions, dtype=np.int64)
+        base = len(self.table)
+        if not self.added or (positions < base).all():
+            return self.table.iloc[positions].reset_index(drop=True)
+        if self._added_table is None:
+            self._added_table = pd.concat(self.added, ignore_index=True)
+        in_table = positions < base
+        rows = pd.concat([self.table.iloc[positions[in_table]].astype(object),
+                          self._added_table.iloc[positions[~in_table] - base].astype(object)], ignore_index=True)
+        order = np.concatenate([np.flatnonzero(in_table), np.flatnonzero(~in_table)])
+        return rows.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+
+    def find(self, set_num):
+        """Position of the current row of a set number, or None."""
+        if set_num in self.added_sets:
+            return self.added_sets[set_num]
+        lo = np.searchsorted(self.set_sorted, set_num, side='left')
+        hi = np.searchsorted(self.set_sorted, set_num, side='right')
+        live = self.set_order[lo:hi][self.live[self.set_order[lo:hi]]]
+        return int(live[0]) if len(live) else None
+
+    def _set_prefix(self, prefix, limit):
+        """Positions of live rows whose set number starts with prefix, at most limit of them."""
+        lo = np.searchsorted(self.set_sorted, prefix, side='left')
+        hi = np.searchsorted(self.set_sorted, prefix + '\U0010ffff', side='left')
+        found = self.set_order[lo:hi][self.live[self.set_order[lo:hi]]][:limit]
+        added = [pos for set_num, pos in self.added_sets.items() if set_num.startswith(prefix)]
+        return np.concatenate([found, np.asarray(added, dtype=np.int64)])[:limit]
+
+    # --- queries ---
+
+    def _name_scores(self, grams):
+        """Ids of the names sharing grams with a query, and their scores."""
+        postings = [self.gram_names.get(self.grams[gram]) for gram in grams if gram in self.grams]
+        if not postings:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ids, shared = np.unique(np.concatenate(postings), return_counts=True)
+        coverage = shared / len(grams)
+        dice = 2 * shared / (len(grams) + self.name_size[ids])
+        return ids, (coverage + dice) / 2
+
+    def search(self, query, limit=DEFAULT_LIMIT, min_score=MIN_SCORE):
+        """Rows whose name matches query best (or whose set number starts with it), with a score column.
+
+        Sets sharing a name score the same and come by part count."""
+        query = query.strip()
+        positions, scores = [], []
+        if query and ' ' not in query:
+            found = self._set_prefix(query, limit)
+            positions.append(found)
+            scores.append(np.ones(len(found)))
+
+        ids, name_scores = self._name_scores(ngrams(query))
+        keep = name_scores >= min_score
+        ids, name_scores = ids[keep], name_scores[keep]
+        count = sum(len(p) for p in positions)
+        for i in top_k(name_scores, None):
+            if count >= limit:
+                break
+            rows = self.name_rows.get(ids[i])
+            rows = rows[self.live[rows]][:limit - count]
+            positions.append(rows)
+            scores.append(np.full(len(rows), name_scores[i]))
+            count += len(rows)
+
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.empty(0)
+        # A set found by its number and by its name is listed once, where its number put it
+        _, first = np.unique(positions, return_index=True)
+        first = np.sort(first)[:limit]
+        result = self._rows(positions[first])
+        result['score'] = scores[first]
+        return result
+
+    def _closest(self, postings, key, parts):
+        """The rows of a key of name_rows or theme_rows with the SIMILAR_WINDOW part counts either side of parts."""
+        rows = postings.get(key)
+        lo, hi = 0, len(rows)
+        while lo < hi:  # Bisect the rows, sorted by part count with missing counts last
+            mid = (lo + hi) // 2
+            if self.row_parts[rows[mid]] < parts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return rows[max(lo - SIMILAR_WINDOW, 0):lo + SIMILAR_WINDOW]
+
+    def similar(self, set_num, limit=10):
+        """The sets most like set_num: similar name, same theme (or parent theme) and close part count.
+
+        Scored as the SIMILARITY_WEIGHTS mean of the name score of search(),
+        1 for the same theme (0.5 for the same parent theme only) and
+        1 / (1 + |log(1 + parts) - log(1 + reference parts)|) (0 when either
+        part count is missing). Raises KeyError for an unknown set number."""
+        pos = self.find(set_num)
+        if pos is None:
+            raise KeyError(set_num)
+        name_id, theme_id, parts = self.row_name[pos], self.row_theme[pos], self.row_parts[pos]
+
+        ids, name_scores = self._name_scores(ngrams(self.names[name_id]))
+        closest = ids[top_k(name_scores, SIMILAR_NAMES)]
+        candidates = np.unique(np.concatenate([self._closest(self.name_rows, i, parts) for i in closest]
+                                              + [self._closest(self.theme_rows, theme_id, parts)]))
+        candidates = candidates[self.live[candidates] & (candidates != pos)]
+
+        name = np.zeros(len(candidates))
+        if len(ids):
+            at = np.minimum(np.searchsorted(ids, self.row_name[candidates]), len(ids) - 1)
+            match = ids[at] == self.row_name[candidates]
+            name[match] = name_scores[at[match]]
+        themes = self.row_theme[candidates]
+        theme = np.where(themes == theme_id, 1.0, np.where(self.theme_parent[themes] == self.theme_parent[theme_id], 0.5, 0.0))
+        with np.errstate(invalid='ignore'):
+            size = 1 / (1 + np.abs(np.log1p(self.row_parts[candidates]) - np.log1p(parts)))
+        size = np.nan_to_num(size, nan=0.0)
+
+        score = (SIMILARITY_WEIGHTS['name'] * name + SIMILARITY_WEIGHTS['theme'] * theme
+                 + SIMILARITY_WEIGHTS['parts'] * size)
+        best = top_k(score, limit)
+        result = self._rows(candidates[best])
+        result['score'] = score[best]
+        return result
+
+    # --- updates ---
+
+    def add(self, batch):
+        """Index a batch of new or corrected rows (merged or lego_sets.csv columns) and return its size.
+
+        A row whose set_num is already indexed replaces the earlier row, as in
+        incremental.CatalogState.apply(). The postings grow in time
+        proportional to the batch; the per-row arrays are extended with one
+        copy per batch."""
+        batch = index_frame(batch)
+        start = len(self.live)
+        row_name, row_theme, name_grams = [], [], {}
+        for offset, row in enumerate(batch.itertuples(index=False)):
+            pos = start + offset
+            if isinstance(row.set_num, str):
+                previous = self.find(row.set_num)
+                if previous is not None:
+                    self.live[previous] = False
+                self.added_sets[row.set_num] = pos
+
+            name = row.name if isinstance(row.name, str) else ''
+            if name not in self.name_ids:
+                self.name_ids[name] = len(self.names)
+                self.names.append(name)
+                grams = ngrams(name)
+                self.name_size = np.append(self.name_size, len(grams))
+                for gram in grams:
+                    name_grams.setdefault(self.grams.setdefault(gram, len(self.grams)), []).append(self.name_ids[name])
+            theme = theme_key(row.parent_theme, row.theme_name)
+            if theme not in self.theme_ids:
+                self.theme_ids[theme] = len(self.themes)
+                self.themes.append(theme)
+                self.theme_parent = np.append(self.theme_parent, theme[0])
+            row_name.append(self.name_ids[name])
+            row_theme.append(self.theme_ids[theme])
+
+        self.row_name = np.concatenate([self.row_name, np.asarray(row_name, dtype=np.int64)])
+        self.row_theme = np.concatenate([self.row_theme, np.asarray(row_theme, dtype=np.int64)])
+        self.row_parts = np.concatenate([self.row_parts, batch['num_parts'].to_numpy(dtype=float)])
+        self.live = np.concatenate([self.live, np.ones(len(batch), dtype=bool)])
+        # Each touched list is merged once per batch, rows by part count as when built
+        for gram_id, name_ids in name_grams.items():
+            self.gram_names.add(gram_id, name_ids)
+        positions = np.arange(start, start + len(batch))
+        for postings, keys in ((self.name_rows, row_name), (self.theme_rows, row_theme)):
+            keys = np.asarray(keys, dtype=np.int64)
+            for key in np.unique(keys):
+                postings.add(int(key), positions[keys == key], self.row_parts)
+        self.added.append(batch)
+        self._added_table = None
+        return len(batch)
+
+    # --- persistence ---
+
+    def save(self, directory, extra=None):
+        """Write the index, with every added row folded in, into directory (replacing it).
+
+        The fingerprints of the source files it was built from (self.sources,
+        set by cached_index()) are written with it, so cached_index() keeps
+        reusing it, added rows included, until a source file changes."""
+        table = pd.concat([self.table] + self.added, ignore_index=True) if self.added else self.table
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+        save_frame(table, os.path.join(tmp, 'rows'))
+        gram_names = self.gram_names.compacted(len(self.grams))
+        name_rows = self.name_rows.compacted(len(self.names), self.row_parts)
+        theme_rows = self.theme_rows.compacted(len(self.themes), self.row_parts)
+        np.savez(os.path.join(tmp, 'index.npz'),
+                 names=np.asarray(self.names, dtype=str), grams=np.asarray(list(self.grams), dtype=str),
+                 theme_parents=np.asarray([p for p, _ in self.themes], dtype=str),
+                 theme_names=np.asarray([t for _, t in self.themes], dtype=str),
+                 row_name=self.row_name, row_theme=self.row_theme, live=self.live,
+                 set_order=self._set_order(table), name_size=self.name_size,
+                 gram_offsets=gram_names.offsets, gram_values=gram_names.values,
+                 name_row_offsets=name_rows.offsets, name_row_values=name_rows.values,
+                 theme_row_offsets=theme_rows.offsets, theme_row_values=theme_rows.values)
+
+        meta = {'version': CACHE_VERSION, 'kind': 'name_index', 'ngram': NGRAM, 'rows': len(table)}
+        if self.sources is not None:
+            meta['sources'] = self.sources
+        meta.update(extra or {})
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        publish_directory(tmp, directory)
+
+    @classmethod
+    def load(cls, directory):
+        """Read an index written by save()."""
+        table = load_frame(os.path.join(directory, 'rows'), mmap=False)
+        with np.load(os.path.join(directory, 'index.npz')) as a:
+            themes = list(zip(a['theme_parents'].tolist(), a['theme_names'].tolist()))
+            return cls(table, a['names'].tolist(), {gram: i for i, gram in enumerate(a['grams'].tolist())}, themes,
+                       a['row_name'], a['row_theme'], a['live'], a['set_order'], a['name_size'],
+                       Postings(a['gram_offsets'], a['gram_values']),
+                       Postings(a['name_row_offsets'], a['name_row_values']),
+                       Postings(a['theme_row_offsets'], a['theme_row_values']))
+
+
+def cached_index(name, sources, build, cache_dir):
+    """Return build() (a NameIndex) from the cache, rebuilding it when any source file changed.
+
+    An index saved back to the same directory after add() is reused with its
+    added rows; a change to a source file rebuilds it from them alone."""
+    directory = os.path.join(cache_dir, name)
+    meta = read_meta(directory)
+    current, fresh = check_sources(directory, meta, sources)
+    if fresh and meta.get('kind') == 'name_index' and meta.get('ngram') == NGRAM:
+        index = NameIndex.load(directory)
+    else:
+        index = build()
+        index.sources = current
+        index.save(directory)
+        return index
+    index.sources = current
+    return index
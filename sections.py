@@ -0,0 +1,166 @@
+# Report sections declared as a dependency graph of calculation nodes
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import analysis
+from profiling import Tracer
+from render import ChartSpec
+
+# A calculation: fn is called with the values of deps, in order
+Node = namedtuple('Node', ['deps', 'fn'])
+
+# A report section: the nodes it reads and a function turning their values
+# into blocks ('paragraph', text), ('table', rows, col_widths) or ('chart', ChartSpec)
+Section = namedtuple('Section', ['key', 'title', 'tags', 'needs', 'blocks'])
+
+NODES = {
+    'merged': Node((), analysis.load_data),
+    'cube': Node(('merged',), analysis.build_cube),
+    # Intermediate results shared between sections
+    'licensed': Node(('cube',), lambda cube: cube.where(is_licensed=True)),
+    'theme_ranking': Node(('cube',), analysis.rank_parent_themes),
+    # calc_* answers
+    'star_wars': Node(('licensed',), analysis.calc_star_wars_percentage),
+    'star_wars_peak': Node(('star_wars',), lambda star_wars: analysis.calc_peak_star_wars_year(star_wars[1])),
+    'top_themes': Node(('cube',), analysis.calc_top_themes_by_set_count),
+    'licensed_percentage': Node(('cube',), analysis.calc_licensed_percentage),
+    'licensed_themes': Node(('licensed',), analysis.calc_licensed_highest_sets),
+    'top5_themes_data': Node(('cube',), analysis.calc_set_count_for_top_themes),
+    'licensed_trends': Node(('cube',), analysis.calc_licensed_non_licensed_sets),
+    'subtheme_counts': Node(('cube', 'theme_ranking'), analysis.calc_subthemes_top_3_parent_themes),
+    'size_sketches': Node(('merged',), analysis.calc_size_sketches),
+    'size_comparison': Node(('size_sketches',), analysis.calc_set_size_comparison),
+    'set_sizes': Node(('merged', 'size_sketches'), analysis.calc_distribution_set_sizes),
+    'new_themes': Node(('cube',), analysis.calc_top_new_theme_year),
+    'avg_part_trend': Node(('cube', 'theme_ranking'), analysis.calc_set_compexity_top_themes),
+    'theme_stats': Node(('cube',), analysis.calc_theme_set_complexity_corr),
+}
+
+
+def _table(frame):
+    return [frame.columns.tolist()] + frame.values.tolist()
+
+
+SECTIONS = [
+    Section('star_wars', "Star Wars Sets", ('licensed',), ('star_wars', 'star_wars_peak'), lambda r: [
+        ('paragraph', f"Percentage of licensed sets that are Star Wars: {r['star_wars'][0]}%."),
+        ('paragraph', f"Year with the most Star Wars sets released: {r['star_wars_peak']}."),
+    ]),
+    Section('sets_over_time', "Set Release Over Time", ('trends',), ('cube',), lambda r: [
+        ('chart', ChartSpec('plot_sets_over_time', "sets_over_time.png", (r['cube'],))),
+    ]),
+    Section('top_themes', "Top 5 Most Common Parent Themes", ('themes',), ('top_themes',), lambda r: [
+        ('table', _table(r['top_themes']), [60, 40, 40]),
+        ('chart', ChartSpec('plot_top_themes', "top_themes.png", (r['top_themes'],))),
+    ]),
+    Section('licensed_percentage', "Licensed Sets Percentage", ('licensed',), ('licensed_percentage',), lambda r: [
+        ('paragraph', f"Licensed sets account for {r['licensed_percentage'][1]}% of all LEGO sets."),
+        ('chart', ChartSpec('plot_licenses_percentage', "licensed_percentage.png", (r['licensed_percentage'][0],))),
+    ]),
+    Section('licensed_themes', "Licensed Themes with the Most Sets", ('licensed', 'themes'), ('licensed_themes',), lambda r: [
+        ('table', _table(r['licensed_themes']), [60, 40, 40]),
+        ('chart', ChartSpec('plot_licensed_highest_sets', "licensed_highest.png", (r['licensed_themes'],))),
+    ]),
+    Section('top5_trends', "Set Count Trends for Top 5 Themes", ('themes', 'trends'), ('top5_themes_data',), lambda r: [
+        ('chart', ChartSpec('plot_set_count_for_top_themes', "top5_trends.png", (r['top5_themes_data'],))),
+    ]),
+    Section('licensed_trend', "Licensed vs Non-Licensed Sets Over Time", ('licensed', 'trends'), ('licensed_trends',), lambda r: [
+        ('chart', ChartSpec('plot_licensed_non_licensed_sets', "licensed_trend.png", (r['licensed_trends'],))),
+    ]),
+    Section('size_boxplot', "Set Size Comparison (Boxplot)", ('licensed', 'sizes'), ('size_comparison',), lambda r: [
+        ('chart', ChartSpec('box_plot_set_comparison_licensed_non_licensed', "boxplot_comparison.png", (r['size_comparison'],))),
+    ]),
+    Section('subthemes', "Sub-themes in Top 3 Parent Themes", ('themes',), ('subtheme_counts',), lambda r: [
+        ('chart', ChartSpec('plot_subthemes_top_3_parent_themes', "subthemes_top3.png", (r['subtheme_counts'],))),
+    ]),
+    Section('size_distribution', "Set Size Distribution Across Sets", ('sizes',), ('set_sizes',), lambda r: [
+        ('chart', ChartSpec('plot_distribution_set_sizes', "distribution_set_sizes.png", (r['set_sizes'],))),
+    ]),
+    Section('new_themes', "Highest Number of Themes Introduced", ('themes', 'trends'), ('new_themes',), lambda r: [
+        ('paragraph', f"The highest number of new themes was introduced in: {r['new_themes'][0].iloc[0,0]}.\n"),
+        ('chart', ChartSpec('plot_top_new_theme_year', "top_new_themes_year.png", (r['new_themes'][1],))),
+    ]),
+    Section('complexity', "Average Number of Parts for the Top 5 Themes Over Time", ('themes', 'sizes', 'trends'), ('avg_part_trend',), lambda r: [
+        ('chart', ChartSpec('plot_set_complexity_top_themes', "set_complexity_top_themes.png", (r['avg_part_trend'],))),
+    ]),
+    Section('popularity_complexity', "Theme Popularity vs. Set Complexity", ('themes', 'sizes'), ('theme_stats',), lambda r: [
+        ('chart', ChartSpec('plot_theme_set_complexity_corr', "theme_set_complexity_corr.png", (r['theme_stats'],))),
+    ]),
+]
+
+
+def select_sections(names=None):
+    """Sections matching any of the given section keys or tags, in report order (all when names is empty)."""
+    if not names:
+        return list(SECTIONS)
+    names = set(names)
+    known = {s.key for s in SECTIONS} | {t for s in SECTIONS for t in s.tags}
+    unknown = names - known
+    if unknown:
+        raise ValueError(f"Unknown section(s) {sorted(unknown)}; choose from {sorted(known)}")
+    return [s for s in SECTIONS if s.key in names or names & set(s.tags)]
+
+
+def required_nodes(targets, values=()):
+    """Nodes needed for targets, dependencies first, skipping the ones already in values."""
+    order, seen = [], set(values)
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for dep in NODES[name].deps:
+            visit(dep)
+        order.append(name)
+
+    for name in targets:
+        visit(name)
+    return order
+
+
+def _node_name(name):
+    fn = NODES[name].fn
+    return fn.__name__ if fn.__name__ != '<lambda>' else name
+
+
+def compute(targets, values=None, workers=1, tracer=None):
+    """Compute the target nodes and everything they depend on; returns all node values.
+
+    values holds nodes that are already known (e.g. 'merged' and 'cube' from
+    a streaming pass) and are not recomputed. With workers > 1 independent
+    nodes run concurrently in a thread pool as soon as their inputs are ready.
+    """
+    values = dict(values or {})
+    tracer = tracer or Tracer(enabled=False)
+    order = required_nodes(targets, values)
+
+    def run(name):
+        with tracer.span(_node_name(name), 'calc'):
+            return NODES[name].fn(*(values[dep] for dep in NODES[name].deps))
+
+    if workers <= 1:
+        for name in order:
+            values[name] = run(name)
+        return values
+
+    waiting = {name: {d for d in NODES[name].deps if d not in values} for name in order}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while waiting or running:
+            for name in [n for n, deps in waiting.items() if not deps]:
+                del waiting[name]
+                running[pool.submit(run, name)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                values[name] = future.result()
+                for deps in waiting.values():
+                    deps.discard(name)
+    return values
+
+
+def build(sections, values=None, workers=1, tracer=None):
+    """Compute what the sections need and return them as (title, blocks) pairs in order."""
+    needs = [n for s in sections for n in s.needs]
+    results = compute(needs, values, workers, tracer)
+    return [(s.title, s.blocks(results)) for s in sections]
@@ -0,0 +1,439 @@
+# Local HTTP/JSON query service that keeps the merged catalog in memory
+#
+#   python cli.py serve [--host 127.0.0.1] [--port 8765]
+#   curl 'http://127.0.0.1:8765/calc/calc_licensed_highest_sets?top=3&year_from=2000'
+#   curl 'http://127.0.0.1:8765/years/totals?year_from=1995&year_to=2005&theme=Star+Wars'
+#   curl 'http://127.0.0.1:8765/leaderboard/top?year=2000&top=5'
+#   curl 'http://127.0.0.1:8765/search?q=millennium+falcon&limit=5'
+import inspect
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import analysis
+from cache import file_fingerprint
+from cube import Cube
+from leaderboard import LEVELS, Leaderboard
+from search import DEFAULT_LIMIT
+from sketch import QuantileSketch, SizeSketches
+from yearindex import AVG_PARTS, INDEX_MEASURES, YearIndex
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 256
+
+# Source files are stat()ed at most this often (seconds) to notice changes
+RELOAD_CHECK_INTERVAL = 1.0
+
+# What each calc_* endpoint is called with, when it is not the (filtered) cube
+CALC_INPUTS = {
+    'calc_peak_star_wars_year': lambda data: analysis.calc_star_wars_percentage(data.cube)[1],
+    'calc_size_sketches': lambda data: data.merged,
+    'calc_distribution_set_sizes': lambda data: data.merged,
+    'calc_set_size_comparison': lambda data: analysis.calc_size_sketches(data.merged),
+}
+
+# Calcs that need more than a non-empty selection: what they need, and a check of a Selection for it
+CALC_REQUIRES = {
+    'calc_star_wars_percentage': ("licensed sets", lambda data: data.cube.where(is_licensed=True).total() > 0),
+    'calc_peak_star_wars_year': ("licensed Star Wars sets",
+                                 lambda data: data.cube.where(is_licensed=True, parent_theme='Star Wars').total() > 0),
+}
+
+# The merged rows and their cube, after the year and theme filters of a request
+Selection = namedtuple('Selection', ['merged', 'cube'])
+
+# Everything loaded from one version of the source files, swapped in as a whole on reload
+Resident = namedtuple('Resident', ['data', 'year_index', 'leaderboards', 'names', 'version', 'loaded_at'])
+
+
+def calc_endpoints():
+    """Every calc_* function of analysis.py by name."""
+    return {name: fn for name, fn in inspect.getmembers(analysis, inspect.isfunction) if name.startswith('calc_')}
+
+
+def to_jsonable(obj):
+    """Plain lists, dicts and scalars for a calc_* result; NaN becomes null."""
+    if isinstance(obj, pd.DataFrame):
+        frame = obj.reset_index() if obj.index.name is not None else obj
+        return to_jsonable(frame.to_dict(orient='records'))
+    if isinstance(obj, pd.Series):
+        return to_jsonable(obj.reset_index().to_dict(orient='records') if obj.index.name else obj.to_dict())
+    if isinstance(obj, Cube):
+        return {measure: obj.total(measure) for measure in ('rows', 'sets', 'parts_count')}
+    if isinstance(obj, QuantileSketch):
+        return {'count': obj.count, 'mean': obj.mean() if obj.count else None, 'min': obj.min, 'max': obj.max,
+                **{f'p{int(q * 100)}': obj.quantile(q) for q in (0.05, 0.25, 0.5, 0.75, 0.95)}}
+    if isinstance(obj, SizeSketches):
+        return {'overall': to_jsonable(obj.overall), **to_jsonable(obj.groups)}
+    if hasattr(obj, '_asdict'):
+        return to_jsonable(obj._asdict())
+    if isinstance(obj, dict):
+        return {str(to_jsonable(k)): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [to_jsonable(item) for item in obj]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+class ResultCache:
+    """Thread-safe LRU of encoded responses."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Catalog:
+    """The merged rows, their cube, year index, leaderboards and name index, loaded once and reloaded when a source CSV changes.
+
+    Source files are checked at most every RELOAD_CHECK_INTERVAL seconds with a
+    stat(); their content hash is only recomputed when size or mtime changed,
+    so touched but unchanged files do not trigger a reload.
+    """
+
+    def __init__(self, sets_path=None, themes_path=None, cache=None):
+        self.sources = [sets_path or analysis.SETS_CSV, themes_path or analysis.THEMES_CSV]
+        self.cache = cache or ResultCache()
+        self.lock = threading.Lock()
+        self.checked = 0.0
+        with self.lock:
+            self.resident, self.fingerprints = self._load(1)
+
+    @property
+    def version(self):
+        return self.resident.version
+
+    @property
+    def loaded_at(self):
+        return self.resident.loaded_at
+
+    def _load(self, version, previous=None):
+        """A Resident of the current source files, and their fingerprints.
+
+        The fingerprints are taken before the files are read, so a file
+        rewritten during the load differs from them and is loaded again."""
+        fingerprints = [file_fingerprint(path, fp) for path, fp in zip(self.sources, previous or [None] * 2)]
+        merged = analysis.load_data(*self.sources)
+        cube = analysis.build_cube(merged)
+        resident = Resident(data=Selection(merged, cube), year_index=YearIndex.from_cube(cube),
+                            leaderboards={level: Leaderboard.from_cube(cube, level) for level in LEVELS},
+                            names=analysis.load_name_index(*self.sources), version=version, loaded_at=time.time())
+        return resident, fingerprints
+
+    def current(self):
+        """The resident data (a Resident), reloaded first if a source file changed.
+
+        Callers keep the Resident they got for the whole request, so every
+        part of an answer comes from the same version of the data."""
+        if time.monotonic() - self.checked < RELOAD_CHECK_INTERVAL:
+            return self.resident
+        with self.lock:
+            if time.monotonic() - self.checked >= RELOAD_CHECK_INTERVAL:
+                current = [file_fingerprint(path, fp) for path, fp in zip(self.sources, self.fingerprints)]
+                if [fp['sha256'] for fp in current] != [fp['sha256'] for fp in self.fingerprints]:
+                    self.resident, self.fingerprints = self._load(self.resident.version + 1, current)
+                    self.cache.clear()
+                else:
+                    self.fingerprints = current
+                self.checked = time.monotonic()
+        return self.resident
+
+    def select(self, years=(None, None), themes=None, resident=None):
+        """The resident data (of resident, or the current one) restricted to a year range
+        (inclusive, either end open) and parent themes."""
+        data = (resident or self.current()).data
+        first, last = years
+        if first is None and last is None and not themes:
+            return data
+        rows = pd.Series(True, index=data.merged.index)
+        cells = pd.Series(True, index=data.cube.frame.index)
+        for column, keep in (('year', lambda c: c.between(first if first is not None else -math.inf,
+                                                            last if last is not None else math.inf)),
+                             ('parent_theme', lambda c: c.isin(themes) if themes else True)):
+            rows &= keep(data.merged[column])
+            cells &= keep(data.cube.frame[column])
+        return Selection(data.merged[rows], Cube(data.cube.frame[cells]))
+
+
+def _params(query, allowed):
+    """The query string as parse_qs() returns it; raises ValueError for parameters not in allowed."""
+    params = parse_qs(query)
+    unknown = set(params) - set(allowed)
+    if unknown:
+        raise ValueError(f"unknown parameter(s): {', '.join(sorted(unknown))}")
+    return params
+
+
+def _integer(params, name, minimum=None):
+    if name not in params:
+        return None
+    try:
+        value = int(params[name][-1])
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+def _themes(params):
+    return tuple(sorted(t for value in params.get('theme', []) for t in value.split(',') if t))
+
+
+def parse_query(query):
+    """(top, (year_from, year_to), themes) from the query string; raises ValueError on bad values."""
+    params = _params(query, {'top', 'year_from', 'year_to', 'theme'})
+    return _integer(params, 'top', 1), (_integer(params, 'year_from'), _integer(params, 'year_to')), _themes(params)
+
+
+def parse_year_query(query):
+    """((year_from, year_to), themes, measure, window, periods) for the /years endpoints."""
+    params = _params(query, {'year_from', 'year_to', 'theme', 'measure', 'window', 'periods'})
+    measure = params.get('measure', ['sets'])[-1]
+    if measure not in INDEX_MEASURES + [AVG_PARTS]:
+        raise ValueError(f"measure must be one of {', '.join(INDEX_MEASURES + [AVG_PARTS])}")
+    first, last = _integer(params, 'year_from'), _integer(params, 'year_to')
+    if first is not None and last is not None and first > last:
+        raise ValueError("year_from must not be after year_to")
+    return ((first, last), _themes(params), measure,
+            _integer(params, 'window', 1) or 3, _integer(params, 'periods', 1) or 1)
+
+
+def parse_leaderboard_query(query):
+    """(level, year, top, cumulative, entry) for the /leaderboard endpoints; entry is None without a theme."""
+    params = _params(query, {'level', 'year', 'top', 'cumulative', 'theme', 'subtheme'})
+    level = params.get('level', ['parent_theme'])[-1]
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    cumulative = params.get('cumulative', ['1'])[-1].lower()
+    if cumulative not in ('0', '1', 'false', 'true'):
+        raise ValueError("cumulative must be 0 or 1")
+    theme, subtheme = (params[name][-1] if name in params else None for name in ('theme', 'subtheme'))
+    if level == 'theme_name' and (theme is None) != (subtheme is None):
+        raise ValueError("a sub-theme is given by both theme and subtheme")
+    entry = theme if level == 'parent_theme' or theme is None else (theme, subtheme)
+    return level, _integer(params, 'year'), _integer(params, 'top', 1) or 10, cumulative in ('1', 'true'), entry
+
+
+def parse_search_query(query, text):
+    """(text, limit) for /search (text 'q') and /similar (text 'set_num')."""
+    params = _params(query, {text, 'limit'})
+    if not params.get(text, [''])[-1].strip():
+        raise ValueError(f"{text} is required")
+    return params[text][-1], _integer(params, 'limit', 1) or DEFAULT_LIMIT
+
+
+class QueryService:
+    """Answers calc_* queries against a Catalog, through the result cache."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.endpoints = calc_endpoints()
+
+    def index(self):
+        return {
+            'endpoints': {f'/calc/{name}': (fn.__doc__ or '').strip().splitlines()[0]
+                          for name, fn in sorted(self.endpoints.items())},
+            'parameters': {'top': "number of themes for the top-N questions",
+                           'year_from': "first year to include", 'year_to': "last year to include",
+                           'theme': "parent theme(s) to include; repeat or comma-separate"},
+            'year_index': {
+                '/years/totals': "a measure over year_from..year_to, overall and per theme",
+                '/years/rolling': "trailing mean of a measure over window years (default 3), per year and theme",
+                '/years/growth': "relative change of a measure against periods years earlier (default 1)",
+                'measure': ', '.join(INDEX_MEASURES + [AVG_PARTS]) + " (default sets)",
+            },
+            'leaderboard': {
+                '/leaderboard/top': "the top (default 10) themes as of year (default the last one)",
+                '/leaderboard/rank': "rank of theme (and subtheme) in every year",
+                'level': ', '.join(LEVELS) + " (default parent_theme)",
+                'cumulative': "1 ranks on the sets released up to the year (default), 0 on that year alone",
+            },
+            'search': {
+                '/search': "sets whose name matches q best, typos allowed, or whose set number starts with q",
+                '/similar': "the sets most like set_num by name, theme and part count",
+                'limit': f"number of sets (default {DEFAULT_LIMIT})",
+            },
+        }
+
+    def health(self):
+        resident = self.catalog.current()
+        return {'rows': len(resident.data.merged), 'version': resident.version, 'loaded_at': resident.loaded_at,
+                'sources': self.catalog.sources, 'cache': {'entries': len(self.catalog.cache.entries),
+                                                          'hits': self.catalog.cache.hits,
+                                                          'misses': self.catalog.cache.misses}}
+
+    def years(self, kind, query):
+        """Encoded JSON answer of a YearIndex query: kind is 'totals', 'rolling' or 'growth'."""
+        years, themes, measure, window, periods = parse_year_query(query)
+        resident = self.catalog.current()
+        key = (resident.version, 'years', kind, years, themes, measure, window, periods)
+        body = self.catalog.cache.get(key)
+        if body is None:
+            index = resident.year_index
+            unknown = [theme for theme in themes if theme not in index.themes]
+            if unknown:
+                raise ValueError(f"unknown parent theme(s): {', '.join(unknown)}")
+            if kind == 'totals':
+                result = {'all': index.total(*years, measure=measure),
+                          'themes': index.totals(*years, measure=measure).loc[list(themes) or index.themes]}
+            else:
+                frame = index.rolling(window, measure) if kind == 'rolling' else index.growth(measure, periods)
+                first, last = years
+                result = frame.loc[first:last, list(themes) or index.themes]
+            body = json.dumps({'result': to_jsonable(result)}).encode()
+            self.catalog.cache.put(key, body)
+        return body
+
+    def leaderboard(self, kind, query):
+        """Encoded JSON answer of a Leaderboard query: kind is 'top' or 'rank'."""
+        level, year, top, cumulative, entry = parse_leaderboard_query(query)
+        resident = self.catalog.current()
+        key = (resident.version, 'leaderboard', kind, level, year, top, cumulative, entry)
+        body = self.catalog.cache.get(key)
+        if body is None:
+            board = resident.leaderboards[level]
+            if kind == 'top':
+                result = board.top(top, year, cumulative)
+            elif entry is None:
+                raise ValueError("rank needs a theme")
+            elif entry not in board.entries:
+                raise ValueError(f"unknown {level}: {entry}")
+            else:
+                result = board.rank(entry, cumulative)
+            body = json.dumps({'result': to_jsonable(result)}).encode()
+            self.catalog.cache.put(key, body)
+        return body
+
+    def search(self, kind, query):
+        """Encoded JSON answer of a NameIndex query: kind is 'search' or 'similar'."""
+        text, limit = parse_search_query(query, 'q' if kind == 'search' else 'set_num')
+        resident = self.catalog.current()
+        key = (resident.version, kind, text, limit)
+        body = self.catalog.cache.get(key)
+        if body is None:
+            names = resident.names
+            if kind == 'search':
+                result = names.search(text, limit)
+            elif names.find(text) is None:
+                raise ValueError(f"unknown set_num: {text}")
+            else:
+                result = names.similar(text, limit)
+            body = json.dumps({'result': to_jsonable(result)}).encode()
+            self.catalog.cache.put(key, body)
+        return body
+
+    def calc(self, name, query):
+        """Encoded JSON answer of one calc_* function (name must be in endpoints); raises ValueError for bad parameters."""
+        fn = self.endpoints[name]
+        top, years, themes = parse_query(query)
+        kwargs = {}
+        if top is not None:
+            if 'top' not in inspect.signature(fn).parameters:
+                raise ValueError(f"{name} does not take top")
+            kwargs['top'] = top
+
+        resident = self.catalog.current() # Reload (and empty the cache) before looking in it
+        key = (resident.version, name, top, years, themes)
+        body = self.catalog.cache.get(key)
+        if body is None:
+            data = self.catalog.select(years, themes, resident)
+            if data.cube.total('rows') == 0:
+                raise ValueError("no sets match the year_from, year_to and theme filters")
+            needs, check = CALC_REQUIRES.get(name, (None, None))
+            if needs and not check(data):
+                raise ValueError(f"{name} needs {needs}, and none match the filters")
+            arg = CALC_INPUTS.get(name, lambda d: d.cube)(data)
+            body = json.dumps({'result': to_jsonable(fn(arg, **kwargs))}).encode()
+            self.catalog.cache.put(key, body)
+        return body
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None # Set by make_server()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path in ('/', ''):
+                self._send(200, json.dumps(self.service.index()).encode())
+            elif url.path == '/health':
+                self._send(200, json.dumps(self.service.health()).encode())
+            elif url.path in ('/years/totals', '/years/rolling', '/years/growth'):
+                self._send(200, self.service.years(url.path[len('/years/'):], url.query))
+            elif url.path in ('/leaderboard/top', '/leaderboard/rank'):
+                self._send(200, self.service.leaderboard(url.path[len('/leaderboard/'):], url.query))
+            elif url.path in ('/search', '/similar'):
+                self._send(200, self.service.search(url.path[1:], url.query))
+            elif url.path.startswith('/calc/') and url.path[len('/calc/'):] in self.service.endpoints:
+                self._send(200, self.service.calc(url.path[len('/calc/'):], url.query))
+            else:
+                self._error(404, f"no such endpoint: {url.path}")
+        except ValueError as e:
+            self._error(400, str(e))
+        except Exception as e:
+            self._error(500, f"{type(e).__name__}: {e}")
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode())
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep the console quiet; every request would print a line
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, cache_size=DEFAULT_CACHE_SIZE, sets_path=None, themes_path=None):
+    """A threaded HTTP server (one thread per connection) over a freshly loaded Catalog."""
+    catalog = Catalog(sets_path, themes_path, ResultCache(cache_size))
+    handler = type('CatalogHandler', (Handler,), {'service': QueryService(catalog)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, cache_size=DEFAULT_CACHE_SIZE):
+    server = make_server(host, port, cache_size)
+    print(f"Serving the LEGO catalog on http://{host}:{server.server_address[1]}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,146 @@
+# Mergeable quantile sketches of the set sizes
+import numpy as np
+import pandas as pd
+
+# Columns num_parts is sketched by, besides the catalog as a whole
+SKETCH_GROUPS = ['is_licensed', 'parent_theme', 'year']
+
+DEFAULT_COMPRESSION = 200
+
+
+class QuantileSketch:
+    """Bounded-memory summary of a stream of values for approximate quantiles (a merging t-digest).
+
+    Values are kept as weighted centroids. Centroid sizes follow the arcsine
+    scale function k(q) = compression / (2 pi) * asin(2q - 1): every centroid
+    covers at most one unit of k, so there are at most about compression
+    centroids and they get small towards the tails. quantile(q) interpolates
+    between centroid means; its rank error is below the width of one
+    centroid, 2 pi sqrt(q (1 - q)) / compression of the count (1.6% at the
+    median and 0.7% at the 95th percentile with the default compression of
+    200), and is usually far smaller. Count, sum, min and max are exact, and
+    sketches of disjoint parts of the data merge into a sketch of the whole
+    with the same guarantee.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0.0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def __len__(self):
+        return len(self.means)
+
+    def add(self, values, weights=None):
+        """Add values (each repeated weights times); missing values are ignored."""
+        values = np.asarray(values, dtype=float)
+        weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+        keep = ~np.isnan(values) & (weights > 0)
+        values, weights = values[keep], weights[keep]
+        if not len(values):
+            return self
+        self.count += weights.sum()
+        self.sum += (values * weights).sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, weights]))
+        return self
+
+    def merge(self, other):
+        """Fold the sketch of another part of the data into this one."""
+        if other.count:
+            self.count += other.count
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _compress(self, means, weights):
+        # Sort by mean and give every point the centroid its centre falls in on
+        # the k scale; the pass is vectorised over all points
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        centre = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * centre - 1)
+        bucket = (np.floor(k) - np.floor(k[0])).astype(np.int64)
+        sums = np.bincount(bucket, weights * means)
+        totals = np.bincount(bucket, weights)
+        used = totals > 0
+        self.means, self.weights = sums[used] / totals[used], totals[used]
+
+    def mean(self):
+        return self.sum / self.count
+
+    def quantile(self, q):
+        """Approximate q-quantile of the values added so far (NaN while empty)."""
+        if not self.count:
+            return np.nan
+        centres = np.cumsum(self.weights) - self.weights / 2
+        # Pin the ends to the exact min and max
+        positions = np.concatenate([[0], centres, [self.count]])
+        means = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * self.count, positions, means))
+
+    def box_stats(self, label):
+        """Box plot statistics (as matplotlib's boxplot_stats returns them) from the sketch.
+
+        Whiskers end at the most extreme centroid mean (or min / max) inside
+        1.5 IQR of the quartiles; the fliers are the centroids beyond them,
+        one point per centroid.
+        """
+        q1, med, q3 = (self.quantile(q) for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        points = np.concatenate([[self.min], self.means, [self.max]])
+        inside = points[(points >= q1 - 1.5 * iqr) & (points <= q3 + 1.5 * iqr)]
+        return {'label': label, 'mean': self.mean(), 'med': med, 'q1': q1, 'q3': q3, 'iqr': iqr,
+                'whislo': inside.min(), 'whishi': inside.max(),
+                'fliers': np.unique(points[(points < inside.min()) | (points > inside.max())])}
+
+
+class SizeSketches:
+    """Quantile sketches of num_parts for the whole catalog and for every value of the SKETCH_GROUPS columns.
+
+    Built from merged rows or from a weighted frame (num_parts, weight and
+    whichever group columns it has, like the streaming part counts), and
+    mergeable across disjoint parts of the catalog.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.overall = QuantileSketch(compression)
+        self.groups = {column: {} for column in SKETCH_GROUPS}
+
+    def add(self, frame):
+        """Sketch the num_parts of another part of the catalog."""
+        frame = frame.dropna(subset=['num_parts'])
+        if 'weight' not in frame.columns:
+            # Part counts take few distinct values: sketch (value, count) pairs instead of rows
+            columns = [c for c in SKETCH_GROUPS if c in frame.columns]
+            frame = frame.groupby(columns + ['num_parts'], dropna=False, observed=True).size().reset_index(name='weight')
+        self.overall.add(frame['num_parts'], frame['weight'])
+        for column, sketches in self.groups.items():
+            if column not in frame.columns:
+                continue
+            for value, group in frame.groupby(column, observed=True):
+                sketch = sketches.setdefault(value, QuantileSketch(self.compression))
+                sketch.add(group['num_parts'], group['weight'])
+        return self
+
+    def merge(self, other):
+        """Fold the sketches of another part of the catalog into these."""
+        self.overall.merge(other.overall)
+        for column, sketches in other.groups.items():
+            for value, sketch in sketches.items():
+                self.groups[column].setdefault(value, QuantileSketch(self.compression)).merge(sketch)
+        return self
+
+    def quantiles(self, column, q):
+        """Approximate q-quantile of num_parts for every value of column, as a Series."""
+        sketches = self.groups[column]
+        return pd.Series({value: sketch.quantile(q) for value, sketch in sorted(sketches.items())},
+                         name='num_parts', dtype=float).rename_axis(column)
@@ -0,0 +1,293 @@
+# Optional SQLite storage backend: the merged catalog and its aggregates in indexed tables, queried with SQL
+#
+#   store = open_store()
+#   cube = store.cube()                      # a Cube answered by SQL
+#   analysis.calc_licensed_highest_sets(cube)
+#
+# The catalog is ingested once per pair of source CSVs into a database under
+# CACHE_DIR and re-ingested when either file changes. Ingestion also rolls the
+# catalog up inside SQLite into the cube (one row per year, parent theme,
+# sub-theme and licensed flag) and the number of sets per part count. The
+# SqlCube of store.cube() answers every Cube method with one aggregate query
+# over those tables that filters through their indexes, so the calc_*
+# functions run unchanged with their work pushed down into SQLite, and only
+# the aggregated groups come back into pandas.
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from analysis import CACHE_DIR, SETS_CSV, THEMES_CSV
+from cache import CACHE_VERSION, check_sources, publish_directory, read_meta, sources_name
+from compact import narrow
+from cube import CUBE_KEYS, CUBE_MEASURES, Cube
+
+DB_FILE = 'catalog.sqlite'
+
+# Rows of lego_sets.csv read and inserted at a time
+INGEST_CHUNK_ROWS = 200_000
+
+# Columns of the catalog table, in lego_sets.csv order, plus the licensed flag of the parent theme
+CATALOG_SCHEMA = """
+CREATE TABLE catalog (
+    set_num TEXT,
+    name TEXT,
+    year INTEGER,
+    num_parts REAL,
+    theme_name TEXT,
+    parent_theme TEXT,
+    is_licensed INTEGER
+)"""
+
+# Indexed columns of every table: the filters and group keys of the calc_* questions
+INDEXED_COLUMNS = ['year', 'parent_theme', 'theme_name', 'is_licensed']
+
+# How each cube measure is computed over the catalog rows of a cell
+CELL_SQL = {
+    'rows': 'COUNT(*)',
+    'sets': 'COUNT(set_num)',
+    'parts_sum': 'TOTAL(num_parts)',  # 0.0 without part counts, as pandas' sum()
+    'parts_count': 'COUNT(num_parts)',
+}
+
+# The aggregate tables built from the catalog at ingestion
+AGGREGATES_SQL = [
+    f"""CREATE TABLE cube AS
+        SELECT {', '.join(CUBE_KEYS)}, {', '.join(f'{CELL_SQL[m]} AS "{m}"' for m in CUBE_MEASURES)}
+        FROM catalog GROUP BY {', '.join(CUBE_KEYS)}""",
+    """CREATE TABLE part_counts AS
+       SELECT year, parent_theme, theme_name, is_licensed, num_parts, COUNT(*) AS weight
+       FROM catalog WHERE num_parts IS NOT NULL
+       GROUP BY year, parent_theme, theme_name, is_licensed, num_parts""",
+]
+
+# The measure columns of the cube table, quoted: "rows" is an SQL keyword
+MEASURE_COLUMNS = ', '.join(f'"{m}"' for m in CUBE_MEASURES)
+
+# How each measure of a group of cube cells is rolled up
+MEASURE_SQL = {
+    'rows': 'SUM("rows")',
+    'sets': 'SUM(sets)',
+    'parts_sum': 'TOTAL(parts_sum)',
+    'parts_count': 'SUM(parts_count)',
+}
+MEASURE_DTYPES = {'rows': 'int64', 'sets': 'int64', 'parts_sum': 'float64', 'parts_count': 'int64'}
+
+
+def _param(value):
+    """A filter value as sqlite3 binds it."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    return int(value) if isinstance(value, bool) else value
+
+
+def _columns(names, allowed):
+    """names (one or a list) as a list, each checked against allowed before it goes into SQL."""
+    names = [names] if isinstance(names, str) else list(names)
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"not a cube column: {', '.join(map(str, unknown))}")
+    return names
+
+
+def ingest(path, sets_path, themes_path, chunksize=INGEST_CHUNK_ROWS):
+    """Load both CSVs into a new database at path, joined as merge_data() joins them, aggregate and index it.
+
+    Returns the dtype the pandas path gives year, for SqlCube to match."""
+    db = sqlite3.connect(path)
+    try:
+        db.execute("CREATE TABLE parent_themes (id INTEGER, name TEXT, is_licensed INTEGER)")
+        themes = pd.read_csv(themes_path)
+        db.executemany("INSERT INTO parent_themes VALUES (?, ?, ?)",
+                       themes[['id', 'name', 'is_licensed']].itertuples(index=False, name=None))
+        db.execute(CATALOG_SCHEMA)
+        db.execute("CREATE TEMP TABLE staging (set_num, name, year, num_parts, theme_name, parent_theme)")
+
+        columns = ['set_num', 'name', 'year', 'num_parts', 'theme_name', 'parent_theme']
+        for chunk in pd.read_csv(sets_path, chunksize=chunksize):
+            chunk = chunk[columns].astype(object).where(chunk[columns].notna(), None)
+            db.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?, ?)", chunk.itertuples(index=False, name=None))
+            # Inner join on the parent theme name, one catalog row per matching theme
+            db.execute("""INSERT INTO catalog
+                          SELECT s.set_num, s.name, s.year, s.num_parts, s.theme_name, s.parent_theme, p.is_licensed
+                          FROM staging s JOIN parent_themes p ON s.parent_theme = p.name""")
+            db.execute("DELETE FROM staging")
+        bounds = [year for year in db.execute("SELECT MIN(year), MAX(year) FROM catalog").fetchone() if year is not None]
+
+        for sql in AGGREGATES_SQL:
+            db.execute(sql)
+        for table in ('catalog', 'cube', 'part_counts'):
+            for column in INDEXED_COLUMNS:
+                db.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+        db.execute("ANALYZE")
+        db.commit()
+    finally:
+        db.close()
+    return str(narrow(pd.Series(bounds or [0], dtype='int64')).dtype)
+
+
+class SqliteStore:
+    """A catalog database: the catalog table joined with the licensed flags, and its cube and
+    part_counts aggregates, each indexed on INDEXED_COLUMNS."""
+
+    def __init__(self, path, year_dtype='int64'):
+        self.path = path
+        self.year_dtype = year_dtype
+        # Report sections may query from several threads; queries are serialised on one connection
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def query(self, sql, params=(), columns=None):
+        """Rows of a query as a DataFrame."""
+        with self.lock:
+            cursor = self.db.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = columns or [d[0] for d in cursor.description]
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    def scalar(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchone()[0]
+
+    def cube(self):
+        """The whole catalog as a SqlCube."""
+        return SqlCube(self)
+
+    def close(self):
+        self.db.close()
+
+
+class SqlCube(Cube):
+    """A Cube whose methods run as aggregate queries over a SqliteStore.
+
+    where() only collects conditions; total(), totals(), distinct() and top()
+    each run one GROUP BY query over the matching cells of the cube table and
+    return what the pandas Cube of the same rows returns, down to dtypes and
+    order. frame reads those cells, for code that uses them directly.
+    """
+
+    def __init__(self, store, filters=()):
+        self.store = store
+        self.filters = tuple(filters)  # (column, value or tuple of values)
+        self._frame = None
+
+    def where(self, **filters):
+        """Return the sub-cube matching every filter (a scalar value or a list of values)."""
+        added = []
+        for column, value in filters.items():
+            _columns(column, CUBE_KEYS)
+            if isinstance(value, (list, tuple, set, pd.Index, np.ndarray)):
+                value = tuple(_param(v) for v in value)
+            else:
+                value = _param(value)
+            added.append((column, value))
+        return SqlCube(self.store, self.filters + tuple(added))
+
+    def _where(self, not_null=()):
+        """WHERE clause and parameters of the filters, also excluding missing not_null columns."""
+        conditions, params = [], []
+        for column, value in self.filters:
+            if isinstance(value, tuple):
+                conditions.append(f"{column} IN ({', '.join('?' * len(value))})" if value else "0")
+                params.extend(value)
+            else:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        conditions += [f"{column} IS NOT NULL" for column in not_null]
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _typed(self, frame):
+        """Key and measure columns of a query result in the dtypes of the pandas cube."""
+        for column in frame.columns:
+            if column == 'year':
+                frame[column] = frame[column].astype(self.store.year_dtype)
+            elif column == 'is_licensed':
+                frame[column] = frame[column].astype(bool)
+            elif column in ('parent_theme', 'theme_name'):
+                frame[column] = frame[column].astype('str')
+            elif column in MEASURE_DTYPES:
+                frame[column] = frame[column].astype(MEASURE_DTYPES[column])
+        return frame
+
+    def _grouped(self, by, values, order=None, limit=None):
+        """Run SELECT by, values ... GROUP BY by over the filtered rows with non-missing keys."""
+        where, params = self._where(not_null=by)
+        keys = ', '.join(by)
+        sql = (f"SELECT {keys}, {', '.join(sql for _, sql in values)} FROM cube{where} "
+               f"GROUP BY {keys} ORDER BY {order or keys}")
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        frame = self._typed(self.store.query(sql, params, columns=by + [name for name, _ in values]))
+        return frame.set_index(by[0] if len(by) == 1 else by)
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            where, params = self._where()
+            keys = ', '.join(CUBE_KEYS)
+            sql = f"SELECT {keys}, {MEASURE_COLUMNS} FROM cube{where}"
+            frame = self._typed(self.store.query(sql, params, columns=CUBE_KEYS + CUBE_MEASURES))
+            # build_cube() order: sorted by the keys, missing keys last
+            self._frame = frame.sort_values(CUBE_KEYS, na_position='last', kind='stable', ignore_index=True)
+        return self._frame
+
+    def total(self, measure='rows'):
+        """Grand total of one measure."""
+        where, params = self._where()
+        return int(self.store.scalar(f"SELECT {MEASURE_SQL[_columns(measure, CUBE_MEASURES)[0]]} FROM cube{where}",
+                                     params) or 0)
+
+    def totals(self, by, measures='rows'):
+        """Roll the cube up to the given dimension(s), summing the measure(s)."""
+        names = _columns(measures, CUBE_MEASURES)
+        frame = self._grouped(_columns(by, CUBE_KEYS), [(m, MEASURE_SQL[m]) for m in names])
+        return frame[measures] if isinstance(measures, str) else frame
+
+    def distinct(self, by, column):
+        """Number of distinct values of column per group of by."""
+        column = _columns(column, CUBE_KEYS)[0]
+        counts = self._grouped(_columns(by, CUBE_KEYS), [('distinct', f"COUNT(DISTINCT {column})")])['distinct']
+        return counts.astype('int64').rename(column)
+
+    def top(self, by, measure='rows', k=None):
+        """The k largest totals of measure by by, largest first, ties in key order; only k groups are fetched."""
+        by = _columns(by, CUBE_KEYS)
+        measure = _columns(measure, CUBE_MEASURES)[0]
+        keys = ', '.join(by)
+        return self._grouped(by, [(measure, MEASURE_SQL[measure])], order=f"{len(by) + 1} DESC, {keys}", limit=k)[measure]
+
+    def part_counts(self):
+        """Number of sets per (is_licensed, parent_theme, year, num_parts), for the sets with a part count.
+
+        Weighted part counts like those of streaming.stream_aggregates(), with
+        every column calc_size_sketches() groups by."""
+        where, params = self._where()
+        columns = ['is_licensed', 'parent_theme', 'year', 'num_parts']
+        keys = ', '.join(columns)
+        frame = self.store.query(f"SELECT {keys}, SUM(weight) FROM part_counts{where} GROUP BY {keys} ORDER BY {keys}",
+                                 params, columns=columns + ['weight'])
+        return self._typed(frame).astype({'num_parts': 'float64', 'weight': 'int64'})
+
+
+def open_store(sets_path=None, themes_path=None, cache_dir=None, rebuild=False, chunksize=INGEST_CHUNK_ROWS):
+    """The SqliteStore of a pair of source CSVs, ingesting them first (chunksize rows at a time)
+    when new or changed, or when rebuild is set."""
+    sets_path = sets_path or SETS_CSV
+    themes_path = themes_path or THEMES_CSV
+    directory = os.path.join(cache_dir or CACHE_DIR, sources_name('store', [sets_path, themes_path]))
+    meta = read_meta(directory)
+    current, fresh = check_sources(directory, meta, [sets_path, themes_path])
+    if rebuild or not (fresh and meta.get('kind') == 'sqlite'):
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        year_dtype = ingest(os.path.join(tmp, DB_FILE), sets_path, themes_path, chunksize)
+        meta = {'version': CACHE_VERSION, 'kind': 'sqlite', 'year_dtype': year_dtype, 'sources': current}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        publish_directory(tmp, directory)
+    return SqliteStore(os.path.join(directory, DB_FILE), meta['year_dtype'])
@@ -0,0 +1,59 @@
+# Chunked, out-of-core pass over lego_sets.csv
+import pandas as pd
+
+from analysis import SETS_CSV, THEMES_CSV, merge_data
+from cube import build_cube, merge_cubes
+from sketch import SizeSketches
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def iter_merged_chunks(sets_path=None, themes_path=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield the merged catalog chunk by chunk; only one chunk of sets is in memory at a time."""
+    parent_themes = pd.read_csv(themes_path or THEMES_CSV)
+    for chunk in pd.read_csv(sets_path or SETS_CSV, chunksize=chunksize):
+        yield merge_data(chunk, parent_themes)
+
+
+def count_parts(merged):
+    """Number of sets per (is_licensed, num_parts) value; missing num_parts are left out.
+
+    Part counts take few distinct values, so this keeps the full set-size
+    distribution in memory bounded by the number of distinct values, not rows.
+    """
+    counts = merged.groupby(['is_licensed', 'num_parts']).size().reset_index(name='weight')
+    return counts
+
+
+def merge_part_counts(counts):
+    """Combine part counts built over disjoint parts of the catalog."""
+    combined = pd.concat(counts, ignore_index=True)
+    return combined.groupby(['is_licensed', 'num_parts'])['weight'].sum().reset_index()
+
+
+def stream_aggregates(sets_path=None, themes_path=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Build the aggregate cube, the part counts and the set-size sketches in one chunked pass over the CSV.
+
+    Every calc_* function gives the same answer on this cube as on the cube of
+    the fully loaded catalog, and the part counts (a weighted frame with
+    is_licensed, num_parts and weight columns) stand in for the merged rows in
+    the set-size distribution. The quantile sketches (sketch.SizeSketches)
+    cover num_parts per licensed flag, parent theme and year. Peak memory is
+    one chunk plus the accumulators, whose size depends on the number of
+    cells, not rows.
+    """
+    cube = None
+    parts = None
+    sketches = SizeSketches()
+    for chunk in iter_merged_chunks(sets_path, themes_path, chunksize):
+        chunk_cube = build_cube(chunk)
+        chunk_parts = count_parts(chunk)
+        cube = chunk_cube if cube is None else merge_cubes([cube, chunk_cube])
+        parts = chunk_parts if parts is None else merge_part_counts([parts, chunk_parts])
+        sketches.merge(SizeSketches().add(chunk))
+
+    if cube is None:
+        # Empty CSV: fall back to the (empty) in-memory structures
+        merged = merge_data(pd.read_csv(sets_path or SETS_CSV), pd.read_csv(themes_path or THEMES_CSV))
+        cube, parts = build_cube(merged), count_parts(merged)
+    return cube, parts, sketches
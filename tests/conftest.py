@@ -0,0 +1,45 @@
+# Shared fixtures: the bundled CSVs, merged the plain pandas way and through load_data()
+import os
+import sys
+import tempfile
+
+# Keep the repository's .lego_cache untouched; must be set before analysis is imported
+os.environ.setdefault('LEGO_CACHE_DIR', tempfile.mkdtemp(prefix='lego-test-cache-'))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib  # noqa: E402
+matplotlib.use('Agg')
+
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import analysis  # noqa: E402
+from compact import plain_merge  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def sets():
+    return pd.read_csv(analysis.SETS_CSV)
+
+
+@pytest.fixture(scope='session')
+def themes():
+    return pd.read_csv(analysis.THEMES_CSV)
+
+
+@pytest.fixture(scope='session')
+def plain(sets, themes):
+    """The merged catalog as the original script built it: pd.merge on the parent theme name."""
+    return plain_merge(sets, themes)
+
+
+@pytest.fixture(scope='session')
+def merged():
+    return analysis.load_data()
+
+
+@pytest.fixture(scope='session')
+def cube(merged):
+    return analysis.build_cube(merged)
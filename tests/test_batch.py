@@ -0,0 +1,42 @@
+# Batch reports over a worker pool: one PDF per snapshot, failures reported without stopping the rest
+import json
+
+import pytest
+
+from batch import read_manifest, run_batch
+
+
+def write_manifest(path, jobs):
+    path.write_text(json.dumps(jobs))
+    return str(path)
+
+
+def test_manifest_paths_and_defaults(tmp_path):
+    jobs = read_manifest(write_manifest(tmp_path / 'manifest.json', [
+        {'sets': 'a/sets.csv', 'output': 'out/a.pdf'},
+        {'name': 'b', 'sets': '/data/b.csv', 'themes': 't.csv', 'output': 'b.pdf', 'sections': ['licensed'],
+         'chunksize': 1000}]))
+    assert jobs[0].name == 'a' and jobs[0].sets == str(tmp_path / 'a' / 'sets.csv') and jobs[0].themes is None
+    assert jobs[1].sets == '/data/b.csv' and jobs[1].themes == str(tmp_path / 't.csv')
+    assert (jobs[1].sections, jobs[1].chunksize) == (['licensed'], 1000)
+
+    for bad in [{'sets': 'a.csv'}, [{'sets': 'a.csv', 'output': 'x.pdf'}, {'sets': 'b.csv', 'output': 'x.pdf'}]]:
+        with pytest.raises(ValueError):
+            read_manifest(write_manifest(tmp_path / 'bad.json', bad if isinstance(bad, list) else [bad]))
+
+
+def test_reports_built_and_failures_isolated(tmp_path, sets):
+    for name, rows in (('early', sets[sets['year'] < 1990]), ('late', sets[sets['year'] >= 2010])):
+        rows.to_csv(tmp_path / f'{name}.csv', index=False)
+    jobs = read_manifest(write_manifest(tmp_path / 'manifest.json', [
+        {'sets': 'early.csv', 'output': 'early.pdf', 'sections': ['top_themes']},
+        {'sets': 'missing.csv', 'output': 'missing.pdf', 'sections': ['top_themes']},
+        {'sets': 'late.csv', 'output': 'late.pdf', 'sections': ['top_themes'], 'chunksize': 500}]))
+    results = run_batch(jobs, workers=2, profile='email')
+
+    assert [r.name for r in results] == ['early', 'missing', 'late']
+    assert [r.ok for r in results] == [True, False, True]
+    assert 'missing.csv' in results[1].error
+    for result in (results[0], results[2]):
+        with open(result.output, 'rb') as f:
+            assert f.read(5) == b'%PDF-'
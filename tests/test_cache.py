@@ -0,0 +1,69 @@
+# The columnar cache of the merged frame: lossless round trips and invalidation on source changes
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import analysis
+from cache import cached_frame, data_fingerprint, evict_images, image_cache_path, load_frame, read_meta, save_frame, store_image
+
+
+def test_round_trip_keeps_values_and_dtypes(tmp_path, merged, plain):
+    for frame in (merged, plain):
+        save_frame(frame, tmp_path / 'frame')
+        assert_frame_equal(load_frame(tmp_path / 'frame'), frame)
+
+
+def test_load_data_matches_a_plain_read(tmp_path, sets, themes):
+    cached = analysis.load_data(cache_dir=tmp_path)
+    again = analysis.load_data(cache_dir=tmp_path)
+    assert_frame_equal(again, cached)
+    assert_frame_equal(cached, analysis.merge_data(sets, themes))
+
+
+def test_rebuilt_when_a_source_changes(tmp_path, sets):
+    source = tmp_path / 'sets.csv'
+    sets.head(100).to_csv(source, index=False)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return pd.read_csv(source)
+
+    first = cached_frame('sets', [str(source)], build, tmp_path)
+    os.utime(source) # Touched but unchanged: still served from the cache
+    assert_frame_equal(cached_frame('sets', [str(source)], build, tmp_path), first)
+    assert len(builds) == 1
+
+    sets.head(200).to_csv(source, index=False)
+    assert len(cached_frame('sets', [str(source)], build, tmp_path)) == 200
+    assert len(builds) == 2
+    assert read_meta(tmp_path / 'sets')['rows'] == 200
+
+
+def test_overwriting_an_entry_replaces_it(tmp_path, merged):
+    save_frame(merged, tmp_path / 'frame')
+    save_frame(merged.head(10), tmp_path / 'frame')
+    assert_frame_equal(load_frame(tmp_path / 'frame'), merged.head(10))
+    assert os.listdir(tmp_path) == ['frame'] # No temporary or old copies left behind
+
+
+def test_eviction_keeps_the_newest_images(tmp_path):
+    source = tmp_path / 'chart.png'
+    source.write_bytes(b'x' * 100)
+    for i, key in enumerate('abc'):
+        store_image(tmp_path, key, source)
+        os.utime(image_cache_path(tmp_path, key), (1000 + i, 1000 + i))
+    assert evict_images(tmp_path, max_bytes=250, max_age=3600, now=1003) == 1
+    assert sorted(os.listdir(tmp_path / 'images')) == ['b.png', 'c.png']
+
+
+def test_fingerprint_covers_whole_dict_values():
+    # Box-plot stats: repr() would elide the middle of long flier arrays
+    fliers = np.arange(5000, dtype=float)
+    changed = fliers.copy()
+    changed[2500] += 1e-9
+    stats = {'med': 3.0, 'fliers': fliers}
+    assert data_fingerprint(stats).digest() != data_fingerprint({'med': 3.0, 'fliers': changed}).digest()
+    assert data_fingerprint(stats).digest() == data_fingerprint({'fliers': fliers, 'med': 3.0}).digest()
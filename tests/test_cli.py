@@ -0,0 +1,44 @@
+# The command line: lazy imports, and the same headline numbers from every data path
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import analysis
+import cli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(*args):
+    result = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def test_no_heavy_imports_up_front():
+    loaded = run('-c', "import sys, cli; print(' '.join(sorted(sys.modules)))").split()
+    assert not {'pandas', 'numpy', 'matplotlib', 'seaborn', 'fpdf'} & set(loaded)
+
+
+def test_stats_leaves_the_plotting_libraries_alone():
+    loaded = run('-c', "import sys, cli; cli.main(['stats', '--json']); print(' '.join(sorted(sys.modules)))")
+    assert not {'matplotlib', 'seaborn', 'fpdf'} & set(loaded.splitlines()[-1].split())
+
+
+@pytest.mark.parametrize('options', [[], ['--no-data-cache'], ['--chunksize', '2000'], ['--backend', 'sqlite'],
+                                     ['--backend', 'sqlite', '--chunksize', '2000', '--no-data-cache']])
+def test_stats_agree_across_data_paths(cube, capsys, options):
+    assert cli.main(['stats', '--json'] + options) == 0
+    assert json.loads(capsys.readouterr().out) == cli.compute_stats(cube)
+
+
+def test_headline_numbers(cube, plain):
+    stats = cli.compute_stats(cube)
+    licensed = plain[plain['is_licensed']]
+    assert stats['licensed_percentage'] == int(len(licensed) / len(plain) * 100)
+    assert stats['star_wars_peak_year'] == licensed[licensed['parent_theme'] == 'Star Wars'].groupby('year').size().idxmax()
+    assert [row['parent_theme'] for row in stats['top_themes']] == \
+        plain.groupby('parent_theme')['set_num'].count().sort_values(ascending=False, kind='stable').index[:5].tolist()
+    assert analysis.calc_licensed_percentage(cube)[1] == stats['licensed_percentage']
@@ -0,0 +1,30 @@
+# The dictionary-encoded catalog against the plain pandas merge it replaces
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from compact import compact_frame, join_themes, narrow
+
+
+def test_same_rows_and_values_as_the_plain_merge(merged, plain):
+    assert list(merged.columns) == list(plain.columns)
+    assert_frame_equal(merged, plain, check_dtype=False, check_categorical=False)
+
+
+def test_smaller_than_the_plain_merge(merged, plain):
+    assert merged.memory_usage(deep=True).sum() < plain.memory_usage(deep=True).sum() / 2
+    assert isinstance(merged['parent_theme'].dtype, pd.CategoricalDtype)
+
+
+def test_join_drops_sets_of_unknown_themes(sets, themes, plain):
+    known = themes[themes['name'] != 'Star Wars']
+    joined = join_themes(sets, known)
+    expected = sets.merge(known, how='inner', left_on='parent_theme', right_on='name', suffixes=('_ls', '_pt'))
+    assert_frame_equal(joined, compact_frame(expected), check_categorical=False) # Unused themes stay categories
+    assert len(joined) == len(plain) - (plain['parent_theme'] == 'Star Wars').sum()
+
+
+def test_narrowing_is_exact():
+    assert narrow(pd.Series([1.0, None, 3.0])).dtype == 'float32'
+    assert narrow(pd.Series([0.5, 2.0])).dtype == 'float64' # Not whole numbers
+    assert narrow(pd.Series([2.0 ** 25])).dtype == 'float64' # Beyond float32's exact integers
+    assert narrow(pd.Series([1990, 2017])).dtype == 'int16'
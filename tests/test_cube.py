@@ -0,0 +1,73 @@
+# The calc_* answers from the aggregate cube against the original row-scanning pandas formulas
+import pytest
+from pandas.testing import assert_frame_equal
+
+import analysis
+
+
+def same(result, expected):
+    assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False,
+                       check_categorical=False)
+
+
+def top_counts(frame, k):
+    # Ties in key order, as the cube's top() keeps them
+    return frame.groupby('parent_theme')['set_num'].count().sort_values(ascending=False, kind='stable').head(k)
+
+
+@pytest.mark.parametrize('source', ['merged', 'cube'])
+def test_cube_and_rows_give_the_same_answers(request, source, plain):
+    data = request.getfixturevalue(source)
+
+    same(analysis.calc_top_themes_by_set_count(data), top_counts(plain, 5).reset_index())
+    same(analysis.calc_licensed_highest_sets(data), top_counts(plain[plain['is_licensed']], 10).reset_index())
+
+    counts, percent = analysis.calc_licensed_percentage(data)
+    assert counts == plain['is_licensed'].value_counts().to_list()
+    assert percent == int(plain['is_licensed'].sum() / len(plain) * 100)
+
+    licensed = plain[plain['is_licensed']]
+    star_wars = licensed[licensed['parent_theme'] == 'Star Wars']
+    the_force, star_wars_cube = analysis.calc_star_wars_percentage(data)
+    assert the_force == round(len(star_wars) / len(licensed) * 100, 2)
+    assert analysis.calc_peak_star_wars_year(star_wars_cube) == star_wars.groupby('year').size().idxmax()
+
+
+def test_year_and_theme_breakdowns(cube, plain):
+    top5 = top_counts(plain, 5)
+    expected = (plain[plain['parent_theme'].isin(top5.index)].groupby(['parent_theme', 'year'])['set_num'].count()
+                .reset_index().sort_values(by=['year', 'set_num'], ascending=[True, False]))
+    expected['theme_count'] = expected['parent_theme'].map(top5)
+    same(analysis.calc_set_count_for_top_themes(cube), expected)
+
+    expected = plain.groupby(['year', 'is_licensed'])['set_num'].count().reset_index().pivot(
+        index='year', columns='is_licensed', values='set_num')
+    expected.columns = ['Non-Licensed', 'Licensed']
+    assert_frame_equal(analysis.calc_licensed_non_licensed_sets(cube), expected, check_dtype=False, check_index_type=False)
+
+    top3 = plain['parent_theme'].value_counts().head(3).index
+    expected = (plain[plain['parent_theme'].isin(top3)].groupby(['parent_theme', 'theme_name'])['set_num'].count()
+                .reset_index(name='set_count'))
+    same(analysis.calc_subthemes_top_3_parent_themes(cube), expected)
+
+    highest, per_year = analysis.calc_top_new_theme_year(cube)
+    expected = plain.groupby('year')['parent_theme'].nunique().reset_index(name='new_themes')
+    same(per_year, expected)
+    assert highest['new_themes'].item() == expected['new_themes'].max()
+    assert highest['year'].item() in expected.loc[expected['new_themes'] == expected['new_themes'].max(), 'year'].values
+
+
+def test_part_count_means(cube, plain):
+    top5 = plain['parent_theme'].value_counts().head(5).index
+    expected = plain[plain['parent_theme'].isin(top5)].groupby(['year', 'parent_theme'])['num_parts'].mean().reset_index()
+    same(analysis.calc_set_compexity_top_themes(cube), expected)
+
+    expected = plain.groupby('parent_theme').agg(total_sets=('set_num', 'count'), avg_parts=('num_parts', 'mean')).reset_index()
+    same(analysis.calc_theme_set_complexity_corr(cube), expected)
+
+
+
+def test_filtered_selection_keeps_both_licence_columns(cube):
+    trend = analysis.calc_licensed_non_licensed_sets(cube.where(is_licensed=False))
+    assert list(trend.columns) == ['Non-Licensed', 'Licensed']
+    assert (trend['Licensed'] == 0).all()
@@ -0,0 +1,39 @@
+# The binned FFT density against scipy's exact gaussian_kde, which sns.histplot(kde=True) draws
+import numpy as np
+import pytest
+
+import analysis
+from density import binned_kde, scott_bandwidth, size_distribution
+
+stats = pytest.importorskip('scipy.stats')
+
+
+def test_distribution_matches_histplot_inputs(merged, plain):
+    sizes = plain['num_parts'].dropna().to_numpy()
+    distribution = analysis.calc_distribution_set_sizes(merged)
+
+    counts, edges = np.histogram(sizes, bins=50)
+    np.testing.assert_array_equal(distribution.counts, counts)
+    np.testing.assert_allclose(distribution.edges, edges)
+    assert distribution.xmax == plain['num_parts'].quantile(0.95)
+
+    exact = stats.gaussian_kde(sizes)(distribution.grid) * len(sizes) * (edges[1] - edges[0])
+    np.testing.assert_allclose(distribution.curve, exact, rtol=0, atol=1e-3 * exact.max())
+
+
+def test_weighted_values_equal_repeated_values():
+    rng = np.random.default_rng(0)
+    values = rng.integers(1, 500, 300).astype(float)
+    weights = rng.integers(1, 20, 300).astype(float)
+    repeated = np.repeat(values, weights.astype(int))
+
+    assert scott_bandwidth(values, weights) == pytest.approx(stats.gaussian_kde(repeated).factor * repeated.std(ddof=1))
+    grid = np.linspace(values.min(), values.max(), 200)
+    exact = stats.gaussian_kde(repeated)(grid)
+    np.testing.assert_allclose(binned_kde(values, weights, grid, scott_bandwidth(values, weights)), exact,
+                               rtol=0, atol=1e-3 * exact.max())
+
+
+def test_no_curve_without_spread():
+    assert size_distribution([12.0, 12.0, 12.0]).curve is None
+    assert size_distribution([5.0]).curve is None
@@ -0,0 +1,92 @@
+# Batches applied to the incremental state against a full rebuild of the catalog they produce
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import analysis
+from incremental import CatalogState
+from streaming import count_parts
+
+
+def replay(rows, batch):
+    """The catalog rows after a batch, the slow way: a set already present has its last row replaced."""
+    records = rows.to_dict('records')
+    positions = {}
+    for i, row in enumerate(records):
+        positions.setdefault(row['set_num'], []).append(i)
+    for row in batch.to_dict('records'):
+        if not pd.isna(row['set_num']) and positions.get(row['set_num']):
+            records[positions[row['set_num']].pop()] = None
+        positions.setdefault(row['set_num'], []).append(len(records))
+        records.append(row)
+    return pd.DataFrame([row for row in records if row is not None], columns=rows.columns)
+
+
+def assert_matches(state, rows, themes):
+    merged = analysis.merge_data(rows, themes)
+    expected = analysis.build_cube(merged).frame
+    assert_frame_equal(state.cube().frame, expected.astype({'year': 'int64'}), check_dtype=False)
+    assert_frame_equal(state.parts(), count_parts(merged), check_dtype=False)
+    first = merged.groupby('parent_theme', observed=True)['year'].min()
+    assert state.first_seen_years().to_dict() == first.to_dict()
+
+
+@pytest.fixture
+def base(tmp_path, sets):
+    path = tmp_path / 'sets.csv'
+    sets.iloc[:11000].to_csv(path, index=False)
+    return str(path)
+
+
+def test_apply_equals_a_full_rebuild(tmp_path, base, sets, themes):
+    rows = sets.iloc[:11000]
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    assert_matches(state, rows, themes)
+
+    new_and_corrected = pd.concat([sets.iloc[11000:11500], sets.iloc[:50].assign(num_parts=7.0)])
+    state.apply(new_and_corrected)
+    rows = replay(rows, new_and_corrected)
+    assert_matches(state, rows, themes)
+
+    # Saved and loaded again, then moved to another year and parent theme
+    state.save(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    assert_matches(state, rows, themes)
+    moved = pd.concat([sets.iloc[11500:], sets.iloc[100:120].assign(year=2001, parent_theme='Technic')])
+    state.apply(moved)
+    assert_matches(state, replay(rows, moved), themes)
+
+
+def test_only_affected_sections_go_stale(tmp_path, base, sets):
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    corrected = sets.iloc[:10].assign(num_parts=sets['num_parts'].iloc[:10] + 1)
+    stale = state.apply(corrected.dropna(subset=['set_num']))
+    assert {'size_distribution', 'size_boxplot', 'complexity'} <= stale
+    assert not stale & {'top_themes', 'licensed_percentage', 'new_themes'}
+
+    # Applying the same rows again changes nothing
+    state.mark_fresh()
+    assert state.apply(corrected.dropna(subset=['set_num'])) == set()
+
+
+def test_rebuilt_when_the_source_changes(tmp_path, base, sets, themes):
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    state.apply(sets.iloc[11000:11100])
+    state.save(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+
+    sets.iloc[:5000].to_csv(base, index=False)
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    assert_matches(state, sets.iloc[:5000], themes)
+    assert state.stale == set()
+
+
+def test_rebuilt_when_saved_in_another_layout(tmp_path, base, sets, themes):
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    state.apply(sets.iloc[11000:11100])
+    state.save(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    meta = tmp_path / 'state' / 'meta.json'
+    meta.write_text(meta.read_text().replace('"format": 2, ', ''))
+
+    state = CatalogState.load(str(tmp_path / 'state'), base, analysis.THEMES_CSV)
+    assert_matches(state, sets.iloc[:11000], themes)
+    assert state._current('no-such-set') is None
@@ -0,0 +1,61 @@
+# Partial top-k selection and leaderboards against full sorts of the merged rows
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis
+from leaderboard import top_k, top_series
+
+
+@pytest.mark.parametrize('k', [0, 1, 5, 37, 100, None])
+def test_top_k_equals_a_stable_sort(k):
+    values = np.random.default_rng(3).integers(0, 20, 100) # Plenty of ties
+    expected = np.argsort(-values, kind='stable')[:k]
+    np.testing.assert_array_equal(top_k(values, k), expected)
+
+
+def test_top_series_equals_sort_values(plain):
+    counts = plain.groupby('theme_name')['set_num'].count()
+    expected = counts.sort_values(ascending=False, kind='stable').head(15)
+    pd.testing.assert_series_equal(top_series(counts, 15), expected)
+
+
+def brute_force(plain, level, year, cumulative):
+    keys = ['parent_theme'] if level == 'parent_theme' else ['parent_theme', 'theme_name']
+    rows = plain[plain['year'] <= year] if cumulative else plain[plain['year'] == year]
+    counts = rows.groupby(keys)['set_num'].count()
+    return counts[counts > 0].sort_values(ascending=False, kind='stable')
+
+
+@pytest.mark.parametrize('level', ['parent_theme', 'theme_name'])
+@pytest.mark.parametrize('cumulative', [True, False])
+@pytest.mark.parametrize('year', [1960, 1999, 2017])
+def test_top_and_ranks(cube, plain, level, cumulative, year):
+    board = analysis.build_leaderboard(cube, level)
+    expected = brute_force(plain, level, year, cumulative)
+
+    top = board.top(10, year, cumulative)
+    keys = list(top.columns[:-2])
+    assert list(top.set_index(keys).index) == list(expected.index[:10])
+    assert top['sets'].tolist() == expected.head(10).tolist()
+    assert top['rank'].tolist() == list(range(1, len(top) + 1))
+
+    table = board.rank_table(cumulative).loc[year]
+    ranked = table.dropna().sort_values()
+    assert list(ranked.index) == list(expected.index)
+    assert table.isna().sum() == len(board.entries) - len(expected)
+
+    leader = expected.index[0]
+    assert board.rank(leader, cumulative).loc[year] == 1
+    assert board.rank(expected.index[-1], cumulative).loc[year] == len(expected)
+
+
+def test_unranked_and_unknown_entries(cube):
+    board = analysis.build_leaderboard(cube)
+    ranks = board.rank('Star Wars')
+    assert ranks.dtype == 'Int64'
+    assert ranks.loc[:1998].isna().all() and ranks.loc[1999] >= 1
+    with pytest.raises(KeyError):
+        board.rank('No Such Theme')
+    with pytest.raises(ValueError):
+        board.top(5, year=1800)
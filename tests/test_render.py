@@ -0,0 +1,48 @@
+# Chart rendering: the process pool and the image cache give the bytes a serial, uncached render gives
+import io
+
+import pytest
+
+import analysis
+from render import ChartSpec, chart_key, default_workers, render_charts
+
+
+@pytest.fixture(scope='module')
+def specs(cube):
+    return [ChartSpec('plot_top_themes', 'top_themes.png', (analysis.calc_top_themes_by_set_count(cube),)),
+            ChartSpec('plot_licensed_non_licensed_sets', 'licensed_trend.png',
+                      (analysis.calc_licensed_non_licensed_sets(cube),))]
+
+
+def test_pool_and_cache_reproduce_a_serial_render(tmp_path, specs):
+    serial, summary = render_charts(specs, workers=1, use_cache=False, profile='screen')
+    assert summary['hits'] == []
+    pooled, summary = render_charts(specs, workers=2, cache_dir=tmp_path, profile='screen')
+    assert pooled == serial and summary['misses'] == ['top_themes.png', 'licensed_trend.png']
+    cached, summary = render_charts(specs, workers=1, cache_dir=tmp_path, profile='screen')
+    assert cached == serial and summary == {'hits': ['top_themes.png', 'licensed_trend.png'], 'misses': []}
+
+
+def test_profiles_encode_valid_pngs(specs):
+    from PIL import Image
+
+    (email,), _ = render_charts(specs[:1], use_cache=False, profile='email')
+    (printed,), _ = render_charts(specs[:1], use_cache=False, profile='print')
+    assert len(email) < len(printed)
+    small, large = Image.open(io.BytesIO(email)), Image.open(io.BytesIO(printed))
+    assert small.mode == 'P' and large.mode == 'RGB'
+    assert large.size[0] == pytest.approx(small.size[0] * 300 / 72, rel=0.05)
+
+
+def test_chart_key_follows_the_data(cube, specs):
+    other = ChartSpec('plot_top_themes', 'top_themes.png', (analysis.calc_top_themes_by_set_count(cube).head(4),))
+    assert chart_key(specs[0], 'screen') == chart_key(specs[0], 'screen')
+    assert chart_key(specs[0], 'screen') != chart_key(other, 'screen')
+    assert chart_key(specs[0], 'screen') != chart_key(specs[0], 'email')
+
+
+@pytest.mark.parametrize('value', ['abc', '-2', '1.5'])
+def test_invalid_worker_count_names_the_variable(monkeypatch, value):
+    monkeypatch.setenv('LEGO_RENDER_WORKERS', value)
+    with pytest.raises(ValueError, match='LEGO_RENDER_WORKERS'):
+        default_workers()
@@ -0,0 +1,56 @@
+# Report assembly from the aggregates of the streaming and incremental modes, and its timing trace
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import analysis
+import report
+from incremental import CatalogState
+from profiling import Tracer, trace_path
+
+SECTIONS = ['top_themes', 'licensed_trend', 'new_themes', 'size_distribution']
+
+
+def text_blocks(sections):
+    return [(title, [block for block in blocks if block[0] != 'chart']) for title, blocks in sections]
+
+
+def assert_same_charts(sections, expected):
+    for spec, other in zip(report.chart_specs(sections), report.chart_specs(expected), strict=True):
+        assert spec.plot == other.plot
+        if isinstance(spec.args[0], pd.DataFrame):
+            # The state builds its frames with other integer dtypes than the rows'
+            assert_frame_equal(spec.args[0], other.args[0], check_dtype=False, check_index_type=False)
+        else: # Set-size distributions; the axis limit is a sketch estimate of whichever rows it was fed
+            for a, b in zip(spec.args[0][:-1], other.args[0][:-1]):
+                np.testing.assert_allclose(a, b, rtol=1e-9, atol=1e-9 * np.abs(b).max())
+            assert spec.args[0].xmax == pytest.approx(other.args[0].xmax, rel=1e-3)
+
+
+@pytest.fixture(scope='module')
+def from_rows(merged, cube):
+    return report.build_sections(merged, cube, only=SECTIONS)
+
+
+def test_incremental_state_gives_the_same_sections(tmp_path, from_rows):
+    state = CatalogState.load(str(tmp_path / 'state'), analysis.SETS_CSV, analysis.THEMES_CSV)
+    sections = report.build_sections(state.parts(), state.cube(), only=SECTIONS)
+    assert text_blocks(sections) == text_blocks(from_rows)
+    assert_same_charts(sections, from_rows)
+
+
+def test_pdf_and_trace(tmp_path, capsys):
+    output = str(tmp_path / 'report.pdf')
+    tracer = Tracer()
+    report.main(workers=1, output_pdf=output, tracer=tracer, only=['top_themes', 'size_distribution'],
+                chunksize=5000)
+    with open(output, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+    with open(trace_path(output)) as f:
+        names = {event['name'] for event in json.load(f)['traceEvents']}
+    assert {'stream_aggregates', 'calc_top_themes_by_set_count', 'calc_distribution_set_sizes', 'pdf.output'} <= names
+    assert 'calc_licensed_percentage' not in names # Sections not asked for are not computed
+    assert 'Report saved as' in capsys.readouterr().out
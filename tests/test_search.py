@@ -0,0 +1,84 @@
+# The n-gram name index against a scan of every name, and added rows against a fresh build
+import numpy as np
+import pandas as pd
+import pytest
+
+from search import NameIndex, cached_index, index_frame, ngrams
+
+
+@pytest.fixture(scope='module')
+def index(merged):
+    return NameIndex.build(merged)
+
+
+def scan(plain, query, min_score=0.5):
+    """Score of every row's name for query, the slow way; rows scoring below min_score are dropped."""
+    grams = ngrams(query)
+    names = plain['name_ls'].fillna('')
+    scores = {}
+    for name in names.unique():
+        shared = len(grams & ngrams(name))
+        if shared:
+            scores[name] = (shared / len(grams) + 2 * shared / (len(grams) + len(ngrams(name)))) / 2
+    found = plain.assign(score=names.map(scores)).dropna(subset=['score'])
+    return found[found['score'] >= min_score]
+
+
+@pytest.mark.parametrize('query', ['millennium falcon', 'fire station', 'Hogwarts Castle', 'batmobile'])
+def test_search_finds_what_a_scan_finds(index, plain, query):
+    result = index.search(query, limit=len(plain))
+    expected = scan(plain, query)
+    assert len(result) == len(expected)
+    assert sorted(zip(result['name'], result['score'])) == pytest.approx(sorted(zip(expected['name_ls'], expected['score'])))
+    assert (np.diff(result['score']) <= 0).all()
+
+    top = index.search(query, limit=5)
+    assert top['score'].tolist() == pytest.approx(result['score'].head(5).tolist())
+
+
+def test_set_number_prefix(index, plain):
+    result = index.search('10179')
+    assert result['set_num'].iloc[0].startswith('10179')
+    assert index.find('no-such-set') is None
+
+
+def batch_of(merged):
+    falcons = pd.DataFrame([{'set_num': f'zz-{i}', 'name': 'Millennium Falcon', 'year': 2020, 'num_parts': parts,
+                             'theme_name': 'Star Wars', 'parent_theme': 'Star Wars'}
+                            for i, parts in enumerate([5.0, 9000.0, np.nan, 300.0, 1.0])])
+    corrected = index_frame(merged.iloc[:3]).assign(num_parts=77.0)
+    return pd.concat([falcons, corrected], ignore_index=True)
+
+
+def test_added_rows_equal_a_fresh_build(merged):
+    index = NameIndex.build(merged)
+    batch = batch_of(merged)
+    index.add(batch)
+    fresh = NameIndex.build(pd.concat([index_frame(merged).iloc[3:], batch], ignore_index=True))
+
+    assert len(index) == len(fresh)
+    for query in ['millennium falcon', 'zz-']:
+        a, b = index.search(query, 8), fresh.search(query, 8)
+        assert a['set_num'].tolist() == b['set_num'].tolist()
+        assert a['score'].tolist() == pytest.approx(b['score'].tolist())
+    a, b = index.similar('zz-3', 10), fresh.similar('zz-3', 10)
+    assert a['set_num'].tolist() == b['set_num'].tolist()
+    assert index.find(merged['set_num'].iloc[0]) is not None
+
+
+def test_saved_index_keeps_added_rows(tmp_path, merged):
+    source = tmp_path / 'sets.csv'
+    source.write_text('v1')
+    index = cached_index('names', [str(source)], lambda: NameIndex.build(merged), tmp_path)
+    index.add(batch_of(merged))
+    index.save(tmp_path / 'names')
+
+    def fail():
+        raise AssertionError('rebuilt an unchanged index')
+
+    again = cached_index('names', [str(source)], fail, tmp_path)
+    assert len(again) == len(index) and again.find('zz-1') is not None
+    assert again.search('millennium falcon', 8)['set_num'].tolist() == index.search('millennium falcon', 8)['set_num'].tolist()
+
+    source.write_text('v2')
+    assert cached_index('names', [str(source)], lambda: NameIndex.build(merged), tmp_path).find('zz-1') is None
@@ -0,0 +1,52 @@
+# The section graph computes what a serial pass over every calc_* function computes
+import threading
+import tracemalloc
+
+import pytest
+
+from cache import data_fingerprint
+from profiling import Tracer
+from sections import NODES, SECTIONS, compute, required_nodes, select_sections
+
+
+def fingerprints(values):
+    # Sketches are objects without a data fingerprint; their quantiles are compared through size_comparison
+    return {name: data_fingerprint(value).hexdigest() for name, value in values.items() if name != 'size_sketches'}
+
+
+def test_parallel_equals_serial(merged):
+    targets = [n for s in SECTIONS for n in s.needs]
+    serial = compute(targets, {'merged': merged})
+    parallel = compute(targets, {'merged': merged}, workers=4)
+    assert set(serial) == set(NODES)
+    assert fingerprints(parallel) == fingerprints(serial)
+    assert (parallel['size_sketches'].overall.means == serial['size_sketches'].overall.means).all()
+
+
+def test_spans_from_worker_threads(merged):
+    tracer = Tracer(memory=True)
+    try:
+        compute([n for s in SECTIONS for n in s.needs], {'merged': merged}, workers=4, tracer=tracer)
+        serial = Tracer(memory=True)
+        compute(['licensed_themes'], {'merged': merged}, tracer=serial)
+    finally:
+        tracemalloc.stop()
+    trace = tracer.chrome_trace()['traceEvents']
+    assert len(trace) == len(NODES) - 1
+    assert threading.get_ident() not in {e['tid'] for e in trace}
+    # Spans that overlapped ones in other threads have no allocation peak; serial ones all do
+    assert all('alloc_peak_bytes' in e['args'] for e in serial.chrome_trace()['traceEvents'])
+
+
+def test_only_the_needed_nodes_run(merged):
+    values = compute(['licensed_themes'], {'merged': merged})
+    assert set(values) == {'merged', 'cube', 'licensed', 'licensed_themes'}
+    assert required_nodes(['star_wars_peak'], ['cube']) == ['licensed', 'star_wars', 'star_wars_peak']
+
+
+def test_selection_by_key_and_tag():
+    assert [s.key for s in select_sections(['licensed'])] == [s.key for s in SECTIONS if 'licensed' in s.tags]
+    assert [s.key for s in select_sections(['new_themes'])] == ['new_themes']
+    assert select_sections(None) == list(SECTIONS)
+    with pytest.raises(ValueError):
+        select_sections(['no_such_section'])
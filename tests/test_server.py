@@ -0,0 +1,82 @@
+# Query service answers against the calc_* functions run on the same rows filtered with pandas
+import json
+
+import pytest
+
+import analysis
+import server
+from server import Catalog, QueryService, to_jsonable
+
+
+@pytest.fixture(scope='module')
+def service():
+    return QueryService(Catalog(analysis.SETS_CSV, analysis.THEMES_CSV))
+
+
+def answer(body):
+    return json.loads(body)['result']
+
+
+def expected(name, rows, **kwargs):
+    return json.loads(json.dumps(to_jsonable(getattr(analysis, name)(rows, **kwargs))))
+
+
+@pytest.mark.parametrize('query, keep', [
+    ('', lambda m: m),
+    ('year_from=1990&year_to=1999', lambda m: m[m['year'].between(1990, 1999)]),
+    ('theme=Town,Technic', lambda m: m[m['parent_theme'].isin(['Town', 'Technic'])]),
+    ('theme=Star%20Wars&year_from=2010', lambda m: m[(m['parent_theme'] == 'Star Wars') & (m['year'] >= 2010)]),
+])
+def test_calc_answers_equal_pandas_on_the_selection(service, plain, query, keep):
+    rows = keep(plain)
+    for name in ['calc_top_themes_by_set_count', 'calc_licensed_percentage', 'calc_theme_set_complexity_corr',
+                 'calc_top_new_theme_year', 'calc_set_compexity_top_themes']:
+        assert answer(service.calc(name, query)) == expected(name, rows), name
+    assert answer(service.calc('calc_licensed_highest_sets', query + '&top=3')) == \
+        expected('calc_licensed_highest_sets', rows, top=3)
+
+
+@pytest.mark.parametrize('name, query', [
+    ('calc_top_themes_by_set_count', 'year_from=1800&year_to=1900'), # Nothing selected
+    ('calc_top_themes_by_set_count', 'theme=No%20Such%20Theme'),
+    ('calc_star_wars_percentage', 'theme=Town'), # No licensed sets
+    ('calc_peak_star_wars_year', 'theme=Harry%20Potter'),
+    ('calc_top_themes_by_set_count', 'top=0'),
+    ('calc_top_themes_by_set_count', 'year_from=abc'),
+    ('calc_licensed_percentage', 'top=3'), # Takes no top
+    ('calc_top_themes_by_set_count', 'colour=red'),
+])
+def test_bad_queries_raise_value_error(service, name, query):
+    with pytest.raises(ValueError):
+        service.calc(name, query)
+
+
+def test_year_and_leaderboard_endpoints(service, plain):
+    totals = answer(service.years('totals', 'year_from=1990&year_to=1999&theme=Town'))
+    rows = plain[plain['year'].between(1990, 1999)]
+    assert totals['all'] == rows['set_num'].count()
+    assert totals['themes'] == [{'parent_theme': 'Town', 'sets': int(rows.loc[rows['parent_theme'] == 'Town', 'set_num'].count())}]
+    with pytest.raises(ValueError):
+        service.years('totals', 'year_from=1999&year_to=1990')
+
+    top = answer(service.leaderboard('top', 'top=3'))
+    counts = plain.groupby('parent_theme')['set_num'].count().sort_values(ascending=False, kind='stable')
+    assert [row['parent_theme'] for row in top] == counts.index[:3].tolist()
+    with pytest.raises(ValueError):
+        service.leaderboard('rank', 'theme=No%20Such%20Theme')
+
+
+def test_reload_on_source_change(tmp_path, sets, monkeypatch):
+    source = tmp_path / 'sets.csv'
+    sets.head(1000).to_csv(source, index=False)
+    monkeypatch.setattr(server, 'RELOAD_CHECK_INTERVAL', 0)
+    service = QueryService(Catalog(str(source), analysis.THEMES_CSV))
+    before = answer(service.calc('calc_licensed_percentage', ''))
+    resident = service.catalog.current()
+
+    sets.head(3000).to_csv(source, index=False)
+    after = service.catalog.current()
+    assert after.version == resident.version + 1
+    assert len(after.data.merged) == len(analysis.load_data(str(source), use_cache=False))
+    assert len(resident.data.merged) < len(after.data.merged) # The old Resident is left as it was
+    assert answer(service.calc('calc_licensed_percentage', '')) != before
@@ -0,0 +1,70 @@
+# Quantile sketches against exact quantiles: the rank of every estimate is within the documented bound
+import numpy as np
+import pytest
+
+import analysis
+from sketch import DEFAULT_COMPRESSION, QuantileSketch, SizeSketches
+
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def rank_error(values, estimate, q):
+    """Distance of q from the range of ranks (as fractions) estimate takes in the sorted values."""
+    values = np.sort(values)
+    lo = np.searchsorted(values, estimate, side='left') / len(values)
+    hi = np.searchsorted(values, estimate, side='right') / len(values)
+    return max(lo - q, q - hi, 0)
+
+
+def bound(q, compression=DEFAULT_COMPRESSION):
+    return 2 * np.pi * np.sqrt(q * (1 - q)) / compression
+
+
+@pytest.mark.parametrize('q', QUANTILES)
+def test_rank_error_on_the_catalog(merged, q):
+    # The bound is for distinct values: spread the integer part counts within each part
+    sizes = merged['num_parts'].dropna().to_numpy(dtype=float, copy=True)
+    sizes += np.random.default_rng(1).uniform(0, 1, len(sizes))
+    assert rank_error(sizes, QuantileSketch().add(sizes).quantile(q), q) <= bound(q)
+
+
+@pytest.mark.parametrize('q', QUANTILES)
+def test_tied_part_counts_within_one_part(merged, q):
+    # With ties a centroid can straddle two part counts; the estimate stays within one part
+    sketches = analysis.calc_size_sketches(merged)
+    groups = [(merged, sketches.overall)] + [(merged[merged['is_licensed'] == flag], sketch)
+                                             for flag, sketch in sketches.groups['is_licensed'].items()]
+    for rows, sketch in groups:
+        sizes = rows['num_parts'].dropna().to_numpy(dtype=float)
+        lo, hi = np.quantile(sizes, [max(q - bound(q), 0), min(q + bound(q), 1)])
+        assert lo - 1 <= sketch.quantile(q) <= hi + 1
+
+
+def test_merged_sketches_keep_the_bound():
+    rng = np.random.default_rng(7)
+    values = rng.lognormal(5, 1.2, 200_000)
+    whole = QuantileSketch()
+    for chunk in np.array_split(values, 37):
+        whole.merge(QuantileSketch().add(chunk))
+    assert len(whole) <= DEFAULT_COMPRESSION
+    assert whole.count == len(values) and whole.min == values.min() and whole.max == values.max()
+    for q in QUANTILES:
+        assert rank_error(values, whole.quantile(q), q) <= bound(q)
+
+
+def test_group_quantiles_close_to_pandas(merged):
+    sketches = SizeSketches().add(merged)
+    estimate = sketches.quantiles('year', 0.5)
+    exact = merged.groupby('year')['num_parts'].quantile(0.5)
+    spread = merged.groupby('year')['num_parts'].agg(lambda s: s.quantile(0.75) - s.quantile(0.25))
+    assert list(estimate.index) == list(exact.index)
+    assert (np.abs(estimate - exact) <= spread / 4 + 1).all()
+
+
+def test_weighted_counts_give_the_same_sketch(merged):
+    weighted = merged.groupby(['is_licensed', 'num_parts']).size().reset_index(name='weight')
+    from_rows = QuantileSketch().add(np.repeat(weighted['num_parts'], weighted['weight']))
+    from_counts = QuantileSketch().add(weighted['num_parts'], weighted['weight'])
+    assert from_rows.count == from_counts.count
+    for q in QUANTILES:
+        assert from_counts.quantile(q) == pytest.approx(from_rows.quantile(q), abs=1)
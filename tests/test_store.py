@@ -0,0 +1,77 @@
+# Aggregate queries pushed down to SQLite against the pandas cube of the same CSVs
+import os
+
+import numpy as np
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+import analysis
+from store import open_store
+
+CALCS = ['calc_top_themes_by_set_count', 'calc_licensed_highest_sets', 'calc_set_count_for_top_themes',
+         'calc_licensed_non_licensed_sets', 'calc_subthemes_top_3_parent_themes', 'calc_set_compexity_top_themes',
+         'calc_theme_set_complexity_corr']
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    store = open_store(analysis.SETS_CSV, analysis.THEMES_CSV, cache_dir=tmp_path_factory.mktemp('store'),
+                       chunksize=3000)
+    yield store
+    store.close()
+
+
+def test_cells_equal_the_pandas_cube(store, cube):
+    assert_frame_equal(store.cube().frame, cube.frame)
+
+
+@pytest.mark.parametrize('name', CALCS)
+def test_calcs_equal_the_pandas_cube(store, cube, name):
+    fn = getattr(analysis, name)
+    assert_frame_equal(fn(store.cube()), fn(cube))
+
+
+def test_scalar_answers(store, cube):
+    assert analysis.calc_licensed_percentage(store.cube()) == analysis.calc_licensed_percentage(cube)
+    the_force, star_wars = analysis.calc_star_wars_percentage(store.cube())
+    expected_force, expected_star_wars = analysis.calc_star_wars_percentage(cube)
+    assert the_force == expected_force
+    assert analysis.calc_peak_star_wars_year(star_wars) == analysis.calc_peak_star_wars_year(expected_star_wars)
+    highest, per_year = analysis.calc_top_new_theme_year(store.cube())
+    assert_frame_equal(per_year, analysis.calc_top_new_theme_year(cube)[1])
+
+
+def test_filtered_queries(store, cube):
+    for filters in [{'is_licensed': True}, {'parent_theme': ['Town', 'Technic']}, {'year': 1999, 'is_licensed': False},
+                    {'parent_theme': []}]:
+        sql, frame = store.cube().where(**filters), cube.where(**filters)
+        assert sql.total('sets') == frame.total('sets')
+        assert_series_equal(sql.top('theme_name', 'sets', 7), frame.top('theme_name', 'sets', 7))
+        assert_frame_equal(sql.totals(['year', 'parent_theme'], ['parts_sum', 'parts_count']),
+                           frame.totals(['year', 'parent_theme'], ['parts_sum', 'parts_count']))
+
+
+def test_part_counts_give_the_same_size_statistics(store, merged):
+    parts = store.cube().part_counts()
+    assert parts['weight'].sum() == merged['num_parts'].notna().sum()
+    rows, counts = analysis.calc_size_sketches(merged), analysis.calc_size_sketches(parts)
+    for flag in (False, True):
+        assert counts.groups['is_licensed'][flag].quantile(0.5) == rows.groups['is_licensed'][flag].quantile(0.5)
+    for a, b in zip(analysis.calc_distribution_set_sizes(merged), analysis.calc_distribution_set_sizes(parts)):
+        np.testing.assert_allclose(a, b, rtol=1e-9)
+
+
+def test_reused_until_a_source_changes(tmp_path, sets):
+    source = tmp_path / 'sets.csv'
+    sets.head(500).to_csv(source, index=False)
+    first = open_store(str(source), analysis.THEMES_CSV, cache_dir=tmp_path)
+    again = open_store(str(source), analysis.THEMES_CSV, cache_dir=tmp_path)
+    assert again.path == first.path and os.path.getmtime(again.path) == os.path.getmtime(first.path)
+    assert first.cube().total() == len(analysis.load_data(str(source), use_cache=False))
+    first.close()
+    again.close()
+
+    sets.head(800).to_csv(source, index=False)
+    second = open_store(str(source), analysis.THEMES_CSV, cache_dir=tmp_path)
+    assert second.cube().total() == len(analysis.load_data(str(source), use_cache=False))
+    second.close()
@@ -0,0 +1,34 @@
+# The chunked pass against the aggregates of the fully loaded catalog
+import numpy as np
+import pytest
+from pandas.testing import assert_frame_equal
+
+import analysis
+from streaming import count_parts, stream_aggregates
+
+
+def test_chunked_aggregates_match_the_full_catalog(merged, cube, plain):
+    streamed, parts, sketches = stream_aggregates(analysis.SETS_CSV, analysis.THEMES_CSV, chunksize=1000)
+    assert_frame_equal(streamed.frame, cube.frame, check_dtype=False)
+
+    expected = plain.groupby(['is_licensed', 'num_parts']).size().reset_index(name='weight')
+    assert_frame_equal(parts, expected, check_dtype=False)
+    assert_frame_equal(count_parts(merged), expected, check_dtype=False)
+
+    assert sketches.overall.count == plain['num_parts'].notna().sum()
+    assert sketches.overall.max == plain['num_parts'].max()
+
+
+def test_part_counts_stand_in_for_the_rows(merged):
+    _, parts, _ = stream_aggregates(analysis.SETS_CSV, analysis.THEMES_CSV, chunksize=2500)
+    from_rows = analysis.calc_distribution_set_sizes(merged)
+    from_counts = analysis.calc_distribution_set_sizes(parts)
+    for a, b in zip(from_rows, from_counts):
+        np.testing.assert_allclose(a, b, rtol=1e-9, atol=1e-9 * np.abs(b).max())
+
+
+@pytest.mark.parametrize('q', [0, 0.1, 0.25, 0.5, 0.75, 0.95, 1])
+def test_weighted_quantile_matches_the_rows(plain, q):
+    parts = count_parts(plain)
+    assert analysis.weighted_quantile(parts['num_parts'], parts['weight'], q) == pytest.approx(
+        plain['num_parts'].quantile(q))
@@ -0,0 +1,46 @@
+# The synthetic catalog generator of the benchmarks keeps the shape of lego_sets.csv
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import analysis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from synth import parse_rows, synthetic_chunks, write_catalog  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    return pd.concat(synthetic_chunks(60_000, seed=5, chunk_rows=25_000), ignore_index=True)
+
+
+def test_schema_size_and_seed(sets, synthetic):
+    assert list(synthetic.columns) == list(sets.columns) and len(synthetic) == 60_000
+    again = pd.concat(synthetic_chunks(60_000, seed=5, chunk_rows=25_000), ignore_index=True)
+    pd.testing.assert_frame_equal(synthetic, again)
+    assert not synthetic['set_num'].dropna().duplicated().any()
+
+
+def test_distributions_follow_the_source(sets, synthetic):
+    for column in ['parent_theme', 'year']:
+        source = sets[column].value_counts(normalize=True)
+        drawn = synthetic[column].value_counts(normalize=True).reindex(source.index, fill_value=0)
+        assert (drawn - source).abs().max() < 0.01
+    assert synthetic['set_num'].isna().mean() == pytest.approx(sets['set_num'].isna().mean(), abs=0.005)
+    assert synthetic['num_parts'].median() == pytest.approx(sets['num_parts'].median(), rel=0.1)
+
+
+def test_written_catalog_loads_like_the_real_one(tmp_path, sets):
+    path = write_catalog(5000, seed=1, path=str(tmp_path / 'sets.csv'))
+    written = os.path.getmtime(path)
+    assert write_catalog(5000, seed=1, path=path) == path and os.path.getmtime(path) == written # Reused
+    merged = analysis.load_data(path, use_cache=False)
+    assert len(merged) == len(pd.read_csv(path).merge(pd.read_csv(analysis.THEMES_CSV), left_on='parent_theme',
+                                                      right_on='name'))
+    assert merged['year'].between(sets['year'].min(), sets['year'].max()).all()
+
+
+def test_parse_rows():
+    assert parse_rows('10k') == 10_000 and parse_rows('1.5M') == 1_500_000 and parse_rows('250') == 250
@@ -0,0 +1,61 @@
+# Prefix-sum range, rolling and growth queries against brute-force filters of the merged rows
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+import analysis
+
+RANGES = [(None, None), (1970, 1979), (2001, 2001), (1940, 1955), (2015, 2030), (2020, 2030)]
+
+
+@pytest.fixture(scope='module')
+def index(cube):
+    return analysis.build_year_index(cube)
+
+
+def rows_between(plain, first, last):
+    return plain[plain['year'].between(first if first is not None else -np.inf, last if last is not None else np.inf)]
+
+
+@pytest.mark.parametrize('first, last', RANGES)
+def test_range_totals(index, plain, first, last):
+    rows = rows_between(plain, first, last)
+    total = index.total(first, last)
+    assert isinstance(total, int) and total == rows['set_num'].count()
+    assert index.total(first, last, measure='rows') == len(rows)
+    assert index.total(first, last, measure='parts_sum') == pytest.approx(rows['num_parts'].sum())
+
+    per_theme = index.totals(first, last)
+    expected = rows.groupby('parent_theme')['set_num'].count().reindex(per_theme.index, fill_value=0)
+    assert_series_equal(per_theme, expected, check_names=False)
+    assert per_theme.dtype == np.int64
+
+    star_wars = rows[rows['parent_theme'] == 'Star Wars']
+    assert index.total(first, last, 'Star Wars', 'avg_parts') == pytest.approx(
+        star_wars['num_parts'].mean(), nan_ok=True)
+
+
+def test_per_year_rolling_and_growth(index, plain):
+    expected = (plain.groupby(['year', 'parent_theme'])['set_num'].count().unstack(fill_value=0)
+                .reindex(index=pd.Index(index.years, name='year'), columns=index.themes, fill_value=0))
+    per_year = index.per_year()
+    assert_frame_equal(per_year, expected, check_names=False, check_column_type=False)
+    assert (per_year.dtypes == np.int64).all()
+
+    rolling = expected.rolling(3, min_periods=1).mean()
+    assert_frame_equal(index.rolling(3), rolling, check_names=False, check_column_type=False)
+
+    previous = expected.shift(1)
+    growth = (expected - previous) / previous.where(previous != 0)
+    assert_frame_equal(index.growth(), growth, check_names=False, check_column_type=False)
+
+
+def test_bad_queries(index):
+    with pytest.raises(ValueError):
+        index.total(2000, 1990)
+    with pytest.raises(ValueError):
+        index.rolling(0)
+    with pytest.raises(KeyError):
+        index.total(theme='No Such Theme')
+    assert index.total(1800, 1900) == 0
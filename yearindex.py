@@ -0,0 +1,114 @@
+# Dense year x parent theme prefix sums for range and rolling queries
+import numpy as np
+import pandas as pd
+
+from cube import as_cube
+
+# Additive measures kept per (year, parent theme), as in the cube
+INDEX_MEASURES = ['rows', 'sets', 'parts_sum', 'parts_count']
+
+# Derived measure: parts_sum / parts_count over the same years
+AVG_PARTS = 'avg_parts'
+
+
+class YearIndex:
+    """Cumulative sums of the cube measures over consecutive years, for every parent theme.
+
+    cum[m][i, t] is the total of measure m for theme t over the years before
+    years[i], so the total over any range of years is the difference of two
+    entries: range queries cost O(1) per theme, whatever the range. Counts
+    are summed in int64 and only parts_sum in float64, so counts stay exact
+    integers. A second set of arrays holds the same sums over all themes, so
+    catalog-wide queries are O(1) too. Rolling windows and year-over-year
+    growth are computed for all years and themes at once from the same arrays.
+    """
+
+    def __init__(self, years, themes, licensed, cum):
+        self.years = years        # consecutive years, first to last
+        self.themes = themes      # pd.Index of parent themes
+        self.licensed = licensed  # bool per theme
+        self.cum = cum            # measure -> (len(years) + 1, len(themes)) prefix sums
+        self.total_cum = {measure: values.sum(axis=1) for measure, values in cum.items()}
+
+    @classmethod
+    def from_cube(cls, data):
+        """Build the index from a Cube (or merged rows) in one pass over its cells."""
+        frame = as_cube(data).frame.dropna(subset=['year', 'parent_theme'])
+        if frame.empty:
+            raise ValueError("cannot index an empty catalog")
+        years = np.arange(int(frame['year'].min()), int(frame['year'].max()) + 1)
+        themes = pd.Index(sorted(frame['parent_theme'].unique()), name='parent_theme')
+        licensed = frame.groupby('parent_theme')['is_licensed'].first().reindex(themes).to_numpy(dtype=bool)
+
+        year_pos = frame['year'].to_numpy(dtype=np.int64) - years[0]
+        theme_pos = themes.get_indexer(frame['parent_theme'])
+        cum = {}
+        for measure in INDEX_MEASURES:
+            dtype = np.float64 if measure == 'parts_sum' else np.int64
+            dense = np.zeros((len(years), len(themes)), dtype=dtype)
+            np.add.at(dense, (year_pos, theme_pos), frame[measure].to_numpy(dtype=dtype))
+            cum[measure] = np.concatenate([np.zeros((1, len(themes)), dtype=dtype), np.cumsum(dense, axis=0)])
+        return cls(years, themes, licensed, cum)
+
+    def _bounds(self, first, last):
+        """Prefix positions of the (inclusive, clipped) year range; raises ValueError when first > last."""
+        if first is not None and last is not None and first > last:
+            raise ValueError(f"the year range {first}..{last} is reversed")
+        lo = 0 if first is None else int(np.clip(first - self.years[0], 0, len(self.years)))
+        hi = len(self.years) if last is None else int(np.clip(last - self.years[0] + 1, 0, len(self.years)))
+        return lo, max(lo, hi)
+
+    def _measure(self, cum, measure, lo, hi):
+        """A measure (or avg_parts) over the prefix positions lo..hi of cum (a dict of prefix arrays)."""
+        if measure == AVG_PARTS:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (cum['parts_sum'][hi] - cum['parts_sum'][lo]) / (cum['parts_count'][hi] - cum['parts_count'][lo])
+        return cum[measure][hi] - cum[measure][lo]
+
+    def total(self, first=None, last=None, theme=None, measure='sets'):
+        """A measure (or avg_parts) over the years first..last for one theme, or the whole catalog.
+
+        Counts are ints; parts_sum and avg_parts are floats."""
+        lo, hi = self._bounds(first, last)
+        if theme is None:
+            cum = self.total_cum
+        else:
+            if theme not in self.themes:
+                raise KeyError(theme)
+            column = self.themes.get_loc(theme)
+            cum = {m: values[:, column] for m, values in self.cum.items()}
+        return self._measure(cum, measure, lo, hi).item()
+
+    def totals(self, first=None, last=None, measure='sets'):
+        """A measure (or avg_parts) over the years first..last for every theme, as a Series."""
+        lo, hi = self._bounds(first, last)
+        return pd.Series(self._measure(self.cum, measure, lo, hi), index=self.themes, name=measure)
+
+    def per_year(self, measure='sets'):
+        """A measure (or avg_parts) per year (rows) and theme (columns); counts stay ints."""
+        if measure != AVG_PARTS:
+            values = np.diff(self.cum[measure], axis=0)
+            return pd.DataFrame(values, index=pd.Index(self.years, name='year'), columns=self.themes)
+        return self.rolling(1, measure)
+
+    def rolling(self, window, measure='sets'):
+        """Trailing mean of a measure over window years, per year and theme.
+
+        Additive measures are averaged per year; avg_parts is the part total
+        over the window divided by its number of part counts. Years closer
+        than window to the first indexed year average over the years there are.
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        hi = np.arange(1, len(self.years) + 1)
+        lo = np.maximum(hi - window, 0)
+        values = self._measure(self.cum, measure, lo, hi)
+        if measure != AVG_PARTS:
+            values = values / (hi - lo)[:, None]
+        return pd.DataFrame(values, index=pd.Index(self.years, name='year'), columns=self.themes)
+
+    def growth(self, measure='sets', periods=1):
+        """Relative change of a measure against periods years earlier, per year and theme (NaN from zero)."""
+        values = self.per_year(measure)
+        previous = values.shift(periods)
+        return (values - previous) / previous.where(previous != 0)